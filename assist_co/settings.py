@@ -45,6 +45,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'assist_co_server.middleware.PerformanceMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -54,6 +55,12 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Per view request metrics, see assist_co_server/middleware.py
+PERF_METRICS = {
+    'SAMPLE_RATE': float(os.environ.get('PERF_SAMPLE_RATE', '1.0')),
+    'SERVER_TIMING': DEBUG,
+}
+
 ROOT_URLCONF = 'assist_co.urls'
 
 TEMPLATES = [
@@ -76,10 +83,99 @@ REST_FRAMEWORK = {
     'PAGE_SIZE': 20,
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
+        'assist_co_server.authentication.CachingTokenAuthentication',
+    ),
+    'DEFAULT_THROTTLE_CLASSES': (
+        'assist_co_server.throttling.WriteThrottle',
+    ),
+    # orjson when installed, see assist_co_server/renderers.py
+    'DEFAULT_RENDERER_CLASSES': (
+        'assist_co_server.renderers.JSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+    'DEFAULT_PARSER_CLASSES': (
+        'assist_co_server.renderers.JSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
     ),
 }
 
+# Request rate limits, see assist_co_server/throttling.py
+THROTTLES = {
+    'RATES': {
+        'login': '10/min',
+        'signup': '20/hour',
+        'write': '300/min',
+    },
+    'MAX_KEYS': 100000,
+    'CACHE_ALIAS': None,
+}
+
+# Caches
+# https://docs.djangoproject.com/en/1.10/topics/cache/
+
+# The responses cache is configured from the environment:
+#   RESPONSE_CACHE_BACKEND      locmem (default), file, or db to share it between processes
+#   RESPONSE_CACHE_LOCATION     directory for file, table for db (`python manage.py createcachetable`)
+#   RESPONSE_CACHE_MAX_ENTRIES  pages and versions kept before culling
+
+RESPONSE_CACHE_BACKENDS = {
+    'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+    'file': 'django.core.cache.backends.filebased.FileBasedCache',
+    'db': 'django.core.cache.backends.db.DatabaseCache',
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'responses': {
+        'BACKEND': RESPONSE_CACHE_BACKENDS[os.environ.get('RESPONSE_CACHE_BACKEND', 'locmem')],
+        'LOCATION': os.environ.get('RESPONSE_CACHE_LOCATION', 'responses'),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', '2000')),
+        },
+    },
+}
+
+# Rendered client task lists, see assist_co_server/response_cache.py
+RESPONSE_CACHE = {
+    'CACHE_ALIAS': 'responses',
+    'TTL': 300,
+    'MAX_BODY_BYTES': 256 * 1024,
+}
+
+# Cache for token lookups, see assist_co_server/authentication.py
+TOKEN_AUTH_CACHE = {
+    'MAX_SIZE': 10000,
+    'TTL': 60,
+    'CACHE_ALIAS': None,
+}
+
+# /api/clients/<id>/changes, see assist_co_server/sync.py
+SYNC = {
+    'SETTLE_SECONDS': 2,
+    'PAGE_SIZE': 100,
+    'MAX_PAGE_SIZE': 500,
+}
+
+# Assigning new tasks to assistants, see assist_co_server/assignment.py
+ASSIGNMENT = {
+    'PRIMARY_MAX_LOAD': 20,
+    'REFRESH_SECONDS': 60,
+}
+
+# Background jobs, see assist_co_server/jobs.py
+# With JOBS_BACKEND=db run `python manage.py run_jobs` next to the server
+JOBS = {
+    'BACKEND': os.environ.get('JOBS_BACKEND', 'local'),
+    'WORKERS': int(os.environ.get('JOBS_WORKERS', '2')),
+    'MAX_ATTEMPTS': 5,
+    'BACKOFF_SECONDS': 2,
+    'MAX_BACKOFF_SECONDS': 600,
+    'TIMEOUT_SECONDS': 600,
+}
+
 if DEBUG:
     REST_FRAMEWORK['DEFAULT_PERMISSION_CLASSES'] = ('rest_framework.permissions.AllowAny',)
 else:
@@ -91,11 +187,51 @@ WSGI_APPLICATION = 'assist_co.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/1.10/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+# Configured from the environment:
+#   DB_ENGINE           sqlite (default) or postgresql
+#   DB_NAME             database name, or file path for sqlite
+#   DB_USER, DB_PASSWORD, DB_HOST, DB_PORT
+#   DB_CONN_MAX_AGE     seconds to keep a connection open between requests
+#   DB_HEALTH_CHECKS    ping persistent connections before each request
+#   DB_BUSY_TIMEOUT     seconds a sqlite writer waits for the lock
+
+DB_ENGINE = os.environ.get('DB_ENGINE', 'sqlite')
+
+if DB_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DB_NAME', 'assist_co'),
+            'USER': os.environ.get('DB_USER', ''),
+            'PASSWORD': os.environ.get('DB_PASSWORD', ''),
+            'HOST': os.environ.get('DB_HOST', ''),
+            'PORT': os.environ.get('DB_PORT', ''),
+            'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', '300')),
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('DB_NAME', os.path.join(BASE_DIR, 'db.sqlite3')),
+            'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', '0')),
+            'OPTIONS': {
+                'timeout': int(os.environ.get('DB_BUSY_TIMEOUT', '20')),
+            },
+        }
     }
+
+DB_HEALTH_CHECKS = os.environ.get('DB_HEALTH_CHECKS', 'true').lower() in ('1', 'true', 'yes')
+
+# Run on every new sqlite connection, see assist_co_server/db.py
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': int(os.environ.get('DB_BUSY_TIMEOUT', '20')) * 1000,
+    'mmap_size': 256 * 1024 * 1024,
+    # Django 1.10 rebuilds tables in migrations by renaming them. SQLite 3.26+
+    # would repoint other tables' foreign keys at the renamed copy.
+    'legacy_alter_table': 'ON',
 }
 
 
@@ -133,7 +269,24 @@ USE_TZ = True
 
 # Django-Auth
 
-AUTHENTICATION_BACKENDS = ('assist_co_server.auth_backends.ModelBackend',)
+# Email login for the API, username login for the admin
+AUTHENTICATION_BACKENDS = (
+    'assist_co_server.auth_backends.EmailBackend',
+    'assist_co_server.auth_backends.UsernameBackend',
+)
+
+# New passwords are hashed with the first hasher, see assist_co_server/hashers.py
+PASSWORD_HASHERS = [
+    'assist_co_server.hashers.PBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.BCryptPasswordHasher',
+]
+
+# PBKDF2 cost, passwords hashed with another count are rehashed on login.
+# Check login latency with `python manage.py benchmark_login` when changing it.
+PBKDF2_ITERATIONS = int(os.environ.get('PBKDF2_ITERATIONS', '30000'))
 
 
 
@@ -141,3 +294,13 @@ AUTHENTICATION_BACKENDS = ('assist_co_server.auth_backends.ModelBackend',)
 # https://docs.djangoproject.com/en/1.10/howto/static-files/
 
 STATIC_URL = '/static/'
+
+# Uploaded profile pictures and their thumbnails
+MEDIA_ROOT = os.environ.get('MEDIA_ROOT', os.path.join(BASE_DIR, 'media'))
+MEDIA_URL = '/media/'
+
+# See assist_co_server/thumbnails.py
+PROFILE_THUMBNAILS = {
+    'SIZES': (64, 128, 256),
+    'QUALITY': 85,
+}
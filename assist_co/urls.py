@@ -13,13 +13,16 @@ Including another URLconf
     1. Import the include() function: from django.conf.urls import url, include
     2. Add a URL to urlpatterns:  url(r'^blog/', include('blog.urls'))
 """
+from django.conf import settings
 from django.conf.urls import url, include
+from django.conf.urls.static import static
 from django.contrib import admin
 admin.autodiscover()
 
 from rest_framework.routers import DefaultRouter
 
 import rest_framework_docs
+from assist_co_server import serializers
 from assist_co_server.views import *
 
 
@@ -39,8 +42,13 @@ urlpatterns = [
 
     # Tasks urls
     url(r'^api/tasks$', TasksView.as_view()),
+    url(r'^api/tasks/batch$', TasksBatchView.as_view()),
+    url(r'^api/tasks/export$', TasksExportView.as_view()),
     url(r'^api/clients/(?P<id>[0-9]+)/tasks$', ClientTasksView.as_view()),
     url(r'^api/clients/(?P<client_id>[0-9]+)/tasks/(?P<id>[0-9]+)$', ClientTaskDetailView.as_view()),
+    url(r'^api/clients/(?P<client_id>[0-9]+)/tasks/(?P<id>[0-9]+)/transition$', ClientTaskTransitionView.as_view()),
+    url(r'^api/clients/(?P<id>[0-9]+)/search$', ClientSearchView.as_view()),
+    url(r'^api/clients/(?P<id>[0-9]+)/changes$', ClientChangesView.as_view()),
 
     # Contacts urls
     url(r'^api/contacts$', ContactsView.as_view()),
@@ -51,12 +59,20 @@ urlpatterns = [
     # Client urls
     url(r'^api/clients$', ClientsView.as_view()),
     url(r'^api/clients/(?P<id>[0-9]+)$', ClientDetailView.as_view()),
+    url(r'^api/clients/(?P<id>[0-9]+)/profile-pic$', ProfilePictureView.as_view(
+        model=Client, serializer_class=serializers.ClientSerializer)),
 
     # Assistant urls
     url(r'^api/assistants$', AssistantsView.as_view()),
     url(r'^api/assistants/(?P<id>[0-9]+)$', AssistantDetailView.as_view()),
+    url(r'^api/assistants/(?P<id>[0-9]+)/queue$', AssistantQueueView.as_view()),
+    url(r'^api/assistants/(?P<id>[0-9]+)/profile-pic$', ProfilePictureView.as_view(
+        model=Assistant, serializer_class=serializers.AssistantSerializer)),
+
+    # Metrics
+    url(r'^api/metrics$', MetricsView.as_view()),
 
     # Admin
     url(r'^admin/', include(admin.site.urls)),
     url(r'^admin/doc/', include('django.contrib.admindocs.urls')),
-]
+] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
@@ -0,0 +1 @@
+default_app_config = 'assist_co_server.apps.AssistCoServerConfig'
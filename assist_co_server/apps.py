@@ -5,3 +5,8 @@ from django.apps import AppConfig
 
 class AssistCoServerConfig(AppConfig):
     name = 'assist_co_server'
+
+    def ready(self):
+        # Connect signal receivers and register jobs
+        from assist_co_server import assignment, authentication, db, options, response_cache, search, sync, \
+            task_counts, thumbnails
@@ -0,0 +1,205 @@
+"""
+Assigns new ready tasks to assistants.
+
+A task goes to its client's primary assistant while that assistant has fewer
+than PRIMARY_MAX_LOAD open (ready or executing) tasks, and otherwise to the
+active assistant with the fewest open tasks. The open task count of every
+assistant is kept in memory in a min-heap, loaded from the task counts (see
+task_counts.py) and reloaded every REFRESH_SECONDS to pick up tasks finished
+or reassigned elsewhere, so picking an assistant costs O(log assistants) and
+no query.
+
+Tasks are assigned by the assign_tasks job, queued by the receivers below
+for tasks created without an assistant. The engine lock is only held while
+choosing assistants for a whole batch, the tasks are then written with one
+UPDATE per assistant that skips tasks assigned or started in the meantime.
+
+Configured with settings.ASSIGNMENT:
+
+    ASSIGNMENT = {
+        'PRIMARY_MAX_LOAD': 20,
+        'REFRESH_SECONDS': 60,
+    }
+"""
+import heapq
+import threading
+import time
+
+from django.conf import settings
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from assist_co_server import jobs, response_cache, task_counts
+from assist_co_server.models import Assistant, AssistantTaskCount, Task, IN_CHUNK_SIZE, task_transitioned, tasks_bulk_created
+
+DEFAULTS = {
+    'PRIMARY_MAX_LOAD': 20,
+    'REFRESH_SECONDS': 60,
+}
+
+OPEN_STATES = ('ready', 'executing')
+
+
+def get_setting(name):
+    return dict(DEFAULTS, **getattr(settings, 'ASSIGNMENT', {}))[name]
+
+
+def open_task_counts():
+    """
+    Assistant id -> open task count, for every active assistant
+    """
+    counts = dict.fromkeys(Assistant.objects.filter(is_active=True).values_list('id', flat=True), 0)
+    rows = AssistantTaskCount.objects.filter(state__in=OPEN_STATES).values_list('assistant_id', 'count')
+    for assistant_id, count in rows:
+        if assistant_id in counts:
+            counts[assistant_id] += count
+    return counts
+
+
+class AssignmentEngine(object):
+    """
+    Open task count per assistant with a min-heap of (count, assistant id)
+    over them. Heap entries are not updated in place: a changed count pushes
+    a new entry and entries that no longer match loads are skipped.
+    """
+    def __init__(self, primary_max_load=None, refresh_seconds=None):
+        self.primary_max_load = primary_max_load
+        self.refresh_seconds = refresh_seconds
+        self.loads = {}
+        self.heap = []
+        self.loaded_at = None
+        self._lock = threading.Lock()
+
+    def get_primary_max_load(self):
+        return self.primary_max_load if self.primary_max_load is not None else get_setting('PRIMARY_MAX_LOAD')
+
+    def get_refresh_seconds(self):
+        return self.refresh_seconds if self.refresh_seconds is not None else get_setting('REFRESH_SECONDS')
+
+    def load(self, loads):
+        """
+        Replace the counts with loads, assistant id -> open task count
+        """
+        heap = [(count, assistant_id) for assistant_id, count in loads.items()]
+        heapq.heapify(heap)
+        with self._lock:
+            self.loads = dict(loads)
+            self.heap = heap
+            self.loaded_at = time.time()
+
+    def refresh(self):
+        self.load(open_task_counts())
+
+    def reset(self):
+        with self._lock:
+            self.loads = {}
+            self.heap = []
+            self.loaded_at = None
+
+    def is_stale(self):
+        return self.loaded_at is None or time.time() - self.loaded_at > self.get_refresh_seconds()
+
+    def plan(self, tasks):
+        """
+        Choose an assistant for each (task id, primary assistant id or None)
+        of tasks and count the tasks against them. Returns assistant id ->
+        task ids, tasks are left out when there is no active assistant.
+        """
+        primary_max_load = self.get_primary_max_load()
+        plan = {}
+        with self._lock:
+            for task_id, primary_id in tasks:
+                assistant_id = self._pick(primary_id, primary_max_load)
+                if assistant_id is None:
+                    break
+                plan.setdefault(assistant_id, []).append(task_id)
+        return plan
+
+    def _pick(self, primary_id, primary_max_load):
+        load = self.loads.get(primary_id)
+        if load is not None and load < primary_max_load:
+            self._set(primary_id, load + 1)
+            return primary_id
+        while self.heap:
+            load, assistant_id = self.heap[0]
+            if self.loads.get(assistant_id) == load:
+                self.loads[assistant_id] = load + 1
+                heapq.heapreplace(self.heap, (load + 1, assistant_id))
+                return assistant_id
+            heapq.heappop(self.heap)
+        return None
+
+    def _set(self, assistant_id, load):
+        self.loads[assistant_id] = load
+        heapq.heappush(self.heap, (load, assistant_id))
+        if len(self.heap) > 4 * len(self.loads) + 64:
+            # Drop the stale entries
+            self.heap = [(count, id) for id, count in self.loads.items()]
+            heapq.heapify(self.heap)
+
+    def release(self, assistant_id, count=1):
+        """
+        Uncount count tasks of assistant_id
+        """
+        with self._lock:
+            if assistant_id in self.loads:
+                self._set(assistant_id, max(self.loads[assistant_id] - count, 0))
+
+    def assign(self, task_ids):
+        """
+        Assign the ready and unassigned tasks among task_ids. Returns the
+        number of tasks assigned.
+        """
+        if self.is_stale():
+            self.refresh()
+        task_ids = list(task_ids)
+        rows = []
+        for i in range(0, len(task_ids), IN_CHUNK_SIZE):
+            rows.extend(Task.objects
+                .filter(pk__in=task_ids[i:i + IN_CHUNK_SIZE], state='ready', assistant__isnull=True)
+                .order_by('id').values_list('id', 'client__primary_assistant_id', 'client_id'))
+        tasks = [(task_id, primary_id) for task_id, primary_id, client_id in rows]
+
+        assigned = 0
+        now = timezone.now()
+        for assistant_id, ids in self.plan(tasks).items():
+            for i in range(0, len(ids), IN_CHUNK_SIZE):
+                chunk = ids[i:i + IN_CHUNK_SIZE]
+                updated = (Task.objects.filter(pk__in=chunk, state='ready', assistant__isnull=True)
+                    .update(assistant_id=assistant_id, updated_on=now))
+                if updated < len(chunk):
+                    # Assigned or started by someone else meanwhile
+                    self.release(assistant_id, len(chunk) - updated)
+                task_counts.adjust({(assistant_id, 'ready'): updated})
+                assigned += updated
+        if assigned:
+            response_cache.bump(client_id for task_id, primary_id, client_id in rows)
+        return assigned
+
+
+engine = AssignmentEngine()
+
+
+@jobs.register
+def assign_tasks(task_ids):
+    engine.assign(task_ids)
+
+
+@receiver(post_save, sender=Task)
+def assign_created_task(sender, instance, created=False, raw=False, **kwargs):
+    if created and not raw and instance.assistant_id is None and instance.state == 'ready':
+        jobs.enqueue(assign_tasks, [instance.pk])
+
+
+@receiver(tasks_bulk_created)
+def assign_bulk_created_tasks(sender, tasks, **kwargs):
+    task_ids = [task.pk for task in tasks if task.assistant_id is None and task.state == 'ready']
+    if task_ids:
+        jobs.enqueue(assign_tasks, task_ids)
+
+
+@receiver(task_transitioned)
+def release_finished_task(sender, task, state, **kwargs):
+    if state not in OPEN_STATES and task.assistant_id is not None:
+        engine.release(task.assistant_id)
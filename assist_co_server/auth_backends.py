@@ -1,14 +1,49 @@
-from django.contrib.auth.models import User
 from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.hashers import UNUSABLE_PASSWORD_PREFIX, is_password_usable
+from django.contrib.auth.models import User
+from django.utils.crypto import constant_time_compare
+
+from assist_co_server.models import users_by_email
+
+
+def is_plaintext(encoded):
+    """
+    Whether encoded is a password stored as is rather than hashed
+    """
+    return bool(encoded) and not encoded.startswith(UNUSABLE_PASSWORD_PREFIX) and not is_password_usable(encoded)
+
 
 class EmailBackend(ModelBackend):
-    def authenticate(self, email=None, password=None):
-        try:
-            user = User.objects.get(email=email)
-        except User.DoesNotExist:
+    """
+    Authenticates with email and password. Users are looked up by their
+    lowercased email, which the auth_user_email_lower index serves.
+
+    A password hashed with other settings than the first of
+    settings.PASSWORD_HASHERS is hashed again on a successful login (see
+    hashers.py), and so is a password stored in plaintext by older code.
+    """
+    def authenticate(self, email=None, password=None, **kwargs):
+        if not email or password is None:
+            return None
+        user = users_by_email(email).first()
+        if user is None:
+            # Hash once anyway so unknown emails can't be told apart by timing
+            User().set_password(password)
             return None
+        # Saves the new hash when the hasher settings changed
         if user.check_password(password):
-            # Expects password to be hashed
             return user
-        if user.password == password:
-            return user
\ No newline at end of file
+        if is_plaintext(user.password) and constant_time_compare(user.password, password):
+            user.set_password(password)
+            user.save(update_fields=['password'])
+            return user
+        return None
+
+
+class UsernameBackend(ModelBackend):
+    """
+    ModelBackend for username logins only, like the admin's. Email logins
+    don't match its arguments so they aren't hashed a second time here.
+    """
+    def authenticate(self, username=None, password=None):
+        return super(UsernameBackend, self).authenticate(username=username, password=password)
@@ -0,0 +1,157 @@
+"""
+Token authentication with a cache in front of the Token + User lookup: an
+in-process LRU/TTL cache, or Django's cache framework shared between
+processes.
+
+Configured with settings.TOKEN_AUTH_CACHE:
+
+    TOKEN_AUTH_CACHE = {
+        'MAX_SIZE': 10000,      # entries kept in the process local LRU
+        'TTL': 60,              # seconds an entry is trusted
+        'CACHE_ALIAS': None,    # Django cache alias used instead of the LRU
+    }
+
+Entries are dropped when a token is deleted (logout) and when a user is
+saved as inactive. With the local LRU only the process handling the logout or
+deactivation drops them, the others keep accepting the token until its entry
+expires by TTL. When more than one worker serves the API, set CACHE_ALIAS to
+a cache they share, e.g. the database or memcached backend, so that every
+worker sees the deletion at once. Cached user instances are shared between
+requests and must be treated as read-only.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.dateparse import parse_datetime
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from assist_co_server import jobs
+from assist_co_server.models import Assistant, Client
+
+DEFAULTS = {
+    'MAX_SIZE': 10000,
+    'TTL': 60,
+    'CACHE_ALIAS': None,
+}
+
+
+class TokenCache(object):
+    """
+    Bounded LRU of token key -> (user, token) with a TTL per entry, or the
+    cache_alias Django cache when set. No local copy is kept then, so a
+    deletion through any process applies to every other one.
+    """
+    key_prefix = 'auth-token:'
+
+    def __init__(self, max_size, ttl, cache_alias=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.cache_alias = cache_alias
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls):
+        conf = dict(DEFAULTS, **getattr(settings, 'TOKEN_AUTH_CACHE', {}))
+        return cls(conf['MAX_SIZE'], conf['TTL'], conf['CACHE_ALIAS'])
+
+    @property
+    def shared(self):
+        return caches[self.cache_alias] if self.cache_alias else None
+
+    def get(self, key):
+        if self.shared is not None:
+            value = self.shared.get(self.key_prefix + key)
+            with self._lock:
+                if value is None:
+                    self.misses += 1
+                else:
+                    self.hits += 1
+            return value
+
+        now = time.time()
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None and entry[0] > now:
+                # Re-insert to mark as most recently used
+                self._entries[key] = entry
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        return None
+
+    def set(self, key, value):
+        if self.shared is not None:
+            self.shared.set(self.key_prefix + key, value, self.ttl)
+        else:
+            self._store(key, value, time.time())
+
+    def _store(self, key, value, now):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (now + self.ttl, value)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+        if self.shared is not None:
+            self.shared.delete(self.key_prefix + key)
+
+    def delete_user(self, user_id):
+        for key in Token.objects.filter(user_id=user_id).values_list('key', flat=True):
+            self.delete(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
+
+
+token_cache = TokenCache.from_settings()
+
+
+class CachingTokenAuthentication(TokenAuthentication):
+    """
+    TokenAuthentication that serves repeat tokens from token_cache instead of
+    joining Token and User on every request
+    """
+    def authenticate_credentials(self, key):
+        cached = token_cache.get(key)
+        if cached is not None:
+            return cached
+        user, token = super(CachingTokenAuthentication, self).authenticate_credentials(key)
+        token_cache.set(key, (user, token))
+        return (user, token)
+
+
+@jobs.register
+def update_last_login(user_id, timestamp):
+    User.objects.filter(pk=user_id).update(last_login=parse_datetime(timestamp))
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_deleted_token(sender, instance, **kwargs):
+    token_cache.delete(instance.key)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=Client)
+@receiver(post_save, sender=Assistant)
+def invalidate_inactive_user(sender, instance, created=False, raw=False, **kwargs):
+    if not created and not raw and not instance.is_active:
+        token_cache.delete_user(instance.pk)
@@ -0,0 +1,53 @@
+"""
+Database connection tuning, configured from assist_co/settings.py
+
+* SQLITE_PRAGMAS are run on every new SQLite connection (WAL, synchronous,
+  busy timeout, mmap size) so concurrent writers wait instead of failing
+  with "database is locked".
+* DB_HEALTH_CHECKS pings persistent connections (CONN_MAX_AGE != 0) at the
+  start of each request and drops the ones the server has closed, instead of
+  failing the request on its first query.
+* lock_for_write() makes a transaction that reads before it writes wait for
+  the SQLite write lock instead of failing.
+"""
+from django.conf import settings
+from django.core.signals import request_started
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+@receiver(connection_created)
+def apply_sqlite_pragmas(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    cursor = connection.cursor()
+    for name, value in getattr(settings, 'SQLITE_PRAGMAS', {}).items():
+        cursor.execute('PRAGMA {} = {}'.format(name, value))
+    cursor.close()
+
+
+@receiver(request_started)
+def check_persistent_connections(sender, **kwargs):
+    if not getattr(settings, 'DB_HEALTH_CHECKS', False):
+        return
+    for connection in connections.all():
+        if connection.connection is None or connection.settings_dict['CONN_MAX_AGE'] == 0:
+            continue
+        if not connection.is_usable():
+            connection.close()
+
+
+def lock_for_write(using=DEFAULT_DB_ALIAS):
+    """
+    Take the SQLite write lock at the start of the current transaction.
+    Transactions start deferred, so one that reads before it writes fails on
+    its first write with "database is locked", without waiting out the busy
+    timeout, when another connection wrote since its first read. A no-op on
+    other databases.
+    """
+    connection = connections[using]
+    if connection.vendor == 'sqlite' and connection.in_atomic_block:
+        with connection.cursor() as cursor:
+            # Writes nothing but takes the lock
+            cursor.execute('UPDATE django_migrations SET id = id WHERE 0')
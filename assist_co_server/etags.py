@@ -0,0 +1,64 @@
+"""
+ETag functions for conditional GET via django.views.decorators.http.condition
+
+Each function reads only the timestamps / versions behind a representation,
+never the full rows, so a 304 costs one narrow query at most.
+"""
+import hashlib
+
+from django.db.models import Count, Max
+
+from assist_co_server import options
+from assist_co_server.models import Assistant, Client, Task
+
+
+def _digest(request, *parts):
+    """
+    Hash the validator parts together with everything else that changes the
+    rendered body (path, query string and negotiated format)
+    """
+    digest = hashlib.md5()
+    digest.update(request.get_full_path().encode('utf-8'))
+    digest.update(request.META.get('HTTP_ACCEPT', '').encode('utf-8'))
+    for part in parts:
+        digest.update(repr(part).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def option_etag(table):
+    """
+    Build an ETag function for an option table list view
+    """
+    def etag(request, *args, **kwargs):
+        return _digest(request, table.etag)
+    return etag
+
+
+def assistant_etag(request, *args, **kwargs):
+    row = Assistant.objects.filter(id=kwargs['id']).values_list('updated_on').first()
+    if row is None:
+        return None
+    return _digest(request, row, options.genders.etag)
+
+
+def client_etag(request, *args, **kwargs):
+    row = (Client.objects
+        .filter(id=kwargs['id'], is_active=True)
+        .values_list('updated_on', 'primary_assistant__updated_on')
+        .first())
+    if row is None:
+        return None
+    return _digest(request, row, options.genders.etag, options.professions.etag)
+
+
+def client_task_etag(request, *args, **kwargs):
+    row = (Task.objects
+        .filter(client_id=kwargs['client_id'], id=kwargs['id'], is_archived=False)
+        .annotate(contacts_updated_on=Max('contacts__updated_on'), contacts_count=Count('contacts'))
+        .values_list('updated_on', 'client__updated_on', 'client__primary_assistant__updated_on',
+            'assistant__updated_on', 'contacts_updated_on', 'contacts_count')
+        .first())
+    if row is None:
+        return None
+    return _digest(request, row, options.genders.etag, options.professions.etag,
+        options.task_types.etag)
@@ -0,0 +1,186 @@
+"""
+Streaming export of tasks with their contacts as NDJSON or CSV, served by
+TasksExportView and the export_tasks command.
+
+Rows have the layout of TaskSerializer, including ?fields= selection, but are
+built from flat values() rows. The nested client and assistant come from
+joins in the same query and options from the option registry, so no model
+instances are built. Tasks are read in id order in keyset chunks, one query
+for the tasks and one for their contacts per chunk, so memory stays flat
+however many tasks are exported.
+"""
+import csv
+import json
+from collections import OrderedDict
+
+from django.core.files.storage import default_storage
+from rest_framework import serializers as drf_serializers
+
+from assist_co_server import options, thumbnails
+from assist_co_server.renderers import JSONRenderer
+from assist_co_server.models import Task
+from assist_co_server.serializers import GenderField, ProfessionField, TaskTypeField, ThumbnailsField
+
+OPTION_TABLES = {
+    GenderField: options.genders,
+    ProfessionField: options.professions,
+    TaskTypeField: options.task_types,
+}
+
+
+def option_representation(option):
+    return {'permalink': option.permalink, 'sort': option.sort, 'display': option.display}
+
+
+class Layout(object):
+    """
+    The values() lookups behind a serializer's readable fields and how to
+    turn a values() row back into the serializer's representation
+    """
+    def __init__(self, serializer, prefix=''):
+        self.prefix = prefix
+        self.pk_column = prefix + 'id'
+        self.columns = [self.pk_column]
+        # (name, kind, column or nested layout, field)
+        self.fields = []
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+            source = prefix + field.source
+            if isinstance(field, drf_serializers.ListSerializer):
+                # Many to many, read with a separate query
+                self.fields.append((name, 'many', Layout(field.child), field))
+            elif isinstance(field, drf_serializers.BaseSerializer):
+                nested = Layout(field, source + '__')
+                self.columns.extend(nested.columns)
+                self.fields.append((name, 'nested', nested, field))
+            elif type(field) in OPTION_TABLES:
+                self.columns.append(source + '__id')
+                self.fields.append((name, 'option', source + '__id', field))
+            elif isinstance(field, ThumbnailsField):
+                columns = (prefix + 'profile_pic', prefix + 'thumbnail_format')
+                self.columns.extend(columns)
+                self.fields.append((name, 'thumbnails', columns, field))
+            elif isinstance(field, drf_serializers.FileField):
+                self.columns.append(source)
+                self.fields.append((name, 'file', source, field))
+            else:
+                self.columns.append(source)
+                self.fields.append((name, 'value', source, field))
+        self.columns = list(OrderedDict.fromkeys(self.columns))
+
+    def many_fields(self):
+        return [(name, layout) for name, kind, layout, field in self.fields if kind == 'many']
+
+    def build(self, row, many=None):
+        """
+        The representation of a values() row, many maps each many field name
+        to its list of representations
+        """
+        if row[self.pk_column] is None:
+            return None
+        data = OrderedDict()
+        for name, kind, source, field in self.fields:
+            if kind == 'many':
+                data[name] = many[name] if many else []
+            elif kind == 'nested':
+                data[name] = source.build(row)
+            elif kind == 'option':
+                option = OPTION_TABLES[type(field)].get_by_id(row[source])
+                data[name] = option_representation(option) if option is not None else None
+            elif kind == 'thumbnails':
+                data[name] = thumbnails.thumbnail_urls(row[source[0]], row[source[1]])
+            elif kind == 'file':
+                data[name] = default_storage.url(row[source]) if row[source] else None
+            else:
+                value = row[source]
+                data[name] = field.to_representation(value) if value is not None else None
+        return data
+
+    def csv_header(self, prefix=''):
+        header = []
+        for name, kind, source, field in self.fields:
+            if kind == 'nested':
+                header.extend(source.csv_header(prefix + name + '.'))
+            elif kind == 'option':
+                header.append(prefix + name + '.permalink')
+            else:
+                header.append(prefix + name)
+        return header
+
+    def csv_row(self, data):
+        row = []
+        for name, kind, source, field in self.fields:
+            value = data.get(name) if data is not None else None
+            if kind == 'nested':
+                row.extend(source.csv_row(value))
+            elif kind == 'option':
+                row.append(value['permalink'] if value else '')
+            elif kind in ('many', 'thumbnails'):
+                row.append(json.dumps(value, ensure_ascii=False) if value else '')
+            else:
+                row.append('' if value is None else value)
+        return row
+
+
+def task_rows(queryset, layout, chunk_size=1000):
+    """
+    Generate the representation of every task in queryset, in id order
+    """
+    through = Task.contacts.through
+    many = layout.many_fields()
+    last_id = 0
+    while True:
+        rows = list(queryset.filter(id__gt=last_id).order_by('id').values(*layout.columns)[:chunk_size])
+        if not rows:
+            return
+        ids = [row['id'] for row in rows]
+        related = dict((row['id'], {}) for row in rows)
+        for name, child in many:
+            lookups = ['task_id'] + ['contact__' + column for column in child.columns]
+            for task in related.values():
+                task[name] = []
+            # Rename contact__x keys to the child's columns
+            for link in through.objects.filter(task_id__in=ids).order_by('task_id', 'contact_id').values(*lookups):
+                contact = dict((column, link['contact__' + column]) for column in child.columns)
+                related[link['task_id']][name].append(child.build(contact))
+        for row in rows:
+            yield layout.build(row, related[row['id']])
+        last_id = ids[-1]
+
+
+def ndjson_lines(rows):
+    for row in rows:
+        yield json.dumps(row, ensure_ascii=False, separators=(',', ':')) + '\n'
+
+
+class Echo(object):
+    """
+    File-like object csv.writer writes a line to and gets it back
+    """
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows, layout):
+    writer = csv.writer(Echo())
+    yield writer.writerow(layout.csv_header())
+    for row in rows:
+        yield writer.writerow(layout.csv_row(row))
+
+
+class NDJSONRenderer(JSONRenderer):
+    """
+    Selects NDJSON with ?format=ndjson, the export itself is streamed by the
+    view. Error responses are rendered as JSON.
+    """
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+
+
+class CSVRenderer(JSONRenderer):
+    """
+    Selects CSV with ?format=csv, error responses are rendered as JSON
+    """
+    media_type = 'text/csv'
+    format = 'csv'
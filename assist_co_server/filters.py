@@ -0,0 +1,94 @@
+"""
+Query parameter filtering and ordering for the task list views
+"""
+from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend, OrderingFilter
+
+from assist_co_server import options
+from assist_co_server.models import TASK_STATES
+
+STATES = set(state for state, display in TASK_STATES)
+BOOLEANS = {'true': True, '1': True, 'false': False, '0': False}
+
+# query param -> lookup on Task, values are ISO 8601 datetimes
+DATETIME_WINDOWS = (
+    ('start_on_after', 'start_on__gte'),
+    ('start_on_before', 'start_on__lt'),
+    ('end_on_after', 'end_on__gte'),
+    ('end_on_before', 'end_on__lt'),
+)
+
+
+def split(value):
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
+class TaskFilterBackend(BaseFilterBackend):
+    """
+    ?state=ready,executing
+    ?is_complete=true
+    ?task_type=<permalink>,<permalink>
+    ?assistant=<id>, or ?assistant=none for unassigned tasks
+    ?start_on_after= ?start_on_before= ?end_on_after= ?end_on_before=
+
+    Every filter becomes a WHERE clause, invalid values are a 400.
+    """
+    def filter_queryset(self, request, queryset, view):
+        params = request.query_params
+        lookups = {}
+
+        if params.get('state'):
+            states = split(params['state'])
+            unknown = [state for state in states if state not in STATES]
+            if unknown:
+                raise ValidationError({'state': ['Unknown states: {}'.format(', '.join(unknown))]})
+            lookups['state__in'] = states
+
+        if params.get('is_complete'):
+            if params['is_complete'].lower() not in BOOLEANS:
+                raise ValidationError({'is_complete': ['Must be true or false']})
+            lookups['is_complete'] = BOOLEANS[params['is_complete'].lower()]
+
+        if params.get('task_type'):
+            task_type_ids = []
+            for permalink in split(params['task_type']):
+                # Resolved by the option registry instead of joining task_types
+                task_type = options.task_types.get(permalink)
+                if task_type is None:
+                    raise ValidationError({'task_type': ['No task type exists for permalink {}'.format(permalink)]})
+                task_type_ids.append(task_type.id)
+            lookups['task_type_id__in'] = task_type_ids
+
+        if params.get('assistant'):
+            if params['assistant'].lower() == 'none':
+                lookups['assistant_id__isnull'] = True
+            elif params['assistant'].isdigit():
+                lookups['assistant_id'] = int(params['assistant'])
+            else:
+                raise ValidationError({'assistant': ['Must be an assistant id or none']})
+
+        field = serializers.DateTimeField()
+        for param, lookup in DATETIME_WINDOWS:
+            if params.get(param):
+                try:
+                    lookups[lookup] = field.to_internal_value(params[param])
+                except ValidationError as e:
+                    raise ValidationError({param: e.detail})
+
+        return queryset.filter(**lookups) if lookups else queryset
+
+
+class TaskOrderingFilter(OrderingFilter):
+    """
+    ?ordering=-start_on,state. Ties are broken by id so page number
+    pagination stays stable. Keyset (?cursor=) pages are always newest
+    first and ignore the ordering.
+    """
+    ordering_fields = ('created_on', 'start_on', 'end_on', 'completed_on', 'state', 'id')
+
+    def get_ordering(self, request, queryset, view):
+        ordering = super(TaskOrderingFilter, self).get_ordering(request, queryset, view)
+        if ordering and not any(field.lstrip('-') in ('id', 'pk') for field in ordering):
+            ordering = list(ordering) + ['id']
+        return ordering
@@ -0,0 +1,20 @@
+"""
+Password hashing with a tunable cost.
+
+PBKDF2PasswordHasher takes its iteration count from
+settings.PBKDF2_ITERATIONS. Hashes made with another count still verify, and
+EmailBackend saves them again with the configured count on the user's next
+login, so the cost can be raised or lowered without a migration. Measure the
+effect on login latency with `python manage.py benchmark_login`.
+"""
+from django.conf import settings
+from django.contrib.auth import hashers
+
+
+class PBKDF2PasswordHasher(hashers.PBKDF2PasswordHasher):
+    """
+    Django's PBKDF2-SHA256 hasher with settings.PBKDF2_ITERATIONS iterations
+    """
+    @property
+    def iterations(self):
+        return getattr(settings, 'PBKDF2_ITERATIONS', hashers.PBKDF2PasswordHasher.iterations)
@@ -0,0 +1,201 @@
+"""
+Background jobs for the side effects of a request that need not hold it up:
+last login stamps, search index updates and profile picture thumbnails.
+
+Functions are registered with @register and queued with enqueue(func, *args).
+Arguments go through JSON whatever the backend, so pass ids and plain values
+and let the job read the rows it needs. A job may run more than once and out
+of order with others, so jobs work from the current rows and are idempotent.
+Each run is one transaction.
+
+settings.JOBS['BACKEND'] is one of:
+
+    sync    run in the calling thread straight away, errors propagate to the
+            caller. Meant for tests.
+    local   run on a thread pool of this process once the calling transaction
+            commits. Failures are retried with backoff in the process, jobs
+            still pending when it exits are lost.
+    db      saved to the jobs table in the calling transaction and run by
+            `python manage.py run_jobs`. Failures are retried with backoff,
+            jobs failing MAX_ATTEMPTS times are kept with state failed.
+
+Configured with settings.JOBS:
+
+    JOBS = {
+        'BACKEND': 'local',
+        'WORKERS': 2,                   # threads of the local backend and run_jobs
+        'MAX_ATTEMPTS': 5,
+        'BACKOFF_SECONDS': 2,           # doubled after each failed attempt
+        'MAX_BACKOFF_SECONDS': 600,
+        'TIMEOUT_SECONDS': 600,         # after which a running job is retried
+    }
+"""
+import datetime
+import json
+import logging
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections, transaction
+from django.utils import timezone
+
+from assist_co_server import db
+from assist_co_server.models import Job
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'BACKEND': 'local',
+    'WORKERS': 2,
+    'MAX_ATTEMPTS': 5,
+    'BACKOFF_SECONDS': 2,
+    'MAX_BACKOFF_SECONDS': 600,
+    'TIMEOUT_SECONDS': 600,
+}
+
+# Job name -> function
+registry = {}
+
+
+def get_setting(name):
+    return dict(DEFAULTS, **getattr(settings, 'JOBS', {}))[name]
+
+
+def job_name(func):
+    return '{}.{}'.format(func.__module__, func.__name__)
+
+
+def register(func):
+    """
+    Decorator making func a job that can be enqueued
+    """
+    registry[job_name(func)] = func
+    return func
+
+
+def backoff(attempts):
+    """
+    Seconds to wait before retrying a job that failed attempts times
+    """
+    return min(get_setting('BACKOFF_SECONDS') * 2 ** (attempts - 1), get_setting('MAX_BACKOFF_SECONDS'))
+
+
+def execute(name, args):
+    if name not in registry:
+        raise LookupError('{} is not a registered job'.format(name))
+    with transaction.atomic():
+        db.lock_for_write()
+        registry[name](*json.loads(args))
+
+
+def enqueue(func, *args):
+    """
+    Run func(*args) in the background with the configured backend
+    """
+    name = job_name(func)
+    if name not in registry:
+        raise LookupError('{} is not a registered job'.format(name))
+    args = json.dumps(args, cls=DjangoJSONEncoder)
+    backend = get_setting('BACKEND')
+    if backend == 'sync':
+        execute(name, args)
+    elif backend == 'local':
+        transaction.on_commit(lambda: submit_local(name, args))
+    elif backend == 'db':
+        Job.objects.create(name=name, args=args, run_after=timezone.now())
+    else:
+        raise ImproperlyConfigured('Unknown jobs backend {}'.format(backend))
+
+
+### local backend ###
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=get_setting('WORKERS'))
+        return _executor
+
+
+def submit_local(name, args, attempt=1):
+    executor().submit(run_local, name, args, attempt)
+
+
+def run_local(name, args, attempt):
+    try:
+        execute(name, args)
+    except Exception:
+        if attempt >= get_setting('MAX_ATTEMPTS'):
+            logger.exception('Job %s failed %s times, giving up', name, attempt)
+        else:
+            logger.warning('Job %s failed, retrying', name, exc_info=True)
+            timer = threading.Timer(backoff(attempt), submit_local, (name, args, attempt + 1))
+            timer.daemon = True
+            timer.start()
+    finally:
+        # Pool threads open their own connections, nothing else closes them
+        connections.close_all()
+
+
+### db backend ###
+
+def claim(limit):
+    """
+    Mark up to limit due jobs as running and return them. Each job is claimed
+    with a conditional UPDATE so concurrent workers never claim the same one.
+    Running jobs past their lock are taken back first.
+    """
+    now = timezone.now()
+    lost = Job.objects.filter(state=Job.RUNNING, locked_until__lt=now)
+    lost.filter(attempts__gte=get_setting('MAX_ATTEMPTS')).update(
+        state=Job.FAILED, locked_until=None, last_error='Timed out', updated_on=now)
+    lost.update(state=Job.QUEUED, locked_until=None, updated_on=now)
+
+    locked_until = now + datetime.timedelta(seconds=get_setting('TIMEOUT_SECONDS'))
+    claimed = []
+    for job in Job.objects.filter(state=Job.QUEUED, run_after__lte=now).order_by('run_after', 'id')[:limit]:
+        updated = Job.objects.filter(pk=job.pk, state=Job.QUEUED).update(
+            state=Job.RUNNING, attempts=job.attempts + 1, locked_until=locked_until, updated_on=now)
+        if updated:
+            job.state = Job.RUNNING
+            job.attempts += 1
+            job.locked_until = locked_until
+            claimed.append(job)
+    return claimed
+
+
+def run_job(job):
+    """
+    Run a claimed job. It is deleted when it succeeds and retried later or
+    marked failed when it raises. Returns whether it succeeded.
+    """
+    try:
+        execute(job.name, job.args)
+    except Exception:
+        logger.exception('Job %s %s failed', job.pk, job.name)
+        now = timezone.now()
+        failure = {'locked_until': None, 'last_error': traceback.format_exc(), 'updated_on': now}
+        if job.attempts >= get_setting('MAX_ATTEMPTS'):
+            failure['state'] = Job.FAILED
+        else:
+            failure['state'] = Job.QUEUED
+            failure['run_after'] = now + datetime.timedelta(seconds=backoff(job.attempts))
+        Job.objects.filter(pk=job.pk, state=Job.RUNNING).update(**failure)
+        return False
+    Job.objects.filter(pk=job.pk).delete()
+    return True
+
+
+def run_job_in_worker(job):
+    try:
+        return run_job(job)
+    finally:
+        connections.close_all()
@@ -0,0 +1,332 @@
+import io
+import json
+import platform
+import shutil
+import subprocess
+import tempfile
+from timeit import default_timer
+
+import django
+from django.conf import settings
+from django.core.management import call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+from django.utils import timezone
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from assist_co_server import metrics, options, sync
+from assist_co_server.management.commands.seed_benchmark_data import WORDS, generate
+from assist_co_server.models import Assistant, Client, Contact, Task
+
+PASSWORD = 'benchmark-password'
+
+
+class Route(object):
+    """
+    A request to benchmark. path and data may be callables taking the
+    iteration number, setup runs before each request outside the timing.
+    data is sent as format, json or multipart.
+    """
+    def __init__(self, method, path, data=None, setup=None, name=None, format='json'):
+        self.method = method
+        self.path = path
+        self.data = data
+        self.setup = setup
+        self.name = name
+        self.format = format
+
+    def resolve(self, value, i):
+        return value(i) if callable(value) else value
+
+    def label(self):
+        if self.name:
+            return self.name
+        return '{} {}'.format(self.method.upper(), self.path if not callable(self.path) else self.path(0))
+
+
+def build_routes(client, assistant, token_key):
+    """
+    One or more routes for every API url in assist_co/urls.py. Deleting a
+    client is left out as it would deactivate the benchmark user.
+    """
+    task = Task.objects.filter(client=client, is_archived=False).order_by('id').first()
+    contact = Contact.objects.filter(client=client).order_by('id').first()
+    task_type = options.task_types.all()[0].permalink
+
+    def task_payload(i, prefix='bench-post'):
+        return {
+            'text': 'Benchmark task {}'.format(i),
+            'task_type': task_type,
+            'client_id': client.id,
+            'contacts': [{
+                'first_name': 'Bench',
+                'last_name': str(i),
+                'email': '{}-{}@example.com'.format(prefix, i),
+                'phone': None,
+                'client_id': client.id,
+            }],
+        }
+
+    def fresh_task(i):
+        return Task.objects.create(client=client, task_type_id=options.task_types.all()[0].id,
+            text='Benchmark task to archive {}'.format(i))
+
+    archived = {}
+
+    def archive_setup(i):
+        archived[i] = fresh_task(i).id
+
+    ready = {}
+
+    def transition_setup(i):
+        ready[i] = fresh_task(i).id
+
+    def picture(i):
+        data = io.BytesIO()
+        Image.new('RGB', (640, 480), (i % 256, 100, 200)).save(data, 'JPEG')
+        return {'profile_pic': SimpleUploadedFile('bench-{}.jpg'.format(i), data.getvalue(), content_type='image/jpeg')}
+
+    def restore_token(i):
+        # Same key so the client's Authorization header stays valid
+        Token.objects.get_or_create(user=client.user_ptr, defaults={'key': token_key})
+
+    tasks_url = '/api/clients/{}/tasks'.format(client.id)
+    task_url = '/api/clients/{}/tasks/{}'.format(client.id, task.id)
+    changes_url = '/api/clients/{}/changes'.format(client.id)
+    since = sync.Watermark(dict((table, (timezone.now(), 0)) for table in sync.Watermark.TABLES)).encode()
+    return [
+        Route('get', '/api/option/genders'),
+        Route('get', '/api/option/professions'),
+        Route('get', '/api/option/task-types'),
+        Route('post', '/api/login', {'email': client.email, 'password': PASSWORD}),
+        Route('post', '/api/signup', lambda i: {
+            'email': 'bench-signup-{}@example.com'.format(i),
+            'password': PASSWORD,
+            'first_name': 'Bench',
+            'last_name': 'Signup',
+            'date_of_birth': '1990-01-01',
+            'gender': options.genders.all()[0].permalink,
+            'phone': '+1666{:07d}'.format(i),
+            'profession': options.professions.all()[0].permalink,
+        }, name='POST /api/signup'),
+        Route('delete', '/api/logout', setup=restore_token),
+        Route('get', '/api/tasks'),
+        Route('get', '/api/tasks?page=5'),
+        Route('get', '/api/tasks?cursor='),
+        Route('post', '/api/tasks', task_payload, name='POST /api/tasks'),
+        Route('post', '/api/tasks/batch', lambda i: [task_payload(i * 20 + j, 'bench-batch') for j in range(20)],
+            name='POST /api/tasks/batch (20 tasks)'),
+        Route('get', '/api/tasks/export?assistant={}'.format(assistant.id), name='GET /api/tasks/export?assistant='),
+        Route('get', '/api/tasks/export?assistant={}&format=csv'.format(assistant.id),
+            name='GET /api/tasks/export?assistant=&format=csv'),
+        Route('get', tasks_url, name='GET /api/clients/<id>/tasks'),
+        Route('get', tasks_url + '?cursor=', name='GET /api/clients/<id>/tasks?cursor='),
+        Route('get', '/api/clients/{}/search?q={}'.format(client.id, WORDS[0]),
+            name='GET /api/clients/<id>/search?q='),
+        Route('get', changes_url, name='GET /api/clients/<id>/changes'),
+        # Only what the routes before it wrote
+        Route('get', changes_url + '?since=' + since, name='GET /api/clients/<id>/changes?since='),
+        Route('get', task_url, name='GET /api/clients/<id>/tasks/<id>'),
+        Route('patch', task_url, {'text': 'Updated by benchmark'}, name='PATCH /api/clients/<id>/tasks/<id>'),
+        Route('post', lambda i: '/api/clients/{}/tasks/{}/transition'.format(client.id, ready[i]),
+            {'state': 'executing', 'expected_state': 'ready', 'assistant_id': assistant.id},
+            setup=transition_setup, name='POST /api/clients/<id>/tasks/<id>/transition'),
+        Route('delete', lambda i: '/api/clients/{}/tasks/{}'.format(client.id, archived[i]),
+            setup=archive_setup, name='DELETE /api/clients/<id>/tasks/<id>'),
+        Route('post', '/api/contacts', lambda i: {
+            'first_name': 'Bench',
+            'last_name': 'Contact',
+            'email': 'bench-contact-{}@example.com'.format(i),
+            'phone': None,
+            'client_id': client.id,
+        }, name='POST /api/contacts'),
+        Route('get', '/api/contacts/{}'.format(contact.id), name='GET /api/contacts/<id>'),
+        Route('get', '/api/tasks/{}/contacts'.format(task.id), name='GET /api/tasks/<id>/contacts'),
+        Route('post', '/api/tasks/{}/contacts'.format(task.id), lambda i: {'contacts': [{
+            'first_name': 'Bench',
+            'last_name': str(j),
+            'email': 'bench-task-contact-{}-{}@example.com'.format(i, j),
+            'phone': None,
+        } for j in range(10)]}, name='POST /api/tasks/<id>/contacts (10 contacts)'),
+        Route('get', '/api/clients'),
+        Route('get', '/api/clients/{}'.format(client.id), name='GET /api/clients/<id>'),
+        Route('patch', '/api/clients/{}'.format(client.id), {'first_name': 'Benchmark'},
+            name='PATCH /api/clients/<id>'),
+        # Thumbnails are generated inline, jobs run synchronously
+        Route('post', '/api/clients/{}/profile-pic'.format(client.id), picture, format='multipart',
+            name='POST /api/clients/<id>/profile-pic'),
+        Route('get', '/api/assistants'),
+        Route('get', '/api/assistants/{}'.format(assistant.id), name='GET /api/assistants/<id>'),
+        Route('get', '/api/assistants/{}/queue'.format(assistant.id), name='GET /api/assistants/<id>/queue'),
+        Route('get', '/api/metrics'),
+    ]
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = int(round(pct / 100.0 * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+def run_route(api, route, requests, warmup, offset):
+    latencies = []
+    queries = []
+    statuses = {}
+    for i in range(offset, offset + warmup + requests):
+        if route.setup:
+            route.setup(i)
+        path = route.resolve(route.path, i)
+        data = route.resolve(route.data, i)
+        timer = metrics.QueryTimer()
+        with metrics.timing_queries(timer):
+            started = default_timer()
+            response = getattr(api, route.method)(path, data, format=route.format)
+            if response.streaming:
+                # Streamed responses do their work as they are read
+                b''.join(response.streaming_content)
+            elapsed = default_timer() - started
+        if i - offset < warmup:
+            continue
+        latencies.append(elapsed)
+        queries.append(timer.count)
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    latencies.sort()
+    total = sum(latencies)
+    return {
+        'requests': requests,
+        'status_codes': dict((str(code), count) for code, count in sorted(statuses.items())),
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'mean_ms': total / len(latencies) * 1000,
+        'queries_per_request': float(sum(queries)) / len(queries),
+        'max_queries': max(queries),
+        'throughput_rps': len(latencies) / total if total else None,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = ('Benchmark every API route through the Django test client against a freshly '
+        'generated dataset and report p50/p95/p99 latency, queries per request and throughput.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=20)
+        parser.add_argument('--assistants', type=int, default=5)
+        parser.add_argument('--tasks-per-client', type=int, default=200)
+        parser.add_argument('--contacts-per-task', type=int, default=3)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--requests', type=int, default=100, help='Measured requests per route')
+        parser.add_argument('--warmup', type=int, default=5, help='Unmeasured requests per route')
+        parser.add_argument('--route', action='append', default=[],
+            help='Only run routes whose label contains this text, may be repeated')
+        parser.add_argument('--output', help='Write the results as JSON to this file')
+        parser.add_argument('--compare', help='JSON results of a previous run to compare against')
+        parser.add_argument('--existing-db', action='store_true',
+            help='Run against the configured database instead of a throwaway test database')
+
+    def handle(self, *args, **opts):
+        baseline = None
+        if opts['compare']:
+            with open(opts['compare']) as f:
+                baseline = json.load(f)
+        scale = dict((key, opts[key]) for key in ('clients', 'assistants', 'tasks_per_client',
+            'contacts_per_task', 'seed'))
+        old_name = None
+        # Uploaded profile pictures and their thumbnails
+        media = tempfile.mkdtemp()
+        debug = settings.DEBUG
+        # Query logging would skew the timings
+        settings.DEBUG = False
+        # Jobs run inline, pool threads can't share the in-memory test database
+        overrides = override_settings(JOBS=dict(getattr(settings, 'JOBS', {}), BACKEND='sync'),
+            # Every request comes from the same address
+            THROTTLES=dict(getattr(settings, 'THROTTLES', {}), RATES={}),
+            MEDIA_ROOT=media)
+        overrides.enable()
+        try:
+            if not opts['existing_db']:
+                old_name = connection.settings_dict['NAME']
+                connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+                call_command('loaddata', 'seed.json', verbosity=0)
+                self.stdout.write('Generating dataset {}'.format(scale))
+                generate(password=PASSWORD, **scale)
+            results = self.run_benchmark(opts)
+        finally:
+            settings.DEBUG = debug
+            overrides.disable()
+            shutil.rmtree(media, ignore_errors=True)
+            if old_name is not None:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        report = {
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'scale': scale,
+            'routes': results,
+        }
+        if opts['output']:
+            with open(opts['output'], 'w') as f:
+                json.dump(report, f, indent=2, sort_keys=True)
+            self.stdout.write('Wrote {}'.format(opts['output']))
+        if baseline is not None:
+            self.compare(baseline, report)
+
+    def run_benchmark(self, opts):
+        contact = (Contact.objects
+            .filter(task__isnull=False, client__isnull=False, client__is_active=True)
+            .order_by('id').first())
+        assistant = Assistant.objects.order_by('id').first()
+        if contact is None or assistant is None:
+            raise CommandError('No client with tasks and contacts or no assistant to benchmark with')
+        client = contact.client
+        client.set_password(PASSWORD)
+        client.save()
+        token = Token.objects.get_or_create(user=client.user_ptr)[0]
+
+        api = APIClient(HTTP_HOST=settings.ALLOWED_HOSTS[0] if settings.ALLOWED_HOSTS else 'localhost')
+        api.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+
+        results = {}
+        self.stdout.write('{:<48} {:>9} {:>9} {:>9} {:>9} {:>8} {:>7}'.format(
+            'route', 'p50 ms', 'p95 ms', 'p99 ms', 'req/s', 'queries', 'errors'))
+        for offset, route in enumerate(build_routes(client, assistant, token.key)):
+            label = route.label()
+            if opts['route'] and not any(text in label for text in opts['route']):
+                continue
+            stats = run_route(api, route, opts['requests'], opts['warmup'], offset * 100000)
+            # Logout deletes the token, bring it back with the same key
+            Token.objects.get_or_create(user=client.user_ptr, defaults={'key': token.key})
+            results[label] = stats
+            errors = sum(count for code, count in stats['status_codes'].items() if int(code) >= 400)
+            self.stdout.write('{:<48} {:>9.2f} {:>9.2f} {:>9.2f} {:>9.1f} {:>8.1f} {:>7}'.format(
+                label, stats['p50_ms'], stats['p95_ms'], stats['p99_ms'], stats['throughput_rps'],
+                stats['queries_per_request'], errors))
+        return results
+
+    def compare(self, baseline, report):
+        self.stdout.write('\nAgainst {} ({})'.format(baseline.get('revision'), baseline.get('scale')))
+        self.stdout.write('{:<48} {:>10} {:>10} {:>10}'.format('route', 'p50', 'p95', 'queries'))
+        for label, stats in sorted(report['routes'].items()):
+            before = baseline['routes'].get(label)
+            if before is None:
+                continue
+            self.stdout.write('{:<48} {:>+9.0f}% {:>+9.0f}% {:>+10.1f}'.format(
+                label,
+                (stats['p50_ms'] / before['p50_ms'] - 1) * 100,
+                (stats['p95_ms'] / before['p95_ms'] - 1) * 100,
+                stats['queries_per_request'] - before['queries_per_request']))
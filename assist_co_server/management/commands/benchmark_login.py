@@ -0,0 +1,100 @@
+import datetime
+import threading
+from timeit import default_timer
+
+from django.conf import settings
+from django.contrib.auth.hashers import get_hasher
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+from rest_framework.test import APIClient
+
+from assist_co_server import options
+from assist_co_server.management.commands.benchmark_api import Route, run_route
+from assist_co_server.models import Client
+
+EMAIL = 'bench-login@example.com'
+PASSWORD = 'benchmark-password'
+
+
+def check_rate(iterations, threads, checks):
+    """
+    Password checks per second over threads threads, each verifying the
+    password checks times against a hash with iterations iterations
+    """
+    hasher = get_hasher()
+    encoded = hasher.encode(PASSWORD, hasher.salt(), iterations)
+
+    def work():
+        for i in range(checks):
+            hasher.verify(PASSWORD, encoded)
+
+    workers = [threading.Thread(target=work) for i in range(threads)]
+    started = default_timer()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return threads * checks / (default_timer() - started)
+
+
+class Command(BaseCommand):
+    help = ('Benchmark POST /api/login against a throwaway test database for each PBKDF2 iteration '
+        'count, and the password checks per second the hasher sustains over several threads.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', default='30000,100000,260000',
+            help='Comma separated PBKDF2 iteration counts to compare')
+        parser.add_argument('--requests', type=int, default=50, help='Measured logins per iteration count')
+        parser.add_argument('--warmup', type=int, default=2,
+            help='Unmeasured logins per iteration count, the first one rehashes the password')
+        parser.add_argument('--threads', type=int, default=4)
+        parser.add_argument('--checks', type=int, default=20, help='Password checks per thread')
+
+    def handle(self, *args, **opts):
+        try:
+            counts = [int(value) for value in opts['iterations'].split(',')]
+        except ValueError:
+            raise CommandError('--iterations takes comma separated numbers')
+        old_name = connection.settings_dict['NAME']
+        debug = settings.DEBUG
+        # Query logging would skew the timings
+        settings.DEBUG = False
+        # Jobs run inline, pool threads can't share the in-memory test database
+        overrides = override_settings(JOBS=dict(getattr(settings, 'JOBS', {}), BACKEND='sync'),
+            # Every request comes from the same address
+            THROTTLES=dict(getattr(settings, 'THROTTLES', {}), RATES={}))
+        overrides.enable()
+        try:
+            connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            call_command('loaddata', 'seed.json', verbosity=0)
+            self.run_benchmark(counts, opts)
+        finally:
+            settings.DEBUG = debug
+            overrides.disable()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def run_benchmark(self, counts, opts):
+        Client.objects.create_user(EMAIL, EMAIL, PASSWORD,
+            first_name='Bench',
+            last_name='Login',
+            gender=options.genders.all()[0],
+            profession=options.professions.all()[0],
+            date_of_birth=datetime.date(1990, 1, 1),
+        )
+        api = APIClient(HTTP_HOST=settings.ALLOWED_HOSTS[0] if settings.ALLOWED_HOSTS else 'localhost')
+        # Mixed case like users type it
+        route = Route('post', '/api/login', {'email': EMAIL.title(), 'password': PASSWORD})
+
+        self.stdout.write('{:>10} {:>9} {:>9} {:>9} {:>8} {:>7} {:>16}'.format(
+            'iterations', 'p50 ms', 'p99 ms', 'login/s', 'queries', 'errors',
+            'checks/s ({} thr)'.format(opts['threads'])))
+        for iterations in counts:
+            with override_settings(PBKDF2_ITERATIONS=iterations):
+                stats = run_route(api, route, opts['requests'], opts['warmup'], 0)
+                rate = check_rate(iterations, opts['threads'], opts['checks'])
+            errors = sum(count for code, count in stats['status_codes'].items() if int(code) >= 400)
+            self.stdout.write('{:>10} {:>9.2f} {:>9.2f} {:>9.1f} {:>8.1f} {:>7} {:>16.1f}'.format(
+                iterations, stats['p50_ms'], stats['p99_ms'], stats['throughput_rps'],
+                stats['queries_per_request'], errors, rate))
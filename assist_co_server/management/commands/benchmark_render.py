@@ -0,0 +1,112 @@
+import io
+from contextlib import contextmanager
+from timeit import default_timer
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings
+from rest_framework import parsers, renderers as drf_renderers, serializers as drf_serializers
+
+from assist_co_server import renderers
+from assist_co_server.management.commands.seed_benchmark_data import generate
+from assist_co_server.models import Task
+from assist_co_server.serializers import PlainRepresentationMixin, TaskSerializer
+
+
+@contextmanager
+def stock_representation():
+    """
+    Nested serializers render through DRF's Serializer.to_representation()
+    """
+    plain = PlainRepresentationMixin.to_representation
+    PlainRepresentationMixin.to_representation = drf_serializers.Serializer.to_representation
+    try:
+        yield
+    finally:
+        PlainRepresentationMixin.to_representation = plain
+
+
+def per_page_ms(work, pages, runs):
+    """
+    Milliseconds work(page) takes per page, the best of runs runs over pages
+    """
+    best = None
+    for run in range(runs):
+        started = default_timer()
+        for page in pages:
+            work(page)
+        elapsed = (default_timer() - started) * 1000 / len(pages)
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+class Command(BaseCommand):
+    help = ('Benchmark TaskSerializer output of task pages against a throwaway test database: serializing '
+        'with and without plain nested representations, and rendering and parsing the JSON with DRF and '
+        'with assist_co_server.renderers.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pages', type=int, default=20, help='Task pages serialized per run')
+        parser.add_argument('--page-size', type=int, default=20)
+        parser.add_argument('--contacts', type=int, default=2, help='Contacts per task')
+        parser.add_argument('--runs', type=int, default=5, help='Runs per measurement, the best one is shown')
+
+    def handle(self, *args, **opts):
+        old_name = connection.settings_dict['NAME']
+        debug = settings.DEBUG
+        # Query logging would skew the timings
+        settings.DEBUG = False
+        # Jobs run inline, pool threads can't share the in-memory test database
+        overrides = override_settings(JOBS=dict(getattr(settings, 'JOBS', {}), BACKEND='sync'))
+        overrides.enable()
+        try:
+            connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            call_command('loaddata', 'seed.json', verbosity=0)
+            self.run_benchmark(opts)
+        finally:
+            settings.DEBUG = debug
+            overrides.disable()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def run_benchmark(self, opts):
+        client = generate(1, 5, opts['pages'] * opts['page_size'], opts['contacts'])[0]
+        tasks = list(Task.objects.with_related().filter(client=client).order_by('created_on', 'id'))
+        pages = [tasks[i:i + opts['page_size']] for i in range(0, len(tasks), opts['page_size'])]
+
+        def serialize(page):
+            return TaskSerializer(page, many=True).data
+
+        with stock_representation():
+            stock_data = [serialize(page) for page in pages]
+            stock_serialize = per_page_ms(serialize, pages, opts['runs'])
+        data = [serialize(page) for page in pages]
+        plain_serialize = per_page_ms(serialize, pages, opts['runs'])
+
+        stock_renderer = drf_renderers.JSONRenderer()
+        renderer = renderers.JSONRenderer()
+        bodies = [renderer.render(page) for page in data]
+        same = bodies == [stock_renderer.render(page) for page in stock_data]
+
+        def parse_with(parser):
+            return lambda body: parser.parse(io.BytesIO(body))
+
+        rows = (
+            ('serialize', stock_serialize, plain_serialize),
+            ('render', per_page_ms(stock_renderer.render, data, opts['runs']),
+                per_page_ms(renderer.render, data, opts['runs'])),
+            ('parse', per_page_ms(parse_with(parsers.JSONParser()), bodies, opts['runs']),
+                per_page_ms(parse_with(renderers.JSONParser()), bodies, opts['runs'])),
+        )
+
+        self.stdout.write('{} pages of {} tasks, {} bytes per page, encoder {}, same output as DRF: {}'.format(
+            len(pages), opts['page_size'], sum(len(body) for body in bodies) // len(bodies), renderers.ENCODER,
+            'yes' if same else 'NO'))
+        self.stdout.write('{:<10} {:>10} {:>10} {:>8}'.format('step', 'DRF ms', 'ms', 'speedup'))
+        for step, stock, ours in rows:
+            self.stdout.write('{:<10} {:>10.3f} {:>10.3f} {:>7.2f}x'.format(step, stock, ours, stock / ours))
+        stock_total = sum(row[1] for row in rows[:2])
+        total = sum(row[2] for row in rows[:2])
+        self.stdout.write('{:<10} {:>10.3f} {:>10.3f} {:>7.2f}x'.format(
+            'page', stock_total, total, stock_total / total))
@@ -0,0 +1,99 @@
+import datetime
+import threading
+from timeit import default_timer
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings
+from rest_framework.test import APIClient
+
+from assist_co_server import options, throttling
+from assist_co_server.management.commands.benchmark_api import Route, run_route
+from assist_co_server.models import Client
+
+EMAIL = 'bench-throttle@example.com'
+PASSWORD = 'benchmark-password'
+
+
+def hit_rate(limiter, keys, threads, hits):
+    """
+    Limiter hits per second over threads threads, each hitting hits times
+    spread over keys keys
+    """
+    def work(offset):
+        for i in range(hits):
+            limiter.hit('ip:{}'.format((offset + i) % keys))
+
+    workers = [threading.Thread(target=work, args=(i * hits,)) for i in range(threads)]
+    started = default_timer()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return threads * hits / (default_timer() - started)
+
+
+class Command(BaseCommand):
+    help = ('Benchmark a flood of failed logins against a throwaway test database with and without '
+        'the login throttle, and the hits per second the limiter sustains.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Measured logins per run')
+        parser.add_argument('--rate', default='10/min', help='Login rate of the throttled run')
+        parser.add_argument('--keys', type=int, default=10000, help='Keys hit in the limiter benchmark')
+        parser.add_argument('--threads', type=int, default=4)
+        parser.add_argument('--hits', type=int, default=50000, help='Limiter hits per thread')
+        parser.add_argument('--cache-alias', default='default',
+            help='Django cache alias for the shared limiter benchmark')
+
+    def handle(self, *args, **opts):
+        old_name = connection.settings_dict['NAME']
+        debug = settings.DEBUG
+        # Query logging would skew the timings
+        settings.DEBUG = False
+        # Jobs run inline, pool threads can't share the in-memory test database
+        overrides = override_settings(JOBS=dict(getattr(settings, 'JOBS', {}), BACKEND='sync'))
+        overrides.enable()
+        try:
+            connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            call_command('loaddata', 'seed.json', verbosity=0)
+            self.benchmark_logins(opts)
+        finally:
+            settings.DEBUG = debug
+            overrides.disable()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+        self.benchmark_limiter(opts)
+
+    def benchmark_logins(self, opts):
+        Client.objects.create_user(EMAIL, EMAIL, PASSWORD,
+            first_name='Bench',
+            last_name='Throttle',
+            gender=options.genders.all()[0],
+            profession=options.professions.all()[0],
+            date_of_birth=datetime.date(1990, 1, 1),
+        )
+        api = APIClient(HTTP_HOST=settings.ALLOWED_HOSTS[0] if settings.ALLOWED_HOSTS else 'localhost')
+        route = Route('post', '/api/login', {'email': EMAIL, 'password': 'wrong-password'})
+
+        self.stdout.write('Failed logins from one address')
+        self.stdout.write('{:<16} {:>9} {:>9} {:>9} {:>8} {:>7} {:>7}'.format(
+            'login rate', 'p50 ms', 'p99 ms', 'req/s', 'queries', '400', '429'))
+        for rate in (None, opts['rate']):
+            throttling.reset()
+            rates = dict(throttling.DEFAULTS['RATES'], login=rate)
+            with override_settings(THROTTLES=dict(getattr(settings, 'THROTTLES', {}), RATES=rates)):
+                stats = run_route(api, route, opts['requests'], 0, 0)
+            self.stdout.write('{:<16} {:>9.2f} {:>9.2f} {:>9.1f} {:>8.1f} {:>7} {:>7}'.format(
+                rate or 'unlimited', stats['p50_ms'], stats['p99_ms'], stats['throughput_rps'],
+                stats['queries_per_request'], stats['status_codes'].get('400', 0),
+                stats['status_codes'].get('429', 0)))
+
+    def benchmark_limiter(self, opts):
+        self.stdout.write('\nLimiter hits over {} keys, {} threads'.format(opts['keys'], opts['threads']))
+        self.stdout.write('{:<16} {:>12}'.format('store', 'hits/s'))
+        for name, cache_alias in (('local', None), ('cache ' + opts['cache_alias'], opts['cache_alias'])):
+            limiter = throttling.SlidingWindowLimiter('benchmark', 100, 60, max(opts['keys'], 1), cache_alias)
+            rate = hit_rate(limiter, opts['keys'], opts['threads'], opts['hits'])
+            self.stdout.write('{:<16} {:>12.0f}'.format(name, rate))
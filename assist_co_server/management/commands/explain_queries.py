@@ -0,0 +1,106 @@
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from assist_co_server.models import Assistant, Client, Contact, Task, Tombstone, taken_identities_sql, \
+    users_by_email
+
+# Lines of a query plan that read a whole table, per vendor
+FULL_SCAN_PATTERNS = {
+    # SQLite < 3.24 says SCAN TABLE, later versions just SCAN. A SCAN ... USING
+    # INDEX walks an index in order and is fine, so is the CONSTANT ROW of a
+    # SELECT without FROM.
+    'sqlite': re.compile(r'\bSCAN (?:TABLE )?(?!CONSTANT ROW)(?P<table>\w+)(?!.*\bUSING\b)'),
+    'postgresql': re.compile(r'\bSeq Scan on (?P<table>\w+)'),
+}
+
+
+def sync_probe(queryset, field, now):
+    queryset = queryset.filter(client_id=1, **{field + '__lte': now})
+    return (queryset.filter(**{field + '__gte': now}).exclude(**{field: now, 'pk__lte': 1})
+        .order_by(field, 'pk'))
+
+
+def audited_queries():
+    """
+    (name, queryset) for every hot lookup the views run. Querysets are built
+    the way the views build them with placeholder ids, the plan doesn't
+    depend on the values. Raw queries are given as (sql, params).
+    """
+    now = timezone.now()
+    client_tasks = Task.objects.with_related().filter(client_id=1, is_archived=False)
+    return [
+        ('ClientTasksView', client_tasks),
+        ('ClientTasksView keyset page', client_tasks.order_by('-created_on', '-pk')
+            .filter(created_on__lte=now).exclude(created_on=now, pk__gte=1)),
+        ('ClientTasksView ?state=', client_tasks.filter(state__in=['ready', 'executing'])),
+        ('TasksView ?assistant=&state=', Task.objects.with_related(set()).filter(assistant_id=1, state__in=['ready'])),
+        ('ClientTaskDetailView', Task.objects.with_related().filter(client_id=1, id=1, is_archived=False)),
+        ('TasksView keyset page', Task.objects.with_related().order_by('-created_on', '-pk')
+            .filter(created_on__lte=now).exclude(created_on=now, pk__gte=1)),
+        ('Task contacts prefetch', Contact.objects.filter(task__id__in=[1, 2])),
+        ('TaskContactsView', Task.objects.filter(id=1, is_archived=False)),
+        ('Contact by client and email', Contact.objects.filter(client_id=1, email__in=['a@example.com'])),
+        ('Contact by client and phone', Contact.objects.filter(client_id=1, phone__in=['+15550000000'])),
+        ('ContactView', Contact.objects.filter(id=1)),
+        ('ClientChangesView tasks', sync_probe(Task.objects.with_related(), 'updated_on', now)),
+        ('ClientChangesView contacts', sync_probe(Contact.objects.all(), 'updated_on', now)),
+        ('ClientChangesView tombstones', sync_probe(Tombstone.objects.all(), 'deleted_on', now)),
+        ('ClientView', Client.objects.with_related().filter(id=1, is_active=True)),
+        ('Client by phone', Client.objects.filter(phone='+15550000000')),
+        ('Login by email', users_by_email('a@example.com')),
+        ('Signup email and phone check', taken_identities_sql('a@example.com', '+15550000000', 1)),
+        ('AssistantView', Assistant.objects.with_related().filter(id=1)),
+    ]
+
+
+def explain(queryset):
+    """
+    Plan lines for queryset on the default connection
+    """
+    sql, params = queryset if isinstance(queryset, tuple) else queryset.query.sql_with_params()
+    with transaction.atomic(), connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            # (id, parent, notused, detail)
+            lines = [row[-1] for row in cursor.fetchall()]
+        else:
+            # Small tables are scanned whatever the indexes, only count a
+            # sequential scan when no index could serve the query
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute('EXPLAIN ' + sql, params)
+            lines = [row[0] for row in cursor.fetchall()]
+    return lines
+
+
+def full_scans(lines, vendor):
+    pattern = FULL_SCAN_PATTERNS[vendor]
+    return [match.group('table') for match in (pattern.search(line) for line in lines) if match]
+
+
+class Command(BaseCommand):
+    help = ('EXPLAIN the queries behind the hot API lookups and fail if any of them '
+        'reads a whole table instead of using an index.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verbose-plans', action='store_true', help='Print every plan')
+
+    def handle(self, *args, **opts):
+        if connection.vendor not in FULL_SCAN_PATTERNS:
+            raise CommandError('Query plans can only be audited on {}'.format(', '.join(sorted(FULL_SCAN_PATTERNS))))
+
+        failures = []
+        for name, queryset in audited_queries():
+            lines = explain(queryset)
+            scanned = full_scans(lines, connection.vendor)
+            self.stdout.write('{:<40} {}'.format(name, 'full scan of ' + ', '.join(scanned) if scanned else 'ok'))
+            if scanned or opts['verbose_plans']:
+                for line in lines:
+                    self.stdout.write('    ' + line)
+            if scanned:
+                failures.append(name)
+
+        if failures:
+            raise CommandError('Full table scans in: {}'.format(', '.join(failures)))
@@ -0,0 +1,45 @@
+import io
+
+from django.core.management.base import BaseCommand
+
+from assist_co_server import exports, serializers
+from assist_co_server.models import Task
+
+
+class Command(BaseCommand):
+    help = ('Stream every task with its client, assistant and contacts as NDJSON or CSV, '
+        'in the layout of the API. Memory use does not grow with the number of tasks.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=('ndjson', 'csv'), default='ndjson')
+        parser.add_argument('--output', help='File to write to, stdout by default')
+        parser.add_argument('--client', type=int, help='Only export the tasks of this client id')
+        parser.add_argument('--exclude-archived', action='store_true')
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **opts):
+        tasks = Task.objects.all()
+        if opts['client']:
+            tasks = tasks.filter(client_id=opts['client'])
+        if opts['exclude_archived']:
+            tasks = tasks.filter(is_archived=False)
+
+        layout = exports.Layout(serializers.TaskSerializer())
+        rows = exports.task_rows(tasks, layout, opts['chunk_size'])
+        if opts['format'] == 'csv':
+            lines = exports.csv_lines(rows, layout)
+        else:
+            lines = exports.ndjson_lines(rows)
+
+        count = 0
+        if opts['output']:
+            with io.open(opts['output'], 'w', encoding='utf-8', newline='') as out:
+                for line in lines:
+                    out.write(line)
+                    count += 1
+            # Less the CSV header
+            count -= 1 if opts['format'] == 'csv' else 0
+            self.stderr.write('Exported {} tasks to {}'.format(count, opts['output']))
+        else:
+            for line in lines:
+                self.stdout.write(line, ending='')
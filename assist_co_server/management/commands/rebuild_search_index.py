@@ -0,0 +1,21 @@
+from timeit import default_timer
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from assist_co_server import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the task full text search index from the tasks and contacts tables.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **opts):
+        if search.backend() is None:
+            raise CommandError('Full text search is not supported on {}'.format(search.connection().vendor))
+        started = default_timer()
+        with transaction.atomic():
+            count = search.rebuild(batch_size=opts['batch_size'])
+        self.stdout.write('Indexed {} tasks in {:.1f}s'.format(count, default_timer() - started))
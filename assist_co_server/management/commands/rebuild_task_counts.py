@@ -0,0 +1,16 @@
+from timeit import default_timer
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from assist_co_server import task_counts
+
+
+class Command(BaseCommand):
+    help = 'Recount the tasks of every assistant by state from the tasks table.'
+
+    def handle(self, *args, **opts):
+        started = default_timer()
+        with transaction.atomic():
+            count = task_counts.rebuild()
+        self.stdout.write('Wrote {} task counts in {:.1f}s'.format(count, default_timer() - started))
@@ -0,0 +1,42 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from assist_co_server import jobs
+
+
+class Command(BaseCommand):
+    help = ('Run the jobs queued in the jobs table on a thread pool, for the db jobs backend. '
+        'Several workers can run at once.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None,
+            help="Threads running jobs, JOBS['WORKERS'] by default. 0 runs them in this thread")
+        parser.add_argument('--batch-size', type=int, default=100, help='Jobs claimed at once')
+        parser.add_argument('--poll', type=float, default=1.0, help='Seconds to wait when no job is due')
+        parser.add_argument('--once', action='store_true', help='Exit once no job is due')
+
+    def handle(self, *args, **opts):
+        workers = jobs.get_setting('WORKERS') if opts['workers'] is None else opts['workers']
+        pool = ThreadPoolExecutor(max_workers=workers) if workers else None
+        succeeded = failed = 0
+        try:
+            while True:
+                claimed = jobs.claim(opts['batch_size'])
+                if pool is not None:
+                    results = list(pool.map(jobs.run_job_in_worker, claimed))
+                else:
+                    results = [jobs.run_job(job) for job in claimed]
+                succeeded += results.count(True)
+                failed += results.count(False)
+                if not claimed:
+                    if opts['once']:
+                        break
+                    time.sleep(opts['poll'])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        self.stdout.write('Ran {} jobs, {} failed'.format(succeeded + failed, failed))
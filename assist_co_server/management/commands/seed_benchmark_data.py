@@ -0,0 +1,110 @@
+import datetime
+import random
+from timeit import default_timer
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from assist_co_server import options
+from assist_co_server.models import Assistant, Client, Task, TASK_STATES
+
+
+class Command(BaseCommand):
+    help = ('Generate synthetic assistants, clients, tasks and contacts on top of the '
+        'seed.json option tables. Runs are reproducible for a given --seed.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=50)
+        parser.add_argument('--assistants', type=int, default=10)
+        parser.add_argument('--tasks-per-client', type=int, default=100)
+        parser.add_argument('--contacts-per-task', type=int, default=3)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--password', default='benchmark-password',
+            help='Password set on every generated user')
+
+    def handle(self, *args, **opts):
+        started = default_timer()
+        generate(
+            clients=opts['clients'],
+            assistants=opts['assistants'],
+            tasks_per_client=opts['tasks_per_client'],
+            contacts_per_task=opts['contacts_per_task'],
+            seed=opts['seed'],
+            password=opts['password'],
+        )
+        self.stdout.write('Generated data in {:.1f}s'.format(default_timer() - started))
+
+
+def generate(clients, assistants, tasks_per_client, contacts_per_task, seed=0, password='benchmark-password'):
+    """
+    Create the synthetic dataset, returns the created clients
+    """
+    rand = random.Random(seed)
+    # Hash once, PBKDF2 per user would dominate the run
+    password = make_password(password)
+    genders = options.genders.all()
+    professions = options.professions.all()
+    task_types = options.task_types.all()
+    states = [state for state, display in TASK_STATES]
+    prefix = 'bench{}'.format(seed)
+
+    with transaction.atomic():
+        # Multi-table inherited users can't be bulk inserted
+        assistant_objs = [
+            Assistant.objects.create(
+                username='{}-assistant-{}@assist.co'.format(prefix, i),
+                email='{}-assistant-{}@assist.co'.format(prefix, i),
+                password=password,
+                first_name='Assistant',
+                last_name=str(i),
+                gender=rand.choice(genders),
+                date_of_birth=datetime.date(1980 + i % 20, 1 + i % 12, 1 + i % 28),
+            )
+            for i in range(assistants)
+        ]
+        client_objs = [
+            Client.objects.create(
+                username='{}-client-{}@assist.co'.format(prefix, i),
+                email='{}-client-{}@assist.co'.format(prefix, i),
+                password=password,
+                first_name='Client',
+                last_name=str(i),
+                phone='+1555{}{:06d}'.format(seed % 10, i),
+                gender=rand.choice(genders),
+                profession=rand.choice(professions),
+                primary_assistant=rand.choice(assistant_objs) if assistant_objs else None,
+                date_of_birth=datetime.date(1960 + i % 40, 1 + i % 12, 1 + i % 28),
+            )
+            for i in range(clients)
+        ]
+
+        for client in client_objs:
+            tasks = []
+            for t in range(tasks_per_client):
+                state = rand.choice(states)
+                assistant = rand.choice(assistant_objs) if assistant_objs and state != 'ready' else None
+                tasks.append({
+                    'text': 'Task {} for client {}: {}'.format(t, client.id, rand.choice(WORDS)),
+                    'client_id': client.id,
+                    'assistant_id': assistant.id if assistant else None,
+                    'task_type_id': rand.choice(task_types).id,
+                    'state': state,
+                    'is_complete': state == 'completed',
+                    'contacts': [{
+                        'first_name': rand.choice(WORDS).title(),
+                        'last_name': rand.choice(WORDS).title(),
+                        'email': '{}-{}-{}-{}@example.com'.format(prefix, client.id, t, c),
+                        'phone': None,
+                        'client_id': client.id,
+                    } for c in range(contacts_per_task)],
+                })
+            Task.bulk_create_with_contacts(tasks)
+    return client_objs
+
+
+WORDS = (
+    'dinner', 'flight', 'dentist', 'invoice', 'meeting', 'birthday', 'gift',
+    'hotel', 'taxi', 'plumber', 'insurance', 'lunch', 'tickets', 'renewal',
+    'appointment', 'delivery', 'reservation', 'follow-up', 'contract', 'call',
+)
@@ -0,0 +1,96 @@
+import random
+import threading
+from timeit import default_timer
+
+from django.core.management.base import BaseCommand
+
+from assist_co_server.assignment import AssignmentEngine
+
+
+class ScanEngine(AssignmentEngine):
+    """
+    Baseline that looks for the least loaded assistant in every count for
+    each task, like recounting would
+    """
+    def _pick(self, primary_id, primary_max_load):
+        load = self.loads.get(primary_id)
+        if load is None or load >= primary_max_load:
+            if not self.loads:
+                return None
+            primary_id, load = min(self.loads.items(), key=lambda item: (item[1], item[0]))
+        self.loads[primary_id] = load + 1
+        return primary_id
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+class Command(BaseCommand):
+    help = ('Simulate bursts of new tasks assigned by the assignment engine from several threads, '
+        'against a baseline scanning every assistant per task. No database is used.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--assistants', type=int, default=50)
+        parser.add_argument('--clients', type=int, default=2000)
+        parser.add_argument('--tasks', type=int, default=50000)
+        parser.add_argument('--batch-size', type=int, default=500, help='Tasks per burst')
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--primary-share', type=float, default=0.7,
+            help='Share of the clients with a primary assistant')
+        parser.add_argument('--initial-load', type=int, default=10,
+            help='Assistants start with up to this many open tasks')
+        parser.add_argument('--primary-max-load', type=int, default=20)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **opts):
+        rng = random.Random(opts['seed'])
+        assistants = list(range(1, opts['assistants'] + 1))
+        loads = dict((assistant_id, rng.randint(0, opts['initial_load'])) for assistant_id in assistants)
+        primaries = [rng.choice(assistants) if rng.random() < opts['primary_share'] else None
+            for i in range(opts['clients'])]
+        tasks = [(task_id, rng.choice(primaries)) for task_id in range(opts['tasks'])]
+        batches = [tasks[i:i + opts['batch_size']] for i in range(0, len(tasks), opts['batch_size'])]
+
+        self.stdout.write('{} tasks in bursts of {} over {} assistants, {} threads'.format(
+            len(tasks), opts['batch_size'], len(assistants), opts['threads']))
+        self.stdout.write('{:<8} {:>10} {:>10} {:>10} {:>9} {:>9} {:>9}'.format(
+            'engine', 'tasks/s', 'p50 ms', 'p99 ms', 'primary', 'min load', 'max load'))
+        for name, engine_class in (('heap', AssignmentEngine), ('scan', ScanEngine)):
+            engine = engine_class(primary_max_load=opts['primary_max_load'])
+            engine.load(loads)
+            result = self.simulate(engine, batches, opts['threads'])
+            self.stdout.write('{:<8} {:>10.0f} {:>10.2f} {:>10.2f} {:>8.0%} {:>9} {:>9}'.format(
+                name, len(tasks) / result['seconds'],
+                percentile(result['latencies'], 0.5) * 1000, percentile(result['latencies'], 0.99) * 1000,
+                result['to_primary'] / float(len(tasks)), min(engine.loads.values()), max(engine.loads.values())))
+
+    def simulate(self, engine, batches, threads):
+        pending = list(reversed(batches))
+        lock = threading.Lock()
+        latencies = []
+        to_primary = [0]
+
+        def work():
+            while True:
+                with lock:
+                    if not pending:
+                        return
+                    batch = pending.pop()
+                started = default_timer()
+                plan = engine.plan(batch)
+                elapsed = default_timer() - started
+                primaries = dict(batch)
+                hits = sum(1 for assistant_id, ids in plan.items() for id in ids if primaries[id] == assistant_id)
+                with lock:
+                    latencies.append(elapsed)
+                    to_primary[0] += hits
+
+        started = default_timer()
+        workers = [threading.Thread(target=work) for i in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return {'seconds': default_timer() - started, 'latencies': latencies, 'to_primary': to_primary[0]}
@@ -0,0 +1,176 @@
+"""
+In-memory request metrics, rendered in the Prometheus text format by
+MetricsView. Populated by middleware.PerformanceMiddleware.
+"""
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from timeit import default_timer
+
+from django.db import connections
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERIES_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+BYTES_BUCKETS = (1000, 10000, 100000, 1000000, 10000000)
+
+# name -> (help, buckets)
+HISTOGRAMS = OrderedDict([
+    ('request_seconds', ('Wall time of the request', SECONDS_BUCKETS)),
+    ('db_seconds', ('Time spent executing database queries', SECONDS_BUCKETS)),
+    ('db_queries', ('Database queries per request', QUERIES_BUCKETS)),
+    ('serializer_seconds', ('Time spent in the view outside the database, mostly serializers', SECONDS_BUCKETS)),
+    ('render_seconds', ('Time spent rendering the response body', SECONDS_BUCKETS)),
+    ('response_bytes', ('Size of the response body', BYTES_BUCKETS)),
+])
+
+METRIC_PREFIX = 'assist_'
+
+
+class Histogram(object):
+    """
+    Fixed bucket histogram, buckets are upper bounds
+    """
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                break
+        else:
+            i = len(self.buckets)
+        self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            total += count
+            yield bound, total
+
+
+class Registry(object):
+    """
+    Histograms per (metric, view)
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+
+    def observe(self, view, values):
+        with self._lock:
+            for name, value in values.items():
+                key = (name, view)
+                histogram = self._histograms.get(key)
+                if histogram is None:
+                    histogram = self._histograms[key] = Histogram(HISTOGRAMS[name][1])
+                histogram.observe(value)
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+
+    def render(self, extra_counters=()):
+        """
+        Render every histogram, plus (name, help, value) counters, as
+        Prometheus text exposition format
+        """
+        lines = []
+        with self._lock:
+            for name, (help_text, buckets) in HISTOGRAMS.items():
+                views = sorted(view for metric, view in self._histograms if metric == name)
+                if not views:
+                    continue
+                metric = METRIC_PREFIX + name
+                lines.append('# HELP {} {}'.format(metric, help_text))
+                lines.append('# TYPE {} histogram'.format(metric))
+                for view in views:
+                    histogram = self._histograms[(name, view)]
+                    for bound, total in histogram.cumulative():
+                        lines.append('{}_bucket{{view="{}",le="{}"}} {}'.format(metric, view, bound, total))
+                    lines.append('{}_sum{{view="{}"}} {}'.format(metric, view, histogram.sum))
+                    lines.append('{}_count{{view="{}"}} {}'.format(metric, view, histogram.count))
+        for name, help_text, value in extra_counters:
+            metric = METRIC_PREFIX + name
+            lines.append('# HELP {} {}'.format(metric, help_text))
+            lines.append('# TYPE {} counter'.format(metric))
+            lines.append('{} {}'.format(metric, value))
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+class QueryTimer(object):
+    """
+    Counts and times the queries executed through the cursors it wraps
+    """
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def wrap(self, make_cursor):
+        def timed_make_cursor(cursor):
+            return TimedCursor(make_cursor(cursor), self)
+        return timed_make_cursor
+
+
+class TimedCursor(object):
+    def __init__(self, cursor, timer):
+        self.cursor = cursor
+        self.timer = timer
+
+    def _timed(self, method, *args):
+        start = default_timer()
+        try:
+            return method(*args)
+        finally:
+            self.timer.seconds += default_timer() - start
+            self.timer.count += 1
+
+    def execute(self, sql, params=None):
+        return self._timed(self.cursor.execute, sql, params)
+
+    def executemany(self, sql, param_list):
+        return self._timed(self.cursor.executemany, sql, param_list)
+
+    def callproc(self, procname, params=None):
+        return self._timed(self.cursor.callproc, procname, params)
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+
+@contextmanager
+def timing_queries(timer):
+    """
+    Route the cursors of this thread's connections through timer. Django 1.10
+    has no execute_wrapper so the cursor factories are shadowed per connection.
+    """
+    wrapped = []
+    for connection in connections.all():
+        if 'make_cursor' in connection.__dict__:
+            # Already timed further up the stack
+            continue
+        connection.make_cursor = timer.wrap(connection.make_cursor)
+        connection.make_debug_cursor = timer.wrap(connection.make_debug_cursor)
+        wrapped.append(connection)
+    try:
+        yield timer
+    finally:
+        for connection in wrapped:
+            del connection.make_cursor
+            del connection.make_debug_cursor
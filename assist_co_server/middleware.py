@@ -0,0 +1,88 @@
+import random
+from timeit import default_timer
+
+from django.conf import settings
+
+from assist_co_server import metrics
+
+DEFAULTS = {
+    'SAMPLE_RATE': 1.0,
+    'SERVER_TIMING': False,
+}
+
+
+class RequestSample(object):
+    def __init__(self):
+        self.view = None
+        self.view_started = None
+        self.view_finished = None
+        self.render_seconds = 0.0
+        self.queries = metrics.QueryTimer()
+
+
+class PerformanceMiddleware(object):
+    """
+    Records wall time, DB query count and time, serializer and render time
+    and response size per resolved view into metrics.registry.
+
+    Configured with settings.PERF_METRICS: SAMPLE_RATE is the fraction of
+    requests recorded (0 turns recording off), SERVER_TIMING adds a
+    Server-Timing header to sampled responses.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+        conf = dict(DEFAULTS, **getattr(settings, 'PERF_METRICS', {}))
+        self.sample_rate = conf['SAMPLE_RATE']
+        self.server_timing = conf['SERVER_TIMING']
+
+    def __call__(self, request):
+        if self.sample_rate <= 0 or (self.sample_rate < 1 and random.random() >= self.sample_rate):
+            return self.get_response(request)
+
+        sample = request._perf_sample = RequestSample()
+        start = default_timer()
+        with metrics.timing_queries(sample.queries):
+            response = self.get_response(request)
+        finished = default_timer()
+        wall = finished - start
+
+        values = {
+            'request_seconds': wall,
+            'db_seconds': sample.queries.seconds,
+            'db_queries': sample.queries.count,
+            'render_seconds': sample.render_seconds,
+        }
+        if sample.view_started is not None:
+            view_seconds = (sample.view_finished or finished) - sample.view_started
+            values['serializer_seconds'] = max(view_seconds - sample.queries.seconds, 0)
+        if not response.streaming:
+            values['response_bytes'] = len(response.content)
+        metrics.registry.observe(sample.view or 'unresolved', values)
+
+        if self.server_timing:
+            response['Server-Timing'] = ', '.join(
+                '{};dur={:.2f}'.format(name, values[key] * 1000) for name, key in (
+                    ('total', 'request_seconds'),
+                    ('db', 'db_seconds'),
+                    ('serializer', 'serializer_seconds'),
+                    ('render', 'render_seconds'),
+                ) if key in values
+            )
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        sample = getattr(request, '_perf_sample', None)
+        if sample is not None:
+            sample.view = getattr(view_func, 'view_class', view_func).__name__
+            sample.view_started = default_timer()
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered after the view returns
+        sample = getattr(request, '_perf_sample', None)
+        if sample is not None:
+            render_started = sample.view_finished = default_timer()
+
+            def rendered(response):
+                sample.render_seconds = default_timer() - render_started
+            response.add_post_render_callback(rendered)
+        return response
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.3 on 2026-10-18 18:56
+from __future__ import unicode_literals
+
+import assist_co_server.models
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assist_co_server', '0017_auto_20161208_0811'),
+    ]
+
+    operations = [
+        migrations.AlterModelManagers(
+            name='assistant',
+            managers=[
+                ('objects', assist_co_server.models.AssistantManager()),
+            ],
+        ),
+        migrations.AlterModelManagers(
+            name='client',
+            managers=[
+                ('objects', assist_co_server.models.ClientManager()),
+            ],
+        ),
+    ]
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.3 on 2026-10-18 18:58
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('assist_co_server', '0018_auto_20261018_1856'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='client',
+            index_together=set([('created_on', 'user_ptr')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='task',
+            index_together=set([('created_on', 'id'), ('client', 'is_archived', 'created_on', 'id')]),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.3 on 2026-10-18 19:06
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def blank_emails_to_null(apps, schema_editor):
+    # '' would collide once email is unique per client
+    Contact = apps.get_model('assist_co_server', 'Contact')
+    Contact.objects.filter(email='').update(email=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assist_co_server', '0019_auto_20261018_1858'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='client',
+            name='phone',
+            field=models.CharField(db_index=True, max_length=30, null=True),
+        ),
+        migrations.AlterField(
+            model_name='contact',
+            name='email',
+            field=models.EmailField(blank=True, max_length=254, null=True),
+        ),
+        migrations.RunPython(blank_emails_to_null, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='contact',
+            unique_together=set([('client', 'email')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='contact',
+            index_together=set([('client', 'phone')]),
+        ),
+    ]
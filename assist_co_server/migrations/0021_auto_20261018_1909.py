@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.3 on 2026-10-18 19:09
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assist_co_server', '0020_auto_20261018_1906'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='task',
+            index_together=set([('created_on', 'id'), ('client', 'is_archived', 'created_on', 'id'), ('assistant', 'state'), ('client', 'is_archived', 'state')]),
+        ),
+    ]
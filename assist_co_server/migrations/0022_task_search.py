@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+# Full text index of assist_co_server/search.py, filled by
+# `python manage.py rebuild_search_index` and kept in sync by signals
+CREATE_SQL = {
+    'sqlite': [
+        "CREATE VIRTUAL TABLE task_search USING fts5(client, body, tokenize='unicode61 remove_diacritics 1')",
+    ],
+    'postgresql': [
+        'CREATE TABLE task_search (task_id integer PRIMARY KEY, client_id integer NOT NULL, document tsvector NOT NULL)',
+        'CREATE INDEX task_search_document ON task_search USING GIN (document)',
+        'CREATE INDEX task_search_client_id ON task_search (client_id)',
+    ],
+}
+
+
+def create_task_search(apps, schema_editor):
+    for sql in CREATE_SQL.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(sql)
+
+
+def drop_task_search(apps, schema_editor):
+    if schema_editor.connection.vendor in CREATE_SQL:
+        schema_editor.execute('DROP TABLE task_search')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assist_co_server', '0021_auto_20261018_1909'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_task_search, drop_task_search),
+    ]
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.3 on 2026-10-18 19:15
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assist_co_server', '0022_task_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tombstone',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(choices=[('task', 'task'), ('contact', 'contact')], max_length=20)),
+                ('object_id', models.IntegerField()),
+                ('deleted_on', models.DateTimeField(auto_now_add=True)),
+                ('client', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, to='assist_co_server.Client')),
+            ],
+            options={
+                'db_table': 'tombstones',
+            },
+        ),
+        migrations.AlterIndexTogether(
+            name='contact',
+            index_together=set([('client', 'phone'), ('client', 'updated_on', 'id')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='task',
+            index_together=set([('client', 'is_archived', 'created_on', 'id'), ('client', 'updated_on', 'id'), ('assistant', 'state'), ('client', 'is_archived', 'state'), ('created_on', 'id')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='tombstone',
+            index_together=set([('client', 'deleted_on', 'id')]),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.3 on 2026-10-18 19:21
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assist_co_server', '0023_auto_20261018_1915'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='assistant',
+            name='thumbnail_format',
+            field=models.CharField(blank=True, default='', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='client',
+            name='thumbnail_format',
+            field=models.CharField(blank=True, default='', max_length=10),
+        ),
+    ]
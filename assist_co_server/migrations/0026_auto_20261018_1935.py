@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.3 on 2026-10-18 19:35
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def count_tasks(apps, schema_editor):
+    Task = apps.get_model('assist_co_server', 'Task')
+    AssistantTaskCount = apps.get_model('assist_co_server', 'AssistantTaskCount')
+    rows = (Task.objects.filter(assistant__isnull=False, is_archived=False)
+        .values_list('assistant_id', 'state').annotate(count=models.Count('id')).order_by())
+    AssistantTaskCount.objects.bulk_create(
+        AssistantTaskCount(assistant_id=assistant_id, state=state, count=count)
+        for assistant_id, state, count in rows)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assist_co_server', '0025_auto_20261018_1924'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AssistantTaskCount',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('state', models.CharField(choices=[('ready', 'ready'), ('executing', 'executing'), ('completed', 'completed'), ('terminated', 'terminated')], max_length=100)),
+                ('count', models.IntegerField(default=0)),
+                ('assistant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='assist_co_server.Assistant')),
+            ],
+            options={
+                'db_table': 'assistant_task_counts',
+            },
+        ),
+        migrations.AlterIndexTogether(
+            name='task',
+            index_together=set([('client', 'updated_on', 'id'), ('client', 'is_archived', 'created_on', 'id'), ('created_on', 'id'), ('assistant', 'state', 'created_on', 'id'), ('client', 'is_archived', 'state')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='assistanttaskcount',
+            unique_together=set([('assistant', 'state')]),
+        ),
+        migrations.RunPython(count_tasks, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.3 on 2026-10-18 19:38
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+# Emails are unique whatever their case, see models.taken_identities. Users
+# without an email (superusers) are left out.
+CREATE_EMAIL_INDEX = "CREATE UNIQUE INDEX auth_user_email_lower ON auth_user (lower(email)) WHERE email <> ''"
+
+DUPLICATE_EMAILS = "SELECT lower(email) FROM auth_user WHERE email <> '' GROUP BY 1 HAVING count(*) > 1 ORDER BY 1"
+DUPLICATE_PHONES = "SELECT phone FROM clients WHERE phone IS NOT NULL GROUP BY 1 HAVING count(*) > 1 ORDER BY 1"
+
+
+def find_duplicates(connection):
+    """
+    Emails, lowercased, and client phones held by more than one user
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(DUPLICATE_EMAILS)
+        emails = [row[0] for row in cursor.fetchall()]
+        cursor.execute(DUPLICATE_PHONES)
+        phones = [row[0] for row in cursor.fetchall()]
+    return emails, phones
+
+
+def check_duplicates(apps, schema_editor):
+    # Fail with the values to fix rather than with the index's IntegrityError
+    emails, phones = find_duplicates(schema_editor.connection)
+    if emails or phones:
+        raise RuntimeError(
+            'Emails and client phones must be unique before migrating, fix the users holding these first. '
+            'Duplicate emails: {}. Duplicate phones: {}.'.format(
+                ', '.join(emails) or 'none', ', '.join(phones) or 'none'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assist_co_server', '0026_auto_20261018_1935'),
+        ('auth', '0008_alter_user_username_max_length'),
+    ]
+
+    operations = [
+        migrations.RunPython(check_duplicates, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='client',
+            name='phone',
+            field=models.CharField(max_length=30, null=True, unique=True),
+        ),
+        migrations.RunSQL([CREATE_EMAIL_INDEX], ['DROP INDEX auth_user_email_lower']),
+    ]
@@ -1,18 +1,52 @@
 from __future__ import unicode_literals
 
-from django.db import models
+from collections import OrderedDict
+
+from django.db import connections, models, router, transaction
 from django.conf import settings
 from django.contrib.auth.models import User, UserManager
-from django.dispatch import receiver
+from django.dispatch import Signal, receiver
+from django.utils import timezone
 
 from phonenumber_field.modelfields import PhoneNumberField
 from rest_framework.authtoken.models import Token
 
+from assist_co_server import db
+
 TASK_STATES = (('ready','ready'), 
     ('executing','executing'), 
     ('completed','completed'), 
     ('terminated','terminated'))
 
+# State -> states a task can move to from it
+TASK_TRANSITIONS = {
+    'ready': ('executing', 'terminated'),
+    'executing': ('ready', 'completed', 'terminated'),
+    'completed': (),
+    'terminated': (),
+}
+
+# Max values bound in a single `__in` lookup
+IN_CHUNK_SIZE = 500
+
+# Sent by Task.bulk_create_with_contacts, which sends no post_save
+tasks_bulk_created = Signal(providing_args=['tasks'])
+
+# Sent by TaskQuerySet.transition, which sends no post_save
+task_transitioned = Signal(providing_args=['task', 'state', 'previous_state', 'previous_assistant_id'])
+
+class InvalidTransition(ValueError):
+    pass
+
+class TransitionConflict(Exception):
+    """
+    The task was not in a state the transition starts from, state is the
+    state it is in
+    """
+    def __init__(self, state):
+        super(TransitionConflict, self).__init__('Task is {}'.format(state))
+        self.state = state
+
 ### Constants ###
 
 class TaskType(models.Model):
@@ -48,10 +82,128 @@ class Gender(models.Model):
     def __unicode__(self):
         return '%s' % (self.display)
 
+### Querysets ###
+
+# TaskSerializer field -> relations it renders
+TASK_RELATED_FIELDS = (
+    ('task_type', ('task_type',)),
+    ('client', ('client__gender', 'client__profession', 'client__primary_assistant__gender')),
+    ('assistant', ('assistant__gender',)),
+)
+
+class TaskQuerySet(models.QuerySet):
+    def with_related(self, fields=None):
+        """
+        Eager load every relation rendered by TaskSerializer so a page of
+        tasks costs the same number of queries no matter how many rows it has.
+        When fields is given only the relations of those serializer fields
+        are joined.
+        """
+        related = [name for field, names in TASK_RELATED_FIELDS
+            if fields is None or field in fields for name in names]
+        queryset = self
+        if related:
+            queryset = queryset.select_related(*related)
+        if fields is None or 'contacts' in fields:
+            queryset = queryset.prefetch_related('contacts')
+        return queryset
+
+    def transition(self, task_id, state, expected=None, assistant_id=None):
+        """
+        Move a task of this queryset to state with a conditional UPDATE from
+        expected, or else from each state TASK_TRANSITIONS allows in turn, and
+        keep is_complete and completed_on in step. assistant_id also assigns the
+        task. Returns the task read back through this queryset.
+
+        Raises InvalidTransition for a transition TASK_TRANSITIONS doesn't
+        have, TransitionConflict when the task is in another state, e.g. taken
+        by a concurrent transition, and Task.DoesNotExist.
+        """
+        if expected is not None:
+            if state not in TASK_TRANSITIONS.get(expected, ()):
+                raise InvalidTransition('Tasks can\'t go from {} to {}'.format(expected, state))
+            sources = [expected]
+        else:
+            sources = [source for source, label in TASK_STATES if state in TASK_TRANSITIONS[source]]
+            if not sources:
+                raise InvalidTransition('Tasks can\'t go to {}'.format(state))
+        now = timezone.now()
+        values = {
+            'state': state,
+            'is_complete': state == 'completed',
+            'completed_on': now if state == 'completed' else None,
+            'updated_on': now,
+        }
+        with transaction.atomic(using=self.db):
+            previous_assistant_id = None
+            if assistant_id is not None:
+                values['assistant_id'] = assistant_id
+                # Only for the receivers, the UPDATE below is still conditional
+                db.lock_for_write(self.db)
+                previous_assistant_id = (self.select_for_update().filter(pk=task_id)
+                    .values_list('assistant_id', flat=True).first())
+            # One state per UPDATE so receivers know which one the task left
+            for previous_state in sources:
+                if self.filter(pk=task_id, state=previous_state).update(**values):
+                    break
+            else:
+                current = self.filter(pk=task_id).values_list('state', flat=True).first()
+                if current is None:
+                    raise self.model.DoesNotExist('No task {}'.format(task_id))
+                raise TransitionConflict(current)
+            task = self.get(pk=task_id)
+            if assistant_id is None:
+                previous_assistant_id = task.assistant_id
+            task_transitioned.send(sender=self.model, task=task, state=state, previous_state=previous_state,
+                previous_assistant_id=previous_assistant_id)
+        return task
+
+class AssistantManager(UserManager):
+    def with_related(self):
+        """
+        Eager load the relations rendered by AssistantSerializer
+        """
+        return self.get_queryset().select_related('gender')
+
+class ClientManager(UserManager):
+    def with_related(self):
+        """
+        Eager load the relations rendered by ClientSerializer
+        """
+        return self.get_queryset().select_related(
+            'gender',
+            'profession',
+            'primary_assistant__gender',
+        )
+
+def taken_identities(email=None, phone=None, exclude_id=None):
+    """
+    Which of email, compared lowercased, and phone already belong to a user
+    other than exclude_id, as a set of 'email' and 'phone'. One query, served
+    by the unique auth_user_email_lower and clients.phone indexes.
+    """
+    with connections[router.db_for_read(User)].cursor() as cursor:
+        cursor.execute(*taken_identities_sql(email, phone, exclude_id))
+        email_taken, phone_taken = cursor.fetchone()
+    return set(name for name, taken in (('email', email_taken), ('phone', phone_taken)) if taken)
+
+def users_by_email(email):
+    """
+    Users whose email is email whatever its case, served by the unique
+    auth_user_email_lower index
+    """
+    return User.objects.extra(where=["lower(email) = %s AND email <> ''"], params=[email.lower()])
+
+def taken_identities_sql(email=None, phone=None, exclude_id=None):
+    # email <> '' matches the partial index, users without email aren't unique
+    return ("SELECT EXISTS (SELECT 1 FROM auth_user WHERE lower(email) = %s AND email <> '' AND id <> %s), "
+        "EXISTS (SELECT 1 FROM clients WHERE phone = %s AND user_ptr_id <> %s)",
+        [(email or '').lower(), exclude_id or 0, phone, exclude_id or 0])
+
 ### Models ###
 
 def upload_to(instance, filename):
-    return 'user_profile_image/{}/{}'.format(instance.user_id, filename)
+    return 'user_profile_image/{}/{}'.format(instance.pk, filename)
 
 class Assistant(User):
     class Meta:
@@ -60,23 +212,31 @@ class Assistant(User):
     created_on = models.DateTimeField(auto_now_add=True)
     updated_on = models.DateTimeField(auto_now=True)
     profile_pic = models.ImageField(blank=True, null=True, upload_to=upload_to)
+    # Format of the profile_pic thumbnails, blank until they are generated
+    thumbnail_format = models.CharField(max_length=10, blank=True, default='')
     date_of_birth = models.DateField(null=False)
     # Use UserManager to get the create_user method, etc.
-    objects = UserManager()
+    objects = AssistantManager()
 
 class Client(User):
     class Meta:
         db_table = 'clients'
+        index_together = (
+            # Keyset pagination
+            ('created_on', 'user_ptr'),
+        )
     primary_assistant = models.ForeignKey(Assistant, null=True)
-    phone = models.CharField(max_length=30, null=True)
+    phone = models.CharField(max_length=30, null=True, unique=True)
     profession = models.ForeignKey(Profession)
     created_on = models.DateTimeField(auto_now_add=True)
     updated_on = models.DateTimeField(auto_now=True)
     profile_pic = models.ImageField(blank=True, null=True, upload_to=upload_to)
+    # Format of the profile_pic thumbnails, blank until they are generated
+    thumbnail_format = models.CharField(max_length=10, blank=True, default='')
     date_of_birth = models.DateField(null=False)
     gender = models.ForeignKey(Gender, null=False)
     # Use UserManager to get the create_user method, etc.
-    objects = UserManager()
+    objects = ClientManager()
 
     def __unicode__(self):
         return '{} {}'.format(self.first_name, self.last_name)
@@ -90,9 +250,18 @@ class Client(User):
 class Contact(models.Model):
     class Meta:
         db_table = 'contacts'
+        # Contacts are looked up per client by email, or by phone without email
+        unique_together = (
+            ('client', 'email'),
+        )
+        index_together = (
+            ('client', 'phone'),
+            # Changes since a watermark, see sync.py
+            ('client', 'updated_on', 'id'),
+        )
     first_name = models.CharField(max_length=100)
     last_name = models.CharField(max_length=100)
-    email = models.EmailField(unique=True)
+    email = models.EmailField(null=True, blank=True)
     phone = models.CharField(max_length=30, null=True)
     created_on = models.DateTimeField(auto_now_add=True)
     updated_on = models.DateTimeField(auto_now=True)
@@ -103,24 +272,82 @@ class Contact(models.Model):
         """
         Create contact object if it doesn't already exist
         """
-        if contact_attrs['email']:
-            try:
-                contact = self.objects.get(email=contact_attrs['email'], client_id=contact_attrs['client_id'])
-                return contact
-            except :
-                # create contact
-                return self.objects.create(**contact_attrs)
-        else:
-            try:
-                contact = self.objects.get(phone=contact_attrs['phone'], client_id=contact_attrs['client_id'])
-                return contact
-            except:
-                # create contact
-                return self.objects.create(**contact_attrs)
+        return self.bulk_get_or_create(contact_attrs['client_id'], [contact_attrs])[0]
+
+    @classmethod
+    def bulk_get_or_create(self, client_id, contacts_attrs):
+        """
+        Get or create the client's contacts matching each set of attrs, by
+        email or by phone when there is no email. Runs a fixed number of
+        queries however many contacts are passed and returns the contacts in
+        the order of contacts_attrs. Attrs with neither email nor phone match
+        no contact, each of them creates a new one with its own query.
+        """
+        keys = [self._lookup_key(attrs) for attrs in contacts_attrs]
+        contacts = self._find_by_keys(client_id, set(key for key in keys if key is not None))
+
+        missing = OrderedDict()
+        for key, attrs in zip(keys, contacts_attrs):
+            if key is not None and key not in contacts and key not in missing:
+                missing[key] = self(**self._fields(client_id, attrs))
+        if missing:
+            created = self.objects.bulk_create(missing.values())
+            if all(contact.pk is not None for contact in created):
+                contacts.update(zip(missing.keys(), created))
+            else:
+                # Backend can't return ids from a bulk insert, read them back
+                contacts.update(self._find_by_keys(client_id, set(missing.keys())))
+        return [contacts[key] if key is not None else self.objects.create(**self._fields(client_id, attrs))
+            for key, attrs in zip(keys, contacts_attrs)]
+
+    @staticmethod
+    def _fields(client_id, attrs):
+        return {
+            'first_name': attrs.get('first_name', ''),
+            'last_name': attrs.get('last_name', ''),
+            'email': attrs.get('email') or None,
+            'phone': attrs.get('phone') or None,
+            'client_id': client_id,
+        }
+
+    @staticmethod
+    def _lookup_key(attrs):
+        """
+        ('email', email), ('phone', phone) without email, or None without either
+        """
+        if attrs.get('email'):
+            return ('email', attrs['email'])
+        if attrs.get('phone'):
+            return ('phone', attrs['phone'])
+        return None
+
+    @classmethod
+    def _find_by_keys(self, client_id, keys):
+        emails = [value for field, value in keys if field == 'email']
+        phones = [value for field, value in keys if field == 'phone']
+        found = {}
+        for field, values in (('email', emails), ('phone', phones)):
+            # Keep IN lists under SQLite's bound parameter limit
+            for i in range(0, len(values), IN_CHUNK_SIZE):
+                lookup = {'client_id': client_id, field + '__in': values[i:i + IN_CHUNK_SIZE]}
+                for contact in self.objects.filter(**lookup).order_by('id'):
+                    found.setdefault((field, getattr(contact, field)), contact)
+        return found
 
 class Task(models.Model):
     class Meta:
         db_table = 'tasks'
+        index_together = (
+            # Keyset pagination over all tasks and over a client's tasks
+            ('created_on', 'id'),
+            ('client', 'is_archived', 'created_on', 'id'),
+            # TaskFilterBackend
+            ('client', 'is_archived', 'state'),
+            # TaskFilterBackend and the assistant queue
+            ('assistant', 'state', 'created_on', 'id'),
+            # Changes since a watermark, see sync.py
+            ('client', 'updated_on', 'id'),
+        )
     client = models.ForeignKey(Client)
     assistant = models.ForeignKey(Assistant, null=True, blank=True)
     text = models.TextField()
@@ -135,3 +362,125 @@ class Task(models.Model):
     completed_on = models.DateTimeField(null=True)
     created_on = models.DateTimeField(auto_now_add=True)
     updated_on = models.DateTimeField(auto_now=True)
+
+    objects = TaskQuerySet.as_manager()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        task = super(Task, cls).from_db(db, field_names, values)
+        # Compared on save, see task_counts.py
+        task._loaded_values = dict(zip(field_names, values))
+        return task
+
+    def save(self, *args, **kwargs):
+        # post_save receivers write in the same transaction as the task
+        with transaction.atomic(using=kwargs.get('using') or router.db_for_write(type(self), instance=self)):
+            super(Task, self).save(*args, **kwargs)
+
+    @classmethod
+    def bulk_create_with_contacts(self, tasks_attrs):
+        """
+        Insert many tasks with their contacts using bulk inserts for the tasks,
+        the contacts and the M2M rows. Each attrs dict holds the Task field
+        values plus a `contacts` list of attrs for Contact.bulk_get_or_create.
+        Must run inside a transaction.
+        """
+        tasks = []
+        contacts_by_client = OrderedDict()
+        for attrs in tasks_attrs:
+            attrs = dict(attrs)
+            contacts_attrs = attrs.pop('contacts', [])
+            tasks.append(self(**attrs))
+            for contact_attrs in contacts_attrs:
+                contacts_by_client.setdefault(contact_attrs['client_id'], []).append(contact_attrs)
+        self._bulk_insert(tasks)
+
+        contacts = {}
+        for client_id, contacts_attrs in contacts_by_client.items():
+            contacts[client_id] = iter(Contact.bulk_get_or_create(client_id, contacts_attrs))
+
+        through = self.contacts.through
+        links = OrderedDict()
+        for task, attrs in zip(tasks, tasks_attrs):
+            for contact_attrs in attrs.get('contacts', []):
+                contact = next(contacts[contact_attrs['client_id']])
+                links[(task.id, contact.id)] = through(task_id=task.id, contact_id=contact.id)
+        through.objects.bulk_create(links.values())
+        tasks_bulk_created.send(sender=self, tasks=tasks)
+        return tasks
+
+    @classmethod
+    def _bulk_insert(self, tasks):
+        connection = connections[self.objects.db]
+        assert connection.in_atomic_block, 'Task inserts must run inside a transaction'
+        if connection.features.can_return_ids_from_bulk_insert:
+            self.objects.bulk_create(tasks)
+        elif connection.vendor == 'sqlite':
+            self.objects.bulk_create(tasks)
+            # SQLite holds the write lock from the first insert until commit and
+            # ids are AUTOINCREMENT, so this batch owns the highest ids in order
+            ids = self.objects.order_by('-id').values_list('id', flat=True)[:len(tasks)]
+            for task, id in zip(tasks, sorted(ids)):
+                task.id = id
+        else:
+            for task in tasks:
+                task.save(force_insert=True)
+
+class Tombstone(models.Model):
+    """
+    Record of a deleted Task or Contact, so clients syncing changes can drop
+    their copy. Archived tasks are reported from the tasks table.
+    """
+    class Meta:
+        db_table = 'tombstones'
+        index_together = (
+            ('client', 'deleted_on', 'id'),
+        )
+    MODELS = (('task', 'task'), ('contact', 'contact'))
+    model = models.CharField(choices=MODELS, max_length=20)
+    object_id = models.IntegerField()
+    # No constraint, the client may be deleted in the same cascade
+    client = models.ForeignKey(Client, db_constraint=False, on_delete=models.DO_NOTHING)
+    deleted_on = models.DateTimeField(auto_now_add=True)
+
+class Job(models.Model):
+    """
+    Queued call of a function registered with assist_co_server.jobs, run by
+    `python manage.py run_jobs` when the jobs backend is db
+    """
+    class Meta:
+        db_table = 'jobs'
+        index_together = (
+            ('state', 'run_after', 'id'),
+        )
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    FAILED = 'failed'
+    STATES = ((QUEUED, QUEUED), (RUNNING, RUNNING), (FAILED, FAILED))
+    name = models.CharField(max_length=200)
+    args = models.TextField(default='[]')
+    state = models.CharField(choices=STATES, default=QUEUED, max_length=10)
+    attempts = models.PositiveIntegerField(default=0)
+    run_after = models.DateTimeField()
+    # A running job past this is taken to have lost its worker
+    locked_until = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True, default='')
+    created_on = models.DateTimeField(auto_now_add=True)
+    updated_on = models.DateTimeField(auto_now=True)
+
+    def __unicode__(self):
+        return '%s %s' % (self.name, self.state)
+
+class AssistantTaskCount(models.Model):
+    """
+    Number of unarchived tasks of an assistant in a state, kept current by
+    task_counts.py in the same transaction as the task writes
+    """
+    class Meta:
+        db_table = 'assistant_task_counts'
+        unique_together = (
+            ('assistant', 'state'),
+        )
+    assistant = models.ForeignKey(Assistant, on_delete=models.CASCADE)
+    state = models.CharField(choices=TASK_STATES, max_length=100)
+    count = models.IntegerField(default=0)
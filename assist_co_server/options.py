@@ -0,0 +1,100 @@
+"""
+Process local registry for the constant option tables (Gender, Profession,
+TaskType). Each table is loaded once per process and reloaded lazily after a
+save or delete of one of its rows.
+"""
+import hashlib
+import threading
+
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from assist_co_server.models import Gender, Profession, TaskType
+
+
+class OptionTable(object):
+    """
+    Cached copy of an option table keyed by permalink and by id
+    """
+    def __init__(self, model):
+        self.model = model
+        self._lock = threading.Lock()
+        self._loaded = None
+
+    def _load(self):
+        loaded = self._loaded
+        if loaded is not None:
+            return loaded
+        with self._lock:
+            if self._loaded is None:
+                rows = list(self.model.objects.order_by('sort', 'id'))
+                digest = hashlib.md5()
+                for row in rows:
+                    digest.update('{}:{}:{}:{};'.format(
+                        row.id, row.permalink, row.sort, row.display).encode('utf-8'))
+                self._loaded = {
+                    'rows': rows,
+                    'by_permalink': dict((row.permalink, row) for row in rows),
+                    'by_id': dict((row.id, row) for row in rows),
+                    'etag': digest.hexdigest(),
+                }
+            return self._loaded
+
+    def all(self):
+        """
+        Return every row ordered by sort
+        """
+        return list(self._load()['rows'])
+
+    def get(self, permalink):
+        """
+        Return the row for the permalink or None
+        """
+        return self._load()['by_permalink'].get(permalink)
+
+    def get_by_id(self, id):
+        """
+        Return the row for the id or None
+        """
+        return self._load()['by_id'].get(id)
+
+    def contains(self, permalink):
+        return permalink in self._load()['by_permalink']
+
+    @property
+    def etag(self):
+        """
+        Digest of the table content, identical across processes holding the
+        same rows
+        """
+        return self._load()['etag']
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded = None
+
+
+genders = OptionTable(Gender)
+professions = OptionTable(Profession)
+task_types = OptionTable(TaskType)
+
+TABLES = {
+    Gender: genders,
+    Profession: professions,
+    TaskType: task_types,
+}
+
+
+def invalidate_all():
+    for table in TABLES.values():
+        table.invalidate()
+
+
+@receiver(post_save, sender=Gender)
+@receiver(post_save, sender=Profession)
+@receiver(post_save, sender=TaskType)
+@receiver(post_delete, sender=Gender)
+@receiver(post_delete, sender=Profession)
+@receiver(post_delete, sender=TaskType)
+def invalidate_option_table(sender, **kwargs):
+    TABLES[sender].invalidate()
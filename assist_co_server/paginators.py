@@ -1,6 +1,158 @@
-from rest_framework.pagination import PageNumberPagination
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+
+from django.core.paginator import Paginator
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination, _positive_int
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 
 class StandardResultsSetPagination(PageNumberPagination):
     page_size = 20
-    page_size_query_param = 'page'
-    max_page_size = 20
\ No newline at end of file
+    page_size_query_param = 'page_size'
+    max_page_size = 20
+
+class CountedPaginator(Paginator):
+    """
+    Paginator given its object count instead of running COUNT(*)
+    """
+    def __init__(self, object_list, per_page, count, **kwargs):
+        super(CountedPaginator, self).__init__(object_list, per_page, **kwargs)
+        # Fills the count cached_property
+        self.__dict__['count'] = count
+
+class CountedPagination(StandardResultsSetPagination):
+    """
+    Page number pagination for lists whose length the view already knows,
+    from view.get_count()
+    """
+    def paginate_queryset(self, queryset, request, view=None):
+        count = view.get_count()
+        self.django_paginator_class = lambda object_list, per_page: CountedPaginator(object_list, per_page, count)
+        return super(CountedPagination, self).paginate_queryset(queryset, request, view=view)
+
+class KeysetPagination(BasePagination):
+    """
+    Newest first pagination keyed on (created_on, pk). Each page is a range
+    scan from the previous page's last row, so there is no COUNT(*) and no
+    OFFSET and deep pages cost the same as the first one.
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 20
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        position = self.decode_cursor(request)
+
+        queryset = queryset.order_by('-created_on', '-pk')
+        if position is not None:
+            created_on, pk = position
+            # (created_on, pk) < position, written so created_on stays a range predicate
+            queryset = (queryset
+                .filter(created_on__lte=created_on)
+                .exclude(created_on=created_on, pk__gte=pk))
+
+        results = list(queryset[:self.page_size + 1])
+        self.page = results[:self.page_size]
+        self.has_next = len(results) > self.page_size
+        return self.page
+
+    def get_page_size(self, request):
+        try:
+            return _positive_int(
+                request.query_params[self.page_size_query_param],
+                strict=True,
+                cutoff=self.max_page_size
+            )
+        except (KeyError, ValueError):
+            return self.page_size
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            created_on, pk = urlsafe_b64decode(encoded.encode('ascii')).decode('ascii').split('|')
+            created_on = parse_datetime(created_on)
+            pk = int(pk)
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if created_on is None:
+            raise NotFound(self.invalid_cursor_message)
+        return created_on, pk
+
+    def encode_cursor(self, instance):
+        position = '{}|{}'.format(instance.created_on.isoformat(), instance.pk)
+        return urlsafe_b64encode(position.encode('ascii')).decode('ascii')
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.page[-1]))
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data)
+        ]))
+
+class RankedPagination(KeysetPagination):
+    """
+    Offset pagination for ranked results that can't be keyed, like search
+    hits. One extra row is fetched to know if there is a next page, so there
+    is no COUNT(*).
+    """
+    offset_query_param = 'offset'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        try:
+            self.offset = _positive_int(request.query_params[self.offset_query_param])
+        except (KeyError, ValueError):
+            self.offset = 0
+
+        results = list(queryset[self.offset:self.offset + self.page_size + 1])
+        self.page = results[:self.page_size]
+        self.has_next = len(results) > self.page_size
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.offset_query_param, self.offset + self.page_size)
+
+class StandardOrKeysetPagination(BasePagination):
+    """
+    Page number pagination unless the request opts into keyset pagination by
+    passing a `cursor` query param (empty for the first page)
+    """
+    page_number_class = StandardResultsSetPagination
+    keyset_class = KeysetPagination
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.keyset_class.cursor_query_param in request.query_params:
+            self.paginator = self.keyset_class()
+        else:
+            self.paginator = self.page_number_class()
+        return self.paginator.paginate_queryset(queryset, request, view=view)
+
+    def get_paginated_response(self, data):
+        return self.paginator.get_paginated_response(data)
+
+    @property
+    def display_page_controls(self):
+        return getattr(self.paginator, 'display_page_controls', False)
+
+    def to_html(self):
+        return self.paginator.to_html()
+
+    def get_results(self, data):
+        return self.paginator.get_results(data)
@@ -0,0 +1,107 @@
+"""
+JSON renderer and parser of the API, selected in settings.REST_FRAMEWORK:
+
+    'DEFAULT_RENDERER_CLASSES': (
+        'assist_co_server.renderers.JSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+    'DEFAULT_PARSER_CLASSES': (
+        'assist_co_server.renderers.JSONParser',
+        ...
+    ),
+
+Both use orjson when it is installed (`pip install orjson`), and the
+standard library json module otherwise. The output is the same as DRF's
+JSONRenderer with the default COMPACT_JSON and UNICODE_JSON settings: values
+json can't encode go through DRF's JSONEncoder.default() and U+2028/U+2029
+are escaped. Pretty printed responses (?indent= in the Accept header and
+the browsable API) are left to DRF's renderer.
+"""
+import json
+
+from django.conf import settings
+from django.utils import six
+from rest_framework import parsers, renderers
+from rest_framework.exceptions import ParseError
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Escaped so the output is a strict JavaScript subset, like DRF does
+LINE_SEPARATORS = (('\u2028', '\\u2028'), ('\u2029', '\\u2029'))
+
+_default = JSONEncoder().default
+
+
+class _StdlibEncoder(json.JSONEncoder):
+    def default(self, obj):
+        return _default(obj)
+
+
+# Serializer output has no cycles, skipping the check saves a lookup per container
+_stdlib_encoder = _StdlibEncoder(ensure_ascii=False, check_circular=False, separators=(',', ':'))
+
+
+def _escape(content, separators):
+    for char, escaped in separators:
+        if char in content:
+            content = content.replace(char, escaped)
+    return content
+
+
+if orjson is not None:
+    ENCODER = 'orjson'
+    # Dates go through DRF's default() for the same output
+    _orjson_options = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+    _byte_separators = tuple((char.encode('utf-8'), escaped.encode('utf-8')) for char, escaped in LINE_SEPARATORS)
+
+    def dumps(data):
+        return _escape(orjson.dumps(data, default=_default, option=_orjson_options), _byte_separators)
+
+    def loads(content):
+        return orjson.loads(content)
+else:
+    ENCODER = 'json'
+
+    def dumps(data):
+        return _escape(_stdlib_encoder.encode(data), LINE_SEPARATORS).encode('utf-8')
+
+    def loads(content):
+        if isinstance(content, bytes):
+            content = content.decode('utf-8')
+        return json.loads(content)
+
+
+class JSONRenderer(renderers.JSONRenderer):
+    """
+    Renders with dumps(), compact responses only
+    """
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return bytes()
+        if not self.compact or self.ensure_ascii or \
+                self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super(JSONRenderer, self).render(data, accepted_media_type, renderer_context)
+        return dumps(data)
+
+
+class JSONParser(parsers.JSONParser):
+    """
+    Parses with loads()
+    """
+    renderer_class = JSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+
+        try:
+            content = stream.read()
+            if encoding.lower().replace('-', '') != 'utf8':
+                content = content.decode(encoding)
+            return loads(content)
+        except ValueError as exc:
+            raise ParseError('JSON parse error - %s' % six.text_type(exc))
@@ -0,0 +1,194 @@
+"""
+Cache of the rendered pages of a client's task list (ClientTasksView).
+
+JSON pages are cached under their client id, query params and format
+together with the client's version and the global version. HTML pages of
+the browsable API aren't, they show the requesting user. A write to one of
+the client's tasks or contacts, or to the client itself, which tasks render
+nested, gives the client a new random version. A write to any assistant or
+option table, which every client's tasks can render, gives a new global
+version. Older pages are never read again and expire with their TTL.
+
+The receivers below change the versions right after the write and again
+when its transaction commits, as a read in between could cache rows the
+write hadn't committed yet. QuerySet.update() sends no signal: code updating
+tasks, contacts, clients or assistants that way calls bump(), bump_user() or
+bump_all() itself.
+
+Configured with settings.RESPONSE_CACHE:
+
+    RESPONSE_CACHE = {
+        'CACHE_ALIAS': 'responses',     # Django cache alias, None disables caching
+        'TTL': 300,                     # seconds a page and a version are kept
+        'MAX_BODY_BYTES': 256 * 1024,   # larger pages aren't cached
+    }
+
+Any cache backend works, the local memory one for a single process and the
+file or database one to share pages between processes. Memory is bounded by
+the backend's MAX_ENTRIES together with MAX_BODY_BYTES.
+"""
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from django.http import HttpResponse
+
+from assist_co_server.models import Assistant, Client, Contact, Gender, Profession, Task, TaskType, \
+    task_transitioned, tasks_bulk_created
+
+DEFAULTS = {
+    'CACHE_ALIAS': 'responses',
+    'TTL': 300,
+    'MAX_BODY_BYTES': 256 * 1024,
+}
+
+GLOBAL_VERSION_KEY = 'responses:global'
+
+
+def get_setting(name):
+    return dict(DEFAULTS, **getattr(settings, 'RESPONSE_CACHE', {}))[name]
+
+
+def get_cache():
+    alias = get_setting('CACHE_ALIAS')
+    return caches[alias] if alias else None
+
+
+def version_key(client_id):
+    return 'responses:client:{}'.format(client_id)
+
+
+def new_version():
+    return uuid.uuid4().hex
+
+
+def versions(cache, client_id):
+    """
+    (client version, global version), created when missing
+    """
+    keys = [version_key(client_id), GLOBAL_VERSION_KEY]
+    found = cache.get_many(keys)
+    for key in keys:
+        if key not in found:
+            cache.add(key, new_version(), get_setting('TTL'))
+            found[key] = cache.get(key)
+    return found[keys[0]], found[keys[1]]
+
+
+def page_key(request, client_id, versions):
+    digest = hashlib.md5()
+    for part in (client_id, request.path, sorted(request.query_params.lists()), request.accepted_media_type,
+            versions):
+        digest.update(repr(part).encode('utf-8'))
+    return 'responses:page:{}'.format(digest.hexdigest())
+
+
+def cached_response(view, request, client_id, respond):
+    """
+    The rendered response of respond() for the view's request, from the cache
+    when an earlier one is still current. Only 200 JSON responses are cached.
+    """
+    cache = get_cache()
+    if cache is None or request.accepted_renderer.format != 'json':
+        return respond()
+    key = page_key(request, client_id, versions(cache, client_id))
+    hit = cache.get(key)
+    if hit is not None:
+        content, content_type = hit
+        return HttpResponse(content, content_type=content_type)
+
+    response = view.finalize_response(request, respond())
+    response.render()
+    if response.status_code == 200 and len(response.content) <= get_setting('MAX_BODY_BYTES'):
+        cache.set(key, (response.content, response['Content-Type']), get_setting('TTL'))
+    return response
+
+
+def _replace(keys):
+    cache = get_cache()
+    if cache is not None:
+        cache.set_many(dict((key, new_version()) for key in keys), get_setting('TTL'))
+
+
+def bump(client_ids):
+    """
+    Make the cached pages of the clients with client_ids stale
+    """
+    keys = [version_key(client_id) for client_id in set(client_ids) if client_id is not None]
+    if keys:
+        _replace(keys)
+        transaction.on_commit(lambda: _replace(keys))
+
+
+def bump_all():
+    """
+    Make every cached page stale
+    """
+    _replace([GLOBAL_VERSION_KEY])
+    transaction.on_commit(lambda: _replace([GLOBAL_VERSION_KEY]))
+
+
+def bump_user(model, user_id):
+    """
+    Make the pages rendering the user stale: the client's own pages, or
+    every page for an assistant
+    """
+    if issubclass(model, Client):
+        bump([user_id])
+    else:
+        bump_all()
+
+
+def clear():
+    cache = get_cache()
+    if cache is not None:
+        cache.clear()
+
+
+@receiver(post_save, sender=Task)
+@receiver(post_delete, sender=Task)
+@receiver(post_save, sender=Contact)
+@receiver(post_delete, sender=Contact)
+def bump_written_client(sender, instance, raw=False, **kwargs):
+    if not raw:
+        bump([instance.client_id])
+
+
+@receiver(tasks_bulk_created)
+def bump_bulk_created_clients(sender, tasks, **kwargs):
+    bump(task.client_id for task in tasks)
+
+
+@receiver(task_transitioned)
+def bump_transitioned_client(sender, task, **kwargs):
+    bump([task.client_id])
+
+
+@receiver(m2m_changed, sender=Task.contacts.through)
+def bump_linked_client(sender, instance, action, **kwargs):
+    # Tasks and their contacts belong to the same client
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        bump([instance.client_id])
+
+
+@receiver(post_save, sender=Client)
+def bump_written_client_user(sender, instance, raw=False, **kwargs):
+    # A client is only rendered in its own tasks
+    if not raw:
+        bump([instance.pk])
+
+
+@receiver(post_save, sender=Assistant)
+@receiver(post_save, sender=Gender)
+@receiver(post_delete, sender=Gender)
+@receiver(post_save, sender=Profession)
+@receiver(post_delete, sender=Profession)
+@receiver(post_save, sender=TaskType)
+@receiver(post_delete, sender=TaskType)
+def bump_rendered_rows(sender, instance, raw=False, **kwargs):
+    if not raw:
+        bump_all()
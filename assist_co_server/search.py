@@ -0,0 +1,258 @@
+"""
+Full text search over a client's tasks by task text and contact names,
+emails and phones.
+
+The index is the task_search table from migration 0022, an FTS5 virtual table
+on SQLite and a tsvector with a GIN index on PostgreSQL. There is one document
+per unarchived task, keyed by task id and scoped by client. Text is split into
+words here so both backends index and match the same terms, every search term
+is a prefix match and all of them must match.
+
+The receivers below keep the index in sync with Task, Contact and the
+Task.contacts links by queueing index_tasks jobs, see assist_co_server/jobs.py.
+Task.bulk_create_with_contacts sends no post_save so it sends
+tasks_bulk_created instead. `python manage.py rebuild_search_index`
+rebuilds the index from scratch.
+"""
+import re
+
+import phonenumbers
+from django.db import connections
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from assist_co_server import jobs
+from assist_co_server.models import Contact, Task, IN_CHUNK_SIZE, tasks_bulk_created
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def words(text):
+    return WORD_RE.findall(text.lower()) if text else []
+
+
+def phone_words(phone):
+    """
+    The number without separators, and without the country code when the
+    number has one, so either way of typing it matches
+    """
+    terms = [re.sub(r'\D', '', phone)]
+    try:
+        national = str(phonenumbers.parse(phone, None).national_number)
+    except phonenumbers.NumberParseException:
+        return terms
+    if national not in terms:
+        terms.append(national)
+    return terms
+
+
+def contact_words(first_name, last_name, email, phone):
+    terms = words(first_name) + words(last_name) + words(email) + words(phone)
+    if phone:
+        terms.extend(phone_words(phone))
+    return terms
+
+
+class SQLiteIndex(object):
+    def insert(self, cursor, documents):
+        cursor.executemany('INSERT INTO task_search (rowid, client, body) VALUES (%s, %s, %s)',
+            [(task_id, 'c{}'.format(client_id), body) for task_id, client_id, body in documents])
+
+    def delete(self, cursor, task_ids):
+        for i in range(0, len(task_ids), IN_CHUNK_SIZE):
+            chunk = task_ids[i:i + IN_CHUNK_SIZE]
+            cursor.execute('DELETE FROM task_search WHERE rowid IN ({})'.format(', '.join(['%s'] * len(chunk))), chunk)
+
+    def clear(self, cursor):
+        cursor.execute('DELETE FROM task_search')
+
+    def search(self, cursor, client_id, terms, limit, offset):
+        # The client column only scopes the match, weight it 0 in the ranking
+        match = ' AND '.join(['client : "c{}"'.format(client_id)] +
+            ['body : "{}"*'.format(term) for term in terms])
+        cursor.execute(
+            'SELECT rowid FROM task_search WHERE task_search MATCH %s '
+            'ORDER BY bm25(task_search, 0.0, 1.0), rowid DESC LIMIT %s OFFSET %s',
+            [match, limit, offset])
+        return [row[0] for row in cursor.fetchall()]
+
+
+class PostgresIndex(object):
+    def insert(self, cursor, documents):
+        cursor.executemany(
+            "INSERT INTO task_search (task_id, client_id, document) VALUES (%s, %s, to_tsvector('simple', %s))",
+            documents)
+
+    def delete(self, cursor, task_ids):
+        if task_ids:
+            cursor.execute('DELETE FROM task_search WHERE task_id = ANY(%s)', [list(task_ids)])
+
+    def clear(self, cursor):
+        cursor.execute('TRUNCATE task_search')
+
+    def search(self, cursor, client_id, terms, limit, offset):
+        query = ' & '.join('{}:*'.format(term) for term in terms)
+        cursor.execute(
+            "SELECT task_id FROM task_search, to_tsquery('simple', %s) query "
+            'WHERE client_id = %s AND document @@ query '
+            'ORDER BY ts_rank(document, query) DESC, task_id DESC LIMIT %s OFFSET %s',
+            [query, client_id, limit, offset])
+        return [row[0] for row in cursor.fetchall()]
+
+
+BACKENDS = {
+    'sqlite': SQLiteIndex(),
+    'postgresql': PostgresIndex(),
+}
+
+
+def connection():
+    return connections[Task.objects.db]
+
+
+def backend():
+    return BACKENDS.get(connection().vendor)
+
+
+def task_documents(task_ids):
+    """
+    (task id, client id, indexed text) for the unarchived tasks in task_ids
+    """
+    documents = []
+    through = Task.contacts.through
+    for i in range(0, len(task_ids), IN_CHUNK_SIZE):
+        chunk = task_ids[i:i + IN_CHUNK_SIZE]
+        terms = {}
+        tasks = Task.objects.filter(id__in=chunk, is_archived=False).values_list('id', 'client_id', 'text')
+        for task_id, client_id, text in tasks:
+            terms[task_id] = (client_id, words(text))
+        links = (through.objects.filter(task_id__in=list(terms))
+            .values_list('task_id', 'contact__first_name', 'contact__last_name', 'contact__email', 'contact__phone'))
+        for link in links:
+            terms[link[0]][1].extend(contact_words(*link[1:]))
+        documents.extend((task_id, client_id, ' '.join(task_terms))
+            for task_id, (client_id, task_terms) in terms.items())
+    return documents
+
+
+@jobs.register
+def index_tasks(task_ids):
+    """
+    Add or refresh the documents of task_ids, archived or missing tasks are
+    removed from the index
+    """
+    index = backend()
+    task_ids = list(task_ids)
+    if index is None or not task_ids:
+        return
+    documents = task_documents(task_ids)
+    with connection().cursor() as cursor:
+        index.delete(cursor, task_ids)
+        index.insert(cursor, documents)
+
+
+@jobs.register
+def remove_tasks(task_ids):
+    index = backend()
+    task_ids = list(task_ids)
+    if index is None or not task_ids:
+        return
+    with connection().cursor() as cursor:
+        index.delete(cursor, task_ids)
+
+
+def rebuild(batch_size=1000):
+    """
+    Reindex every task, returns the number of tasks indexed
+    """
+    index = backend()
+    with connection().cursor() as cursor:
+        index.clear(cursor)
+    count = 0
+    last_id = 0
+    while True:
+        ids = list(Task.objects.filter(id__gt=last_id, is_archived=False)
+            .order_by('id').values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return count
+        documents = task_documents(ids)
+        with connection().cursor() as cursor:
+            index.insert(cursor, documents)
+        count += len(documents)
+        last_id = ids[-1]
+
+
+class Results(object):
+    """
+    Ranked task ids of a client's tasks matching query, best match first.
+    Sliced by the paginator, each slice runs one LIMIT/OFFSET query.
+    """
+    def __init__(self, client_id, query):
+        self.client_id = int(client_id)
+        self.terms = words(query)
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice) or key.step is not None:
+            raise TypeError('Search results only support slicing')
+        start = key.start or 0
+        index = backend()
+        if index is None or not self.terms or key.stop is None or key.stop <= start:
+            return []
+        with connection().cursor() as cursor:
+            return index.search(cursor, self.client_id, self.terms, key.stop - start, start)
+
+
+def reindex(task_ids):
+    task_ids = list(task_ids)
+    if task_ids and backend() is not None:
+        jobs.enqueue(index_tasks, task_ids)
+
+
+@receiver(post_save, sender=Task)
+def index_saved_task(sender, instance, **kwargs):
+    reindex([instance.pk])
+
+
+@receiver(post_delete, sender=Task)
+def remove_deleted_task(sender, instance, **kwargs):
+    if backend() is not None:
+        jobs.enqueue(remove_tasks, [instance.pk])
+
+
+@receiver(tasks_bulk_created)
+def index_bulk_created_tasks(sender, tasks, **kwargs):
+    reindex([task.pk for task in tasks])
+
+
+@receiver(m2m_changed, sender=Task.contacts.through)
+def index_linked_tasks(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            reindex([instance.pk])
+    elif action == 'pre_clear':
+        # The links are gone after the clear
+        instance._search_task_ids = list(
+            sender.objects.filter(contact_id=instance.pk).values_list('task_id', flat=True))
+    elif action == 'post_clear':
+        reindex(getattr(instance, '_search_task_ids', []))
+    elif action in ('post_add', 'post_remove'):
+        reindex(pk_set)
+
+
+@receiver(post_save, sender=Contact)
+def index_contact_tasks(sender, instance, created=False, **kwargs):
+    if not created:
+        reindex(Task.contacts.through.objects
+            .filter(contact_id=instance.pk).values_list('task_id', flat=True))
+
+
+@receiver(pre_delete, sender=Contact)
+def collect_contact_tasks(sender, instance, **kwargs):
+    # The links are deleted with the contact
+    instance._search_task_ids = list(Task.contacts.through.objects
+        .filter(contact_id=instance.pk).values_list('task_id', flat=True))
+
+
+@receiver(post_delete, sender=Contact)
+def index_deleted_contact_tasks(sender, instance, **kwargs):
+    reindex(getattr(instance, '_search_task_ids', []))
@@ -4,12 +4,18 @@ from django.contrib.auth.tokens import default_token_generator
 from django.utils.http import urlsafe_base64_decode as uid_decoder
 from django.core.exceptions import ObjectDoesNotExist
 from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
 
 from rest_framework import serializers, exceptions
 from rest_framework.exceptions import ValidationError
+from rest_framework.fields import SkipField
+from rest_framework.relations import PKOnlyObject
+from rest_framework.serializers import raise_errors_on_nested_writes
 from rest_framework.settings import api_settings
 
-from assist_co_server.models import Client, Gender, Profession, TaskType, Task, Contact
+from assist_co_server import options, thumbnails
+from assist_co_server.models import Assistant, Client, Gender, Profession, TaskType, Task, Contact, TASK_STATES, \
+    taken_identities
 
 class GenderField(serializers.RelatedField):
     """
@@ -19,10 +25,13 @@ class GenderField(serializers.RelatedField):
         return {'permalink': value.permalink, 'sort': value.sort, 'display': value.display}
 
     def to_internal_value(self, data):
-        return Gender.objects.get(permalink=data)
+        gender = options.genders.get(data)
+        if gender is None:
+            raise exceptions.ValidationError('No gender exists for permalink {}'.format(data))
+        return gender
 
     def get_queryset(self):
-        return Gender.objects.all()
+        return options.genders.all()
         
 class LoginSerializer(serializers.Serializer):
     """
@@ -52,7 +61,102 @@ class LoginSerializer(serializers.Serializer):
         attrs['user'] = user
         return attrs
 
-class AssistantSerializer(serializers.ModelSerializer):
+class ThumbnailsField(serializers.Field):
+    """
+    Urls of the user's profile picture thumbnails by size, null until they
+    are generated
+    """
+    def __init__(self, **kwargs):
+        kwargs['source'] = '*'
+        kwargs['read_only'] = True
+        super(ThumbnailsField, self).__init__(**kwargs)
+
+    def to_representation(self, user):
+        return thumbnails.thumbnail_urls(user.profile_pic.name, user.thumbnail_format)
+
+class UniqueIdentityMixin(object):
+    """
+    Emails, lowercased, and phones unique among users. Both are checked with
+    one query on validation, and the unique indexes settle the races: an
+    IntegrityError from them is raised as the same validation error.
+    """
+    identity_errors = (
+        ('email', 'Email already exists'),
+        ('phone', 'Phone number already exists'),
+    )
+
+    def validate_email(self, email):
+        return email.lower()
+
+    def validate(self, attrs):
+        attrs = super(UniqueIdentityMixin, self).validate(attrs)
+        self.check_identities(attrs.get('email'), attrs.get('phone'))
+        return attrs
+
+    def check_identities(self, email, phone=None):
+        """
+        Raise a ValidationError for email and phone when they belong to
+        another user
+        """
+        taken = taken_identities(email, phone, exclude_id=self.instance.pk if self.instance else None)
+        if taken:
+            raise ValidationError(dict((name, [message]) for name, message in self.identity_errors if name in taken))
+
+    def save(self, **kwargs):
+        try:
+            with transaction.atomic():
+                return super(UniqueIdentityMixin, self).save(**kwargs)
+        except IntegrityError:
+            self.check_identities(self.validated_data.get('email'), self.validated_data.get('phone'))
+            raise
+
+class PlainRepresentationMixin(object):
+    """
+    Renders to a plain dict rather than an OrderedDict, and reads fields
+    whose to_representation() would return the model value unchanged, e.g.
+    a str for a CharField, straight from the instance. For TaskSerializer
+    and the serializers rendered nested in every task of a page.
+    """
+    # Field classes and the value type they render as is
+    plain_types = (
+        (serializers.CharField, str),
+        (serializers.IntegerField, int),
+        (serializers.BooleanField, bool),
+    )
+
+    def representation_plan(self):
+        """
+        (field name, attribute, value type, field) of the readable fields,
+        attribute and value type are None unless the field is plain
+        """
+        if getattr(self, '_representation_plan', None) is None:
+            plan = []
+            for field in self._readable_fields:
+                plain_type = next((value_type for field_class, value_type in self.plain_types
+                    if isinstance(field, field_class)), None)
+                attribute = field.source_attrs[0] if plain_type and len(field.source_attrs) == 1 else None
+                plan.append((field.field_name, attribute, plain_type, field))
+            self._representation_plan = plan
+        return self._representation_plan
+
+    def to_representation(self, instance):
+        ret = {}
+        for name, attribute, plain_type, field in self.representation_plan():
+            if attribute is not None:
+                value = getattr(instance, attribute)
+                if value is None or type(value) is plain_type:
+                    ret[name] = value
+                    continue
+            else:
+                try:
+                    value = field.get_attribute(instance)
+                except SkipField:
+                    continue
+            check_for_none = value.pk if isinstance(value, PKOnlyObject) else value
+            ret[name] = None if check_for_none is None else field.to_representation(value)
+        return ret
+
+class AssistantSerializer(UniqueIdentityMixin, PlainRepresentationMixin, serializers.ModelSerializer):
     """
     Assistant serializer
     """
@@ -62,19 +166,13 @@ class AssistantSerializer(serializers.ModelSerializer):
     email                   = serializers.EmailField(max_length=200, allow_blank=False, required=True)
     gender                  = GenderField(many=False)
     date_of_birth           = serializers.DateField(required=True)
+    profile_pic             = serializers.ImageField(read_only=True)
+    profile_pic_thumbnails  = ThumbnailsField()
 
     class Meta:
         model = Client
-        fields = ('email', 'password','first_name', 'last_name', 'date_of_birth', 'gender')
-
-
-    def validate_email(self, email):
-        try:
-            u = User.objects.get(email=email.lower())
-            raise exceptions.ValidationError('Email already exists')
-        except ObjectDoesNotExist:
-            pass
-        return email.lower()
+        fields = ('email', 'password','first_name', 'last_name', 'date_of_birth', 'gender',
+            'profile_pic', 'profile_pic_thumbnails')
 
 class ProfessionField(serializers.RelatedField):
     """
@@ -84,12 +182,15 @@ class ProfessionField(serializers.RelatedField):
         return {'permalink': value.permalink, 'sort': value.sort, 'display': value.display}
 
     def to_internal_value(self, data):
-        return Profession.objects.get(permalink=data)
+        profession = options.professions.get(data)
+        if profession is None:
+            raise exceptions.ValidationError('No profession exists for permalink {}'.format(data))
+        return profession
 
     def get_queryset(self):
-        return Profession.objects.all()
+        return options.professions.all()
 
-class ClientSerializer(serializers.ModelSerializer):
+class ClientSerializer(UniqueIdentityMixin, PlainRepresentationMixin, serializers.ModelSerializer):
     """
     Client serializer
     """
@@ -103,43 +204,29 @@ class ClientSerializer(serializers.ModelSerializer):
     profession              = ProfessionField(many=False)
     primary_assistant       = AssistantSerializer(many=False, read_only=True)
     created_on              = serializers.DateTimeField(read_only=True)
+    profile_pic             = serializers.ImageField(read_only=True)
+    profile_pic_thumbnails  = ThumbnailsField()
     class Meta:
         model = Client
         fields = ('id', 'email', 'password','first_name', 'last_name', 'date_of_birth', 
             'date_of_birth', 'gender', 'phone', 'profession', 'primary_assistant',
-            'created_on')
-
-
-    def validate_email(self, email):
-        try:
-            u = User.objects.get(email=email.lower())
-            raise exceptions.ValidationError('Email already exists')
-        except ObjectDoesNotExist:
-            pass
-        return email.lower()
-
-    def validate_phone(self, phone):
-        try:
-            u = Client.objects.get(phone=phone)
-            raise exceptions.ValidationError('Phone number already exists')
-        except ObjectDoesNotExist:
-            pass
-        return phone
+            'created_on', 'profile_pic', 'profile_pic_thumbnails')
 
     def validate_profession(self, profession):
-        if not profession.permalink in [p.permalink for p in Profession.objects.all()]:
+        if not options.professions.contains(profession.permalink):
             raise exceptions.ValidationError('No profession exists for permalink {}'.format(profession.permalink))
         return profession
 
-class ContactSerializer(serializers.ModelSerializer):
+class ContactSerializer(PlainRepresentationMixin, serializers.ModelSerializer):
     client_id = serializers.SlugRelatedField(many=False, slug_field='id', 
         queryset=Client.objects.all(), write_only=True)
 
     def validate(self, attrs):
-        phone = attrs['phone']
-        email = attrs['email']
+        # Blank emails are stored as NULL, email is unique per client
+        attrs['email'] = attrs.get('email') or None
+        attrs['phone'] = attrs.get('phone') or None
 
-        if not phone and not email:
+        if not attrs['phone'] and not attrs['email']:
             raise exceptions.ValidationError('Must include email and/or phone number for contact')
         return attrs
 
@@ -148,13 +235,23 @@ class ContactSerializer(serializers.ModelSerializer):
         fields = ('id', 'first_name', 'last_name', 'email', 'phone', 'client_id')
 
     def create(self, attrs):
-        return Contact.objects.create(
-            first_name=attrs['first_name'],
-            last_name=attrs['last_name'],
-            email=attrs['email'],
-            phone=attrs['phone'],
-            client_id=attrs['client_id'].id,
-        )
+        try:
+            with transaction.atomic():
+                return Contact.objects.create(
+                    first_name=attrs['first_name'],
+                    last_name=attrs['last_name'],
+                    email=attrs['email'],
+                    phone=attrs['phone'],
+                    client_id=attrs['client_id'].id,
+                )
+        except IntegrityError:
+            raise exceptions.ValidationError({'email': ['Client already has a contact with this email']})
+
+    def update(self, contact, attrs):
+        # client_id is validated to a Client
+        if 'client_id' in attrs:
+            attrs['client'] = attrs.pop('client_id')
+        return super(ContactSerializer, self).update(contact, attrs)
 
 class GenderSerializer(serializers.ModelSerializer):
     class Meta:
@@ -179,12 +276,84 @@ class TaskTypeField(serializers.RelatedField):
         return {'permalink': value.permalink, 'sort': value.sort, 'display': value.display}
 
     def to_internal_value(self, data):
-        return TaskType.objects.get(permalink=data)
+        task_type = options.task_types.get(data)
+        if task_type is None:
+            raise exceptions.ValidationError('No task type exists for permalink {}'.format(data))
+        return task_type
+
+    def get_queryset(self):
+        return options.task_types.all()
+
+class SparseFieldsMixin(object):
+    """
+    Renders only the fields listed in the `fields` query parameter of the
+    request in the serializer context, e.g. ?fields=id,text,state. Applies
+    to reads only, writes always validate and return every field.
+    """
+    fields_query_param = 'fields'
+
+    @classmethod
+    def requested_fields(cls, request):
+        """
+        The set of requested field names or None for every field
+        """
+        if request is None or request.method not in ('GET', 'HEAD'):
+            return None
+        value = request.query_params.get(cls.fields_query_param)
+        if not value:
+            return None
+        fields = set(name.strip() for name in value.split(',') if name.strip())
+        unknown = fields - set(cls.Meta.fields)
+        if unknown:
+            raise ValidationError({cls.fields_query_param: ['Unknown fields: {}'.format(', '.join(sorted(unknown)))]})
+        return fields
+
+    def __init__(self, *args, **kwargs):
+        super(SparseFieldsMixin, self).__init__(*args, **kwargs)
+        fields = self.requested_fields(self.context.get('request'))
+        if fields is not None:
+            for name in set(self.fields) - fields:
+                self.fields.pop(name)
+
+class TaskTransitionSerializer(serializers.Serializer):
+    """
+    Move a task to state, only from expected_state when given
+    """
+    state = serializers.ChoiceField(choices=TASK_STATES)
+    expected_state = serializers.ChoiceField(choices=TASK_STATES, required=False)
+    assistant_id = serializers.PrimaryKeyRelatedField(queryset=Assistant.objects.filter(is_active=True),
+        required=False)
 
-    def queryset(self):
-        return [t.permalink for t in TaskType.objects.all()]
+class TaskListSerializer(serializers.ListSerializer):
+    """
+    Creates all the validated tasks with bulk inserts
+    """
+    def create(self, validated_data):
+        with transaction.atomic():
+            return Task.bulk_create_with_contacts([task_attrs(attrs) for attrs in validated_data])
 
-class TaskSerializer(serializers.ModelSerializer):
+def task_attrs(attrs):
+    """
+    Map validated TaskSerializer data to the attrs taken by
+    Task.bulk_create_with_contacts
+    """
+    return {
+        'text': attrs['text'],
+        'client_id': attrs['client_id'].id,
+        'task_type_id': attrs['task_type'].id,
+        'location': attrs.get('location'),
+        'start_on': attrs.get('start_on'),
+        'end_on': attrs.get('end_on'),
+        'contacts': [{
+            'first_name': contact_attrs['first_name'],
+            'last_name': contact_attrs['last_name'],
+            'email': contact_attrs.get('email'),
+            'phone': contact_attrs.get('phone'),
+            'client_id': contact_attrs['client_id'].id,
+        } for contact_attrs in attrs['contacts']],
+    }
+
+class TaskSerializer(SparseFieldsMixin, PlainRepresentationMixin, serializers.ModelSerializer):
     """
     Serializer for Task
     """
@@ -199,43 +368,35 @@ class TaskSerializer(serializers.ModelSerializer):
         model = Task
         fields = ('id', 'text', 'location', 'task_type', 'contacts', 'client', 'client_id', 
             'state', 'start_on', 'end_on', 'completed_on', 'created_on', 'assistant', 'is_complete')
+        # Changed by transitions only, see TaskQuerySet.transition
+        read_only_fields = ('state', 'completed_on', 'is_complete')
+        list_serializer_class = TaskListSerializer
 
     def validate_task_type(self, task_type):
-        if not task_type.permalink in [t.permalink for t in TaskType.objects.all()]:
+        if not options.task_types.contains(task_type.permalink):
             raise exceptions.ValidationError('No task type exists for permalink {}'.format(task_type.permalink))
         return task_type
 
     def validate_contacts(self, contacts):
         for contact_attrs in contacts:
-            phone = contact_attrs['phone']
-            email = contact_attrs['email']
+            phone = contact_attrs.get('phone')
+            email = contact_attrs.get('email')
             if not phone and not email:
                 raise exceptions.ValidationError('Must include email and/or phone number for contact')
         return contacts
 
     def create(self, attrs):
-        task = Task.objects.create(
-            text=attrs['text'], 
-            client_id=attrs['client_id'].id, 
-            task_type_id=attrs['task_type'].id,
-            location=attrs['location'] if 'location' in attrs else None,
-            start_on=attrs['start_on'] if 'start_on' in attrs else None,
-            end_on=attrs['end_on'] if 'end_on' in attrs else None,
-        )
-        contact_objs = []
-        for contact_attrs in attrs['contacts']:
-            c_obj = Contact.objects.create(
-                first_name=contact_attrs['first_name'],
-                last_name=contact_attrs['last_name'],
-                email=contact_attrs['email'],
-                phone=contact_attrs['phone'],
-                client_id=contact_attrs['client_id'].id,
-            )
-            contact_objs.append(c_obj)
-        task.contacts.add(*contact_objs)
-        task.save()
+        with transaction.atomic():
+            return Task.bulk_create_with_contacts([task_attrs(attrs)])[0]
+
+    def update(self, task, attrs):
+        """
+        Save only the given fields, so a concurrent transition isn't undone
+        """
+        raise_errors_on_nested_writes('update', self, attrs)
+        if 'client_id' in attrs:
+            attrs['client'] = attrs.pop('client_id')
+        for name, value in attrs.items():
+            setattr(task, name, value)
+        task.save(update_fields=list(attrs) + ['updated_on'])
         return task
-
-
-
-
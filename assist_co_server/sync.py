@@ -0,0 +1,148 @@
+"""
+Changes since a watermark, for apps keeping a local copy of a client's tasks
+and contacts. Served by ClientChangesView.
+
+Tasks, contacts and tombstones are each read in (updated_on, id) order,
+deleted_on for tombstones, from their (client, updated_on, id) index, so a
+sync without changes is one index probe per table. The watermark is the
+position of the last row returned from each table. Archived tasks come from
+the tasks table, deleted rows from tombstones written by the receivers below.
+
+Rows are only returned once they are SETTLE_SECONDS old. Otherwise a
+transaction committing after a later stamped one would be skipped by apps
+that already synced past its timestamp. Writes bypassing save() must set
+updated_on themselves.
+
+Configured with settings.SYNC:
+
+    SYNC = {
+        'SETTLE_SECONDS': 2,
+        'PAGE_SIZE': 100,       # rows per table per response
+        'MAX_PAGE_SIZE': 500,
+    }
+"""
+import datetime
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+
+from django.conf import settings
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from assist_co_server.models import Contact, Task, Tombstone
+
+DEFAULTS = {
+    'SETTLE_SECONDS': 2,
+    'PAGE_SIZE': 100,
+    'MAX_PAGE_SIZE': 500,
+}
+
+
+def get_setting(name):
+    return dict(DEFAULTS, **getattr(settings, 'SYNC', {}))[name]
+
+
+class Watermark(object):
+    """
+    (timestamp, id) of the last row synced, per table
+    """
+    TABLES = ('tasks', 'contacts', 'tombstones')
+
+    def __init__(self, positions=None):
+        self.positions = dict(positions or {})
+
+    def get(self, table):
+        return self.positions.get(table)
+
+    @classmethod
+    def decode(cls, encoded):
+        """
+        Raises ValueError for an invalid watermark, None or '' is the
+        watermark of a full sync
+        """
+        if not encoded:
+            return cls()
+        try:
+            data = json.loads(urlsafe_b64decode(encoded.encode('ascii')).decode('ascii'))
+            positions = {}
+            for table, (stamp, pk) in data.items():
+                stamp = parse_datetime(stamp)
+                if table not in cls.TABLES or stamp is None:
+                    raise ValueError(table)
+                positions[table] = (stamp, int(pk))
+        except (TypeError, AttributeError, UnicodeError) as e:
+            raise ValueError(e)
+        return cls(positions)
+
+    def encode(self):
+        data = dict((table, [stamp.isoformat(), pk]) for table, (stamp, pk) in self.positions.items())
+        return urlsafe_b64encode(json.dumps(data, sort_keys=True, separators=(',', ':')).encode('ascii')).decode('ascii')
+
+
+class Changes(object):
+    def __init__(self):
+        self.tasks = []
+        self.contacts = []
+        self.deleted_tasks = []
+        self.deleted_contacts = []
+        self.watermark = None
+        self.has_more = False
+
+
+def changed_since(queryset, field, position, horizon, limit):
+    """
+    Up to limit rows of queryset after position in (field, pk) order, that
+    are not newer than horizon. Returns (rows, has_more).
+    """
+    queryset = queryset.filter(**{field + '__lte': horizon})
+    if position is not None:
+        stamp, pk = position
+        # (field, pk) > position, written so field stays a range predicate
+        queryset = queryset.filter(**{field + '__gte': stamp}).exclude(**{field: stamp, 'pk__lte': pk})
+    rows = list(queryset.order_by(field, 'pk')[:limit + 1])
+    return rows[:limit], len(rows) > limit
+
+
+def changes(client_id, watermark, limit, task_fields=None):
+    """
+    The client's changes after watermark, at most limit rows per table.
+    task_fields is passed to Task.objects.with_related().
+    """
+    horizon = timezone.now() - datetime.timedelta(seconds=get_setting('SETTLE_SECONDS'))
+    result = Changes()
+    positions = dict(watermark.positions)
+    streams = (
+        ('tasks', Task.objects.with_related(task_fields), 'updated_on'),
+        ('contacts', Contact.objects.all(), 'updated_on'),
+        ('tombstones', Tombstone.objects.all(), 'deleted_on'),
+    )
+    for table, queryset, field in streams:
+        rows, has_more = changed_since(queryset.filter(client_id=client_id), field,
+            watermark.get(table), horizon, limit)
+        result.has_more = result.has_more or has_more
+        if rows:
+            positions[table] = (getattr(rows[-1], field), rows[-1].pk)
+        if table == 'tasks':
+            result.tasks = [task for task in rows if not task.is_archived]
+            result.deleted_tasks = [task.pk for task in rows if task.is_archived]
+        elif table == 'contacts':
+            result.contacts = rows
+        else:
+            for tombstone in rows:
+                deleted = result.deleted_tasks if tombstone.model == 'task' else result.deleted_contacts
+                deleted.append(tombstone.object_id)
+    result.watermark = Watermark(positions)
+    return result
+
+
+@receiver(post_delete, sender=Task)
+def record_deleted_task(sender, instance, **kwargs):
+    Tombstone.objects.create(model='task', object_id=instance.pk, client_id=instance.client_id)
+
+
+@receiver(post_delete, sender=Contact)
+def record_deleted_contact(sender, instance, **kwargs):
+    if instance.client_id is not None:
+        Tombstone.objects.create(model='contact', object_id=instance.pk, client_id=instance.client_id)
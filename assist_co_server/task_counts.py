@@ -0,0 +1,116 @@
+"""
+Number of unarchived tasks per assistant and state, for the assistant queue
+and the assignment engine, so neither counts tasks with an aggregate query.
+
+The assistant_task_counts table is adjusted by the receivers below, which
+run in the transaction of the task write: Task.save() and deletes, bulk
+inserts (tasks_bulk_created), transitions (task_transitioned) and the
+assignment engine, which calls adjust() itself. Other writes changing a
+task's assistant, state or is_archived must adjust the counts too, or
+`python manage.py rebuild_task_counts` recounts every task.
+"""
+from collections import Counter
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from assist_co_server.models import Assistant, AssistantTaskCount, Task, TASK_STATES, \
+    task_transitioned, tasks_bulk_created
+
+# Task fields the counts depend on, as passed in update_fields
+COUNTED_FIELDS = {'assistant', 'assistant_id', 'state', 'is_archived'}
+
+
+def counted(assistant_id, state, is_archived):
+    """
+    The (assistant id, state) a task with these values is counted under, or
+    None when it isn't counted
+    """
+    if assistant_id is None or is_archived:
+        return None
+    return (assistant_id, state)
+
+
+def adjust(deltas):
+    """
+    Add each delta of deltas, (assistant id, state) -> delta, to its count
+    """
+    # In key order so concurrent transactions lock the rows in the same order
+    for (assistant_id, state), delta in sorted(item for item in deltas.items() if item[0] is not None and item[1]):
+        counts = AssistantTaskCount.objects.filter(assistant_id=assistant_id, state=state)
+        if counts.update(count=F('count') + delta):
+            continue
+        try:
+            with transaction.atomic():
+                AssistantTaskCount.objects.create(assistant_id=assistant_id, state=state, count=delta)
+        except IntegrityError:
+            # Created concurrently
+            counts.update(count=F('count') + delta)
+
+
+def move(previous, current):
+    if previous != current:
+        adjust({previous: -1, current: 1})
+
+
+def counts(assistant_id):
+    """
+    State -> count of the assistant's tasks, every state included
+    """
+    result = dict((state, 0) for state, label in TASK_STATES)
+    result.update(AssistantTaskCount.objects.filter(assistant_id=assistant_id).values_list('state', 'count'))
+    return result
+
+
+def rebuild():
+    """
+    Recount every assistant's tasks. Returns the number of count rows.
+    """
+    rows = (Task.objects.filter(assistant__isnull=False, is_archived=False)
+        .values_list('assistant_id', 'state').annotate(count=Count('id')).order_by())
+    AssistantTaskCount.objects.all().delete()
+    AssistantTaskCount.objects.bulk_create(
+        AssistantTaskCount(assistant_id=assistant_id, state=state, count=count)
+        for assistant_id, state, count in rows)
+    return len(rows)
+
+
+@receiver(post_save, sender=Task)
+def count_saved_task(sender, instance, created=False, raw=False, update_fields=None, **kwargs):
+    if raw:
+        return
+    current = counted(instance.assistant_id, instance.state, instance.is_archived)
+    if created:
+        move(None, current)
+    elif update_fields is None or not COUNTED_FIELDS.isdisjoint(update_fields):
+        # Tasks not read from the database can't tell what they were counted under
+        loaded = getattr(instance, '_loaded_values', {})
+        if all(name in loaded for name in ('assistant_id', 'state', 'is_archived')):
+            move(counted(loaded['assistant_id'], loaded['state'], loaded['is_archived']), current)
+    instance._loaded_values = dict(getattr(instance, '_loaded_values', {}),
+        assistant_id=instance.assistant_id, state=instance.state, is_archived=instance.is_archived)
+
+
+@receiver(post_delete, sender=Task)
+def count_deleted_task(sender, instance, **kwargs):
+    move(counted(instance.assistant_id, instance.state, instance.is_archived), None)
+
+
+@receiver(tasks_bulk_created)
+def count_bulk_created_tasks(sender, tasks, **kwargs):
+    adjust(Counter(counted(task.assistant_id, task.state, task.is_archived) for task in tasks))
+
+
+@receiver(task_transitioned)
+def count_transitioned_task(sender, task, state, previous_state, previous_assistant_id, **kwargs):
+    move(counted(previous_assistant_id, previous_state, task.is_archived),
+        counted(task.assistant_id, state, task.is_archived))
+
+
+@receiver(post_save, sender=Assistant)
+def create_assistant_counts(sender, instance, created=False, raw=False, **kwargs):
+    if created and not raw:
+        AssistantTaskCount.objects.bulk_create(
+            AssistantTaskCount(assistant_id=instance.pk, state=state) for state, label in TASK_STATES)
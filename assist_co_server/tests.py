@@ -1,3 +1,1362 @@
-from django.test import TestCase
+import collections
+import csv
+import datetime
+import decimal
+import importlib
+import io
+import json
+import shutil
+import tempfile
+import uuid
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth import authenticate
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.models import User
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.signals import request_started
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.six import StringIO
+from rest_framework import parsers as drf_parsers, renderers as drf_renderers, serializers as drf_serializers
+from rest_framework.exceptions import AuthenticationFailed, ParseError
+from PIL import Image
+from rest_framework.test import APIClient
+
+from assist_co_server import assignment, jobs, metrics, options, renderers, response_cache, search, serializers, \
+    task_counts, throttling, thumbnails
+from assist_co_server.authentication import CachingTokenAuthentication, TokenCache, token_cache
+from assist_co_server.models import Assistant, Client, Contact, Gender, Job, Profession, Task, TaskType
+
+# Values passed to record_call, in order
+calls = []
+
+
+@jobs.register
+def record_call(value, failures=0):
+    calls.append(value)
+    if calls.count(value) <= failures:
+        raise ValueError(value)
+
+
+@override_settings(JOBS={'BACKEND': 'sync'})
+class APITestCase(TestCase):
+    """
+    Base test case with the seeded option tables and a client/assistant pair,
+    jobs run as they are queued
+    """
+    fixtures = ['seed.json']
+
+    def setUp(self):
+        # Assistant counts loaded in an earlier test are gone with its rows
+        assignment.engine.reset()
+        throttling.reset()
+        # Ids are reused between tests, so would the cached pages be
+        response_cache.clear()
+        self.api = APIClient()
+        self.gender = Gender.objects.get(permalink='female')
+        self.profession = Profession.objects.order_by('sort').first()
+        self.task_type = TaskType.objects.order_by('sort').first()
+        self.assistant = Assistant.objects.create(
+            username='assistant@assist.co',
+            email='assistant@assist.co',
+            first_name='Ada',
+            last_name='Assistant',
+            gender=self.gender,
+            date_of_birth=datetime.date(1990, 1, 1),
+        )
+        self.client_user = self.create_client('client@assist.co', '5555550100')
+
+    def create_client(self, email, phone):
+        return Client.objects.create(
+            username=email,
+            email=email,
+            first_name='Cleo',
+            last_name='Client',
+            phone=phone,
+            gender=self.gender,
+            profession=self.profession,
+            primary_assistant=self.assistant,
+            date_of_birth=datetime.date(1985, 6, 15),
+        )
+
+    def create_tasks(self, count, contacts_per_task=2):
+        tasks = []
+        start = Task.objects.count()
+        for i in range(start, start + count):
+            task = Task.objects.create(
+                client=self.client_user,
+                assistant=self.assistant,
+                task_type=self.task_type,
+                text='Task {}'.format(i),
+            )
+            task.contacts.add(*[
+                Contact.objects.create(
+                    first_name='Contact',
+                    last_name='{}-{}'.format(i, j),
+                    email='contact-{}-{}@example.com'.format(i, j),
+                    phone=None,
+                    client=self.client_user,
+                )
+                for j in range(contacts_per_task)
+            ])
+            tasks.append(task)
+        return tasks
+
+    def assertListQueries(self, url, num):
+        with self.assertNumQueries(num):
+            response = self.api.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+
+class TaskListQueryCountTest(APITestCase):
+    """
+    Task listings must not issue queries per row
+    """
+    def test_tasks_view_query_count_is_independent_of_page_rows(self):
+        self.create_tasks(1)
+        self.assertListQueries('/api/tasks', 3)
+        self.create_tasks(19)
+        response = self.assertListQueries('/api/tasks', 3)
+        self.assertEqual(len(response.data['results']), 20)
+
+    def test_client_tasks_view_query_count_is_independent_of_page_rows(self):
+        url = '/api/clients/{}/tasks'.format(self.client_user.id)
+        self.create_tasks(1)
+        self.assertListQueries(url, 3)
+        self.create_tasks(19)
+        response = self.assertListQueries(url, 3)
+        self.assertEqual(response.data['results'][0]['client']['primary_assistant']['gender']['permalink'], 'female')
+
+    def test_client_task_detail_query_count(self):
+        task = self.create_tasks(1, contacts_per_task=5)[0]
+        url = '/api/clients/{}/tasks/{}'.format(self.client_user.id, task.id)
+        self.api.get(url)
+        # ETag probe, task with joins, contacts
+        response = self.assertListQueries(url, 3)
+        self.assertEqual(len(response.data['contacts']), 5)
+
+
+class TaskFilterTest(APITestCase):
+    """
+    Filters, ordering and sparse fields on the task lists
+    """
+    def ids(self, response):
+        return [task['id'] for task in response.data['results']]
+
+    def test_filters(self):
+        ready, executing, completed = self.create_tasks(3, contacts_per_task=0)
+        Task.objects.filter(id=executing.id).update(state='executing', assistant=None)
+        Task.objects.filter(id=completed.id).update(state='completed', is_complete=True,
+            start_on=datetime.datetime(2016, 12, 1, tzinfo=datetime.timezone.utc))
+        url = '/api/clients/{}/tasks?'.format(self.client_user.id)
+        self.assertEqual(self.ids(self.api.get(url + 'state=ready,executing&ordering=id')), [ready.id, executing.id])
+        self.assertEqual(self.ids(self.api.get(url + 'is_complete=true')), [completed.id])
+        self.assertEqual(self.ids(self.api.get(url + 'assistant=none')), [executing.id])
+        self.assertEqual(self.ids(self.api.get('/api/tasks?assistant={}&ordering=-id'.format(self.assistant.id))),
+            [completed.id, ready.id])
+        self.assertEqual(self.ids(self.api.get(url + 'start_on_after=2016-11-30T00:00:00Z')), [completed.id])
+        self.assertEqual(len(self.ids(self.api.get(url + 'task_type=' + self.task_type.permalink))), 3)
+
+    def test_invalid_filters(self):
+        for query in ('state=sleeping', 'is_complete=maybe', 'task_type=nope', 'assistant=x',
+                'start_on_after=yesterday', 'fields=id,secret'):
+            response = self.api.get('/api/tasks?' + query)
+            self.assertEqual(response.status_code, 400, query)
+
+    def test_sparse_fields_skip_joins_and_prefetch(self):
+        self.create_tasks(20)
+        # COUNT and the page, no contacts prefetch
+        response = self.assertListQueries('/api/tasks?fields=id,text,state', 2)
+        self.assertEqual(set(response.data['results'][0]), {'id', 'text', 'state'})
+        with CaptureQueriesContext(connection) as queries:
+            self.api.get('/api/tasks?fields=id,task_type')
+        self.assertNotIn('"clients"', queries[-1]['sql'])
+        self.assertIn('"task_types"', queries[-1]['sql'])
+
+
+class OptionRegistryTest(APITestCase):
+    """
+    Option tables are served from the process local registry
+    """
+    def assertNoOptionQueries(self, queries):
+        option_tables = ('"genders"', '"professions"', '"task_types"')
+        for query in queries:
+            for table in option_tables:
+                self.assertNotIn(table, query['sql'])
+
+    def test_signup_does_not_query_option_tables(self):
+        options.invalidate_all()
+        options.genders.all(), options.professions.all()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.api.post('/api/signup', {
+                'email': 'New@Example.com',
+                'password': 'secret-password',
+                'first_name': 'New',
+                'last_name': 'Client',
+                'date_of_birth': '1990-01-01',
+                'gender': 'male',
+                'phone': '5555550199',
+                'profession': self.profession.permalink,
+            }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertNoOptionQueries(queries.captured_queries)
+
+    def test_unknown_permalink_is_a_validation_error(self):
+        response = self.api.post('/api/tasks', {
+            'text': 'Book a table',
+            'task_type': 'does-not-exist',
+            'client_id': self.client_user.id,
+            'contacts': [],
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('task_type', response.data)
+
+    def test_registry_is_invalidated_on_save(self):
+        self.assertIsNone(options.genders.get('other'))
+        Gender.objects.create(sort=2, display='Other', permalink='other')
+        self.assertEqual(options.genders.get('other').display, 'Other')
+
+    def test_option_views_are_served_without_queries(self):
+        options.task_types.all()
+        with self.assertNumQueries(0):
+            response = self.api.get('/api/option/task-types')
+        self.assertEqual(response.data['count'], TaskType.objects.count())
+
+
+class ConditionalGetTest(APITestCase):
+    """
+    Option and detail routes answer 304 when the client's ETag is current
+    """
+    def assertRevalidates(self, url):
+        response = self.api.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        with self.assertNumQueries(1):
+            response = self.api.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        return etag
+
+    def test_option_list_revalidates_without_queries(self):
+        etag = self.api.get('/api/option/genders')['ETag']
+        with self.assertNumQueries(0):
+            response = self.api.get('/api/option/genders', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        Gender.objects.create(sort=2, display='Other', permalink='other')
+        response = self.api.get('/api/option/genders', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_client_detail_revalidates(self):
+        url = '/api/clients/{}'.format(self.client_user.id)
+        etag = self.assertRevalidates(url)
+        self.api.patch(url, {'first_name': 'Cleopatra'}, format='json')
+        response = self.api.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['first_name'], 'Cleopatra')
+
+    def test_assistant_detail_revalidates(self):
+        self.assertRevalidates('/api/assistants/{}'.format(self.assistant.id))
+
+    def test_client_task_detail_revalidates(self):
+        task = self.create_tasks(1)[0]
+        url = '/api/clients/{}/tasks/{}'.format(self.client_user.id, task.id)
+        etag = self.assertRevalidates(url)
+        contact = task.contacts.first()
+        contact.first_name = 'Renamed'
+        contact.save()
+        response = self.api.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+
+class KeysetPaginationTest(APITestCase):
+    """
+    `?cursor=` switches listings to keyset pagination on (created_on, id)
+    """
+    def test_walks_every_task_once_without_counting(self):
+        created = self.create_tasks(45, contacts_per_task=1)
+        # Force timestamp ties so the id tie-breaker is exercised
+        Task.objects.filter(id__in=[t.id for t in created[10:30]]).update(created_on=created[10].created_on)
+        url = '/api/clients/{}/tasks?cursor='.format(self.client_user.id)
+        seen = []
+        while url:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.api.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('count', response.data)
+            self.assertEqual(len(queries), 2)
+            self.assertFalse(any('COUNT(' in q['sql'] for q in queries.captured_queries))
+            seen.extend(task['id'] for task in response.data['results'])
+            url = response.data['next']
+        expected = list(Task.objects.filter(client=self.client_user, is_archived=False)
+            .order_by('-created_on', '-id').values_list('id', flat=True))
+        self.assertEqual(seen, expected)
+
+    def test_invalid_cursor_is_not_found(self):
+        response = self.api.get('/api/tasks?cursor=bogus')
+        self.assertEqual(response.status_code, 404)
+
+    def test_page_size_param_no_longer_clashes_with_page_number(self):
+        self.create_tasks(5, contacts_per_task=0)
+        response = self.api.get('/api/tasks?page=2&page_size=5')
+        self.assertEqual(len(response.data['results']), 5)
+        self.assertIsNotNone(response.data['previous'])
+
+
+class TaskContactsBulkTest(APITestCase):
+    """
+    Attaching contacts to a task costs a fixed number of queries
+    """
+    def contacts_payload(self, count, offset=0):
+        return [{
+            'first_name': 'Bulk',
+            'last_name': str(i),
+            'email': 'bulk-{}@example.com'.format(i),
+            'phone': '555{:07d}'.format(i),
+            'client_id': self.client_user.id,
+        } for i in range(offset, offset + count)]
+
+    def post_contacts(self, task, contacts):
+        return self.api.post('/api/tasks/{}/contacts'.format(task.id), {'contacts': contacts}, format='json')
+
+    def test_query_count_is_independent_of_contact_count(self):
+        small, large = self.create_tasks(2, contacts_per_task=0)
+        with CaptureQueriesContext(connection) as few:
+            self.post_contacts(small, self.contacts_payload(4))
+        with CaptureQueriesContext(connection) as many:
+            response = self.post_contacts(large, self.contacts_payload(100, offset=4))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['contacts']), 100)
+        self.assertEqual(len(few), len(many))
+
+    def test_existing_contacts_are_reused_and_not_linked_twice(self):
+        task = self.create_tasks(1, contacts_per_task=0)[0]
+        self.post_contacts(task, self.contacts_payload(10))
+        response = self.post_contacts(task, self.contacts_payload(20))
+        self.assertEqual(len(response.data['contacts']), 20)
+        self.assertEqual(Contact.objects.filter(client=self.client_user).count(), 20)
+
+    def test_contact_ids(self):
+        task, other = self.create_tasks(2, contacts_per_task=3)
+        ids = list(other.contacts.values_list('id', flat=True))
+        response = self.post_contacts(task, ids)
+        self.assertEqual(len(response.data['contacts']), 6)
+        response = self.post_contacts(task, ids + [0])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.post_contacts(task, ['abc']).status_code, 400)
+
+    def test_invalid_contacts_are_rejected(self):
+        task = self.create_tasks(1, contacts_per_task=0)[0]
+        for contacts in ([{'first_name': 'A', 'last_name': 'B'}], self.contacts_payload(1) + [5],
+                [5] + self.contacts_payload(1)):
+            self.assertEqual(self.post_contacts(task, contacts).status_code, 400)
+        self.assertFalse(task.contacts.exists())
+
+    def test_contacts_without_email_or_phone_are_each_created(self):
+        contacts = Contact.bulk_get_or_create(self.client_user.id, [
+            {'first_name': 'A'}, {'first_name': 'B', 'phone': ''}, {'first_name': 'C', 'phone': '5550000001'}])
+        self.assertEqual([contact.first_name for contact in contacts], ['A', 'B', 'C'])
+        self.assertEqual(len(set(contact.id for contact in contacts)), 3)
+        contact = Contact.get_or_create_by_attrs({'first_name': 'D', 'client_id': self.client_user.id})
+        self.assertEqual(contact.first_name, 'D')
+
+    def test_contact_ids_of_other_clients_are_rejected(self):
+        task = self.create_tasks(1, contacts_per_task=0)[0]
+        other = self.create_client('other@assist.co', '5555550101')
+        contact = Contact.objects.create(first_name='Other', last_name='Contact', email='other-contact@example.com',
+            client=other)
+        self.assertEqual(self.post_contacts(task, [contact.id]).status_code, 400)
+        self.assertFalse(task.contacts.exists())
+
+
+class TasksBatchTest(APITestCase):
+    """
+    /api/tasks/batch creates many tasks with bulk inserts
+    """
+    def task_payload(self, i, contacts=2):
+        return {
+            'text': 'Imported {}'.format(i),
+            'task_type': self.task_type.permalink,
+            'client_id': self.client_user.id,
+            'contacts': [{
+                'first_name': 'Imported',
+                'last_name': str(j),
+                'email': 'imported-{}@example.com'.format(j),
+                'phone': None,
+                'client_id': self.client_user.id,
+            } for j in range(i, i + contacts)],
+        }
+
+    def test_creates_tasks_contacts_and_links(self):
+        payload = [self.task_payload(i) for i in range(50)]
+        response = self.api.post('/api/tasks/batch', payload, format='json')
+        self.assertEqual(response.status_code, 201)
+        ids = [result['id'] for result in response.data['results']]
+        tasks = Task.objects.in_bulk(ids)
+        for i, task_id in enumerate(ids):
+            task = tasks[task_id]
+            self.assertEqual(task.text, 'Imported {}'.format(i))
+            self.assertEqual(
+                sorted(task.contacts.values_list('email', flat=True)),
+                sorted('imported-{}@example.com'.format(j) for j in (i, i + 1)))
+        # Contacts shared between tasks are created once
+        self.assertEqual(Contact.objects.filter(email__startswith='imported-').count(), 51)
+
+    def test_reports_errors_per_item(self):
+        bad = self.task_payload(1)
+        bad['task_type'] = 'nope'
+        response = self.api.post('/api/tasks/batch', [self.task_payload(0), bad], format='json')
+        self.assertEqual(response.status_code, 201)
+        first, second = response.data['results']
+        self.assertTrue(Task.objects.filter(id=first['id']).exists())
+        self.assertIn('task_type', second['errors'])
+
+    def test_single_create_still_works(self):
+        response = self.api.post('/api/tasks', self.task_payload(0), format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.data['contacts']), 2)
+
+
+class SearchTest(APITestCase):
+    """
+    Full text search over a client's tasks and their contacts
+    """
+    def search(self, query, client=None, **params):
+        params['q'] = query
+        response = self.api.get('/api/clients/{}/search'.format((client or self.client_user).id), params)
+        self.assertEqual(response.status_code, 200)
+        return [task['id'] for task in response.data['results']]
+
+    def test_task_text_and_contacts_are_searchable(self):
+        dentist, dinner = self.create_tasks(2, contacts_per_task=0)
+        dentist.text = 'Book the dentist for Tuesday'
+        dentist.save()
+        dinner.contacts.add(Contact.objects.create(first_name='Zoe', last_name='Quinn',
+            email='zoe@bistro.example.com', phone='+1 (555) 010-4242', client=self.client_user))
+        self.assertEqual(self.search('dent'), [dentist.id])
+        self.assertEqual(self.search('zoe bistro'), [dinner.id])
+        self.assertEqual(self.search('5550104242'), [dinner.id])
+        self.assertEqual(self.search('dentist zoe'), [])
+
+    def test_index_follows_changes(self):
+        task = self.create_tasks(1, contacts_per_task=1)[0]
+        contact = task.contacts.get()
+        contact.first_name = 'Wilhelmina'
+        contact.save()
+        self.assertEqual(self.search('wilhelmina'), [task.id])
+        contact.delete()
+        self.assertEqual(self.search('wilhelmina'), [])
+        self.api.delete('/api/clients/{}/tasks/{}'.format(self.client_user.id, task.id))
+        self.assertEqual(self.search(task.text), [])
+
+    def test_scoped_per_client(self):
+        other = self.create_client('other@assist.co', '5555550101')
+        Task.objects.create(client=other, task_type=self.task_type, text='Renew passport')
+        self.assertEqual(self.search('passport'), [])
+        self.assertEqual(len(self.search('passport', client=other)), 1)
+
+    def test_bulk_created_tasks_and_pagination(self):
+        payload = [{
+            'text': 'Imported invoice {}'.format(i),
+            'task_type': self.task_type.permalink,
+            'client_id': self.client_user.id,
+            'contacts': [],
+        } for i in range(25)]
+        self.api.post('/api/tasks/batch', payload, format='json')
+        response = self.api.get('/api/clients/{}/search'.format(self.client_user.id), {'q': 'invoice'})
+        self.assertEqual(len(response.data['results']), 20)
+        response = self.api.get(response.data['next'])
+        self.assertEqual(len(response.data['results']), 5)
+        self.assertIsNone(response.data['next'])
+
+    def test_rebuild(self):
+        self.create_tasks(3)
+        with connection.cursor() as cursor:
+            search.backend().clear(cursor)
+        self.assertEqual(self.search('contact'), [])
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(len(self.search('contact')), 3)
+
+    def test_query_is_required(self):
+        response = self.api.get('/api/clients/{}/search'.format(self.client_user.id), {'q': ' ?! '})
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(SYNC={'SETTLE_SECONDS': 0})
+class ChangesSyncTest(APITestCase):
+    """
+    /api/clients/<id>/changes returns the rows changed since a watermark
+    """
+    def sync(self, since=None, **params):
+        if since:
+            params['since'] = since
+        response = self.api.get('/api/clients/{}/changes'.format(self.client_user.id), params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_full_then_incremental_sync(self):
+        first, second = self.create_tasks(2, contacts_per_task=1)
+        data = self.sync()
+        self.assertEqual([task['id'] for task in data['tasks']], [first.id, second.id])
+        self.assertEqual(len(data['contacts']), 2)
+        self.assertFalse(data['has_more'])
+
+        # No changes, one index probe per table
+        with self.assertNumQueries(3):
+            unchanged = self.sync(data['watermark'])
+        self.assertEqual((unchanged['tasks'], unchanged['contacts']), ([], []))
+        self.assertEqual(unchanged['watermark'], data['watermark'])
+
+        first.text = 'Changed'
+        first.save()
+        self.api.delete('/api/clients/{}/tasks/{}'.format(self.client_user.id, second.id))
+        contact_id = second.contacts.get().id
+        Contact.objects.filter(id=contact_id).delete()
+        changed = self.sync(data['watermark'])
+        self.assertEqual([task['text'] for task in changed['tasks']], ['Changed'])
+        self.assertEqual(changed['deleted'], {'tasks': [second.id], 'contacts': [contact_id]})
+        self.assertEqual(self.sync(changed['watermark'])['deleted'], {'tasks': [], 'contacts': []})
+
+    def test_pages_with_the_same_timestamp(self):
+        tasks = self.create_tasks(5, contacts_per_task=0)
+        Task.objects.filter(id__in=[task.id for task in tasks]).update(updated_on=timezone.now())
+        seen = []
+        data = self.sync(page_size=2, fields='id')
+        seen.extend(task['id'] for task in data['tasks'])
+        while data['has_more']:
+            data = self.sync(data['watermark'], page_size=2, fields='id')
+            seen.extend(task['id'] for task in data['tasks'])
+        self.assertEqual(seen, [task.id for task in tasks])
+
+    @override_settings(SYNC={'SETTLE_SECONDS': 60})
+    def test_recent_rows_wait_to_settle(self):
+        self.create_tasks(1)
+        self.assertEqual(self.sync()['tasks'], [])
+
+    def test_invalid_watermark(self):
+        response = self.api.get('/api/clients/{}/changes'.format(self.client_user.id), {'since': 'nope'})
+        self.assertEqual(response.status_code, 400)
+
+
+class TasksExportTest(APITestCase):
+    """
+    /api/tasks/export streams tasks in the TaskSerializer layout
+    """
+    def export(self, **params):
+        response = self.api.get('/api/tasks/export', params)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode('utf-8')
+
+    def test_ndjson_matches_the_task_serializer(self):
+        self.create_tasks(3)
+        Task.objects.filter(id=self.create_tasks(1)[0].id).update(assistant=None)
+        lines = self.export().splitlines()
+        tasks = Task.objects.with_related().order_by('id')
+        self.assertEqual(len(lines), tasks.count())
+        expected = serializers.TaskSerializer(tasks, many=True).data
+        self.assertEqual([json.loads(line) for line in lines], json.loads(json.dumps(expected)))
+
+    def test_chunks_keep_query_count_flat(self):
+        self.create_tasks(20)
+        with mock.patch('assist_co_server.views.TasksExportView.chunk_size', 10), \
+                CaptureQueriesContext(connection) as chunked:
+            lines = self.export(fields='id,text')
+        self.assertEqual(len(lines.splitlines()), Task.objects.count())
+        # One query per chunk as contacts are not requested, then the empty chunk
+        chunks = -(-Task.objects.count() // 10)
+        self.assertEqual(len(chunked), chunks * 1 + 1)
+        self.assertEqual(json.loads(lines.splitlines()[0]).keys(), {'id', 'text'})
+
+    def test_csv_and_filters(self):
+        task = self.create_tasks(2)[0]
+        Task.objects.filter(id=self.create_tasks(1)[0].id).update(state='completed')
+        rows = list(csv.DictReader(io.StringIO(self.export(format='csv', state='ready'))))
+        self.assertEqual(len(rows), Task.objects.filter(state='ready').count())
+        row = [row for row in rows if row['id'] == str(task.id)][0]
+        self.assertEqual(row['task_type.permalink'], self.task_type.permalink)
+        self.assertEqual(row['client.primary_assistant.email'], self.assistant.email)
+        self.assertEqual(len(json.loads(row['contacts'])), 2)
+        self.assertEqual(self.api.get('/api/tasks/export', {'state': 'nope'}).status_code, 400)
+
+    def test_command(self):
+        self.create_tasks(2)
+        out = StringIO()
+        call_command('export_tasks', stdout=out)
+        self.assertEqual(len(out.getvalue().splitlines()), Task.objects.count())
+
+
+@override_settings(PROFILE_THUMBNAILS={'SIZES': (32, 64)})
+class ProfilePictureTest(APITestCase):
+    """
+    Uploads are stored as is and thumbnailed outside the request
+    """
+    def setUp(self):
+        super(ProfilePictureTest, self).setUp()
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        settings_override = self.settings(MEDIA_ROOT=media)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def upload(self, url, name='me.png', size=(300, 200)):
+        picture = io.BytesIO()
+        Image.new('RGB', size, 'purple').save(picture, 'PNG')
+        upload = SimpleUploadedFile(name, picture.getvalue(), content_type='image/png')
+        return self.api.post(url, {'profile_pic': upload}, format='multipart')
+
+    @override_settings(JOBS={'BACKEND': 'db'})
+    def test_upload_is_thumbnailed_by_a_job(self):
+        url = '/api/clients/{}/profile-pic'.format(self.client_user.id)
+        response = self.upload(url)
+        self.assertEqual(response.status_code, 202)
+        self.assertIn('user_profile_image/{}/me'.format(self.client_user.id), response.data['profile_pic'])
+        self.assertIsNone(response.data['profile_pic_thumbnails'])
+
+        call_command('run_jobs', once=True, workers=0, stdout=StringIO())
+        data = self.api.get('/api/clients/{}'.format(self.client_user.id)).data
+        self.assertEqual(list(data['profile_pic_thumbnails']), ['32', '64'])
+        client = Client.objects.get(id=self.client_user.id)
+        for size in (32, 64):
+            name = thumbnails.thumbnail_name(client.profile_pic.name, size, client.thumbnail_format)
+            with default_storage.open(name) as f:
+                self.assertEqual(Image.open(f).size, (size, size))
+
+    def test_replacing_a_picture_deletes_the_previous_one(self):
+        url = '/api/assistants/{}/profile-pic'.format(self.assistant.id)
+        self.upload(url, 'first.png')
+        first = Assistant.objects.get(id=self.assistant.id).profile_pic.name
+        self.upload(url, 'second.png')
+        self.assertFalse(default_storage.exists(first))
+        self.assertFalse(default_storage.exists(thumbnails.thumbnail_name(first, 32, 'jpeg')))
+        self.assertTrue(Assistant.objects.get(id=self.assistant.id).thumbnail_format)
+
+    def test_rejects_non_images(self):
+        url = '/api/clients/{}/profile-pic'.format(self.client_user.id)
+        upload = SimpleUploadedFile('notes.txt', b'hello', content_type='text/plain')
+        response = self.api.post(url, {'profile_pic': upload}, format='multipart')
+        self.assertEqual(response.status_code, 400)
+
+
+class JobsTest(APITestCase):
+    """
+    Jobs run inline, after the commit on a pool or from the jobs table
+    """
+    def setUp(self):
+        super(JobsTest, self).setUp()
+        del calls[:]
+
+    def run_jobs(self):
+        # Failures are logged with their traceback
+        with mock.patch('assist_co_server.jobs.logger'):
+            call_command('run_jobs', once=True, workers=0, stdout=StringIO())
+
+    def test_sync_backend_runs_inline(self):
+        jobs.enqueue(record_call, 'a')
+        self.assertEqual(calls, ['a'])
+        with self.assertRaises(LookupError):
+            jobs.enqueue(len, 'a')
+
+    @override_settings(JOBS={'BACKEND': 'local'})
+    def test_local_backend_submits_after_commit(self):
+        with mock.patch('assist_co_server.jobs.transaction.on_commit') as on_commit, \
+                mock.patch('assist_co_server.jobs.executor') as executor:
+            jobs.enqueue(record_call, 'a')
+            self.assertFalse(executor.called)
+            on_commit.call_args[0][0]()
+        executor.return_value.submit.assert_called_once_with(
+            jobs.run_local, 'assist_co_server.tests.record_call', '["a"]', 1)
+
+    @override_settings(JOBS={'BACKEND': 'db'})
+    def test_db_backend_deletes_finished_jobs(self):
+        jobs.enqueue(record_call, 'a')
+        self.assertEqual(calls, [])
+        self.run_jobs()
+        self.assertEqual(calls, ['a'])
+        self.assertFalse(Job.objects.exists())
+
+    @override_settings(JOBS={'BACKEND': 'db', 'MAX_ATTEMPTS': 2, 'BACKOFF_SECONDS': 30})
+    def test_db_backend_retries_with_backoff(self):
+        jobs.enqueue(record_call, 'a', 5)
+        self.run_jobs()
+        job = Job.objects.get()
+        self.assertEqual((job.state, job.attempts), (Job.QUEUED, 1))
+        self.assertGreater(job.run_after, timezone.now() + datetime.timedelta(seconds=20))
+        self.assertIn('ValueError', job.last_error)
+
+        # Not due yet
+        self.run_jobs()
+        self.assertEqual(calls, ['a'])
+        Job.objects.update(run_after=timezone.now())
+        self.run_jobs()
+        job = Job.objects.get()
+        self.assertEqual((job.state, job.attempts), (Job.FAILED, 2))
+        self.assertEqual(calls, ['a', 'a'])
+
+    @override_settings(JOBS={'BACKEND': 'db'})
+    def test_claimed_jobs_are_not_claimed_again_until_lost(self):
+        jobs.enqueue(record_call, 'a')
+        jobs.enqueue(record_call, 'b')
+        self.assertEqual(len(jobs.claim(10)), 2)
+        self.assertEqual(jobs.claim(10), [])
+        Job.objects.update(locked_until=timezone.now() - datetime.timedelta(seconds=1))
+        self.assertEqual([job.attempts for job in jobs.claim(10)], [2, 2])
+
+    @override_settings(JOBS={'BACKEND': 'db'})
+    def test_login_stamps_last_login_in_a_job(self):
+        with mock.patch('assist_co_server.serializers.authenticate', return_value=self.client_user):
+            response = self.api.post('/api/login', {'email': 'client@assist.co', 'password': 'secret'})
+        self.assertIn('token', response.data)
+        self.assertIsNone(User.objects.get(id=self.client_user.id).last_login)
+        self.run_jobs()
+        self.assertIsNotNone(User.objects.get(id=self.client_user.id).last_login)
+
+
+class AssignmentTest(APITestCase):
+    """
+    New ready tasks go to the primary assistant, then to the least loaded one
+    """
+    def create_assistant(self, email):
+        return Assistant.objects.create(username=email, email=email, first_name='Ada', last_name='Other',
+            gender=self.gender, date_of_birth=datetime.date(1990, 1, 1))
+
+    def post_tasks(self, client, count):
+        payload = [{'text': 'New task {}'.format(i), 'task_type': self.task_type.permalink,
+            'client_id': client.id, 'contacts': []} for i in range(count)]
+        response = self.api.post('/api/tasks/batch', payload, format='json')
+        return [result['id'] for result in response.data['results']]
+
+    def assistants_of(self, task_ids):
+        tasks = Task.objects.filter(id__in=task_ids).order_by('id')
+        return [task.assistant_id for task in tasks]
+
+    def test_new_task_goes_to_the_primary_assistant(self):
+        self.create_assistant('idle@assist.co')
+        response = self.api.post('/api/tasks', {
+            'text': 'Call the plumber', 'task_type': self.task_type.permalink,
+            'client_id': self.client_user.id, 'contacts': []}, format='json')
+        self.assertEqual(Task.objects.get(id=response.data['id']).assistant_id, self.assistant.id)
+
+    @override_settings(ASSIGNMENT={'PRIMARY_MAX_LOAD': 2})
+    def test_busy_primary_falls_back_to_the_least_loaded(self):
+        idle = self.create_assistant('idle@assist.co')
+        busy = self.create_assistant('busy@assist.co')
+        for i in range(3):
+            Task.objects.create(client=self.client_user, assistant=busy, task_type=self.task_type,
+                text='Busy {}'.format(i), state='executing')
+        task_ids = self.post_tasks(self.client_user, 5)
+        # Ties go to the lowest id
+        self.assertEqual(self.assistants_of(task_ids),
+            [self.assistant.id] * 2 + [idle.id] * 2 + [self.assistant.id])
+
+    def test_spreads_a_burst_over_assistants(self):
+        others = [self.create_assistant('other-{}@assist.co'.format(i)) for i in range(3)]
+        client = self.create_client('noprimary@assist.co', '5555550102')
+        Client.objects.filter(id=client.id).update(primary_assistant=None)
+        counts = collections.Counter(self.assistants_of(self.post_tasks(client, 40)))
+        self.assertEqual(sorted(counts), sorted([self.assistant.id] + [a.id for a in others]))
+        self.assertEqual(set(counts.values()), {10})
+
+    def test_leaves_assigned_and_started_tasks_alone(self):
+        other = self.create_assistant('other@assist.co')
+        assigned = Task.objects.create(client=self.client_user, assistant=other, task_type=self.task_type, text='a')
+        started = Task.objects.create(client=self.client_user, task_type=self.task_type, text='b', state='executing')
+        assignment.engine.assign([assigned.id, started.id])
+        self.assertEqual(self.assistants_of([assigned.id, started.id]), [other.id, None])
+
+    def test_plan_skips_stale_heap_entries(self):
+        engine = assignment.AssignmentEngine(primary_max_load=1)
+        engine.load({1: 0, 2: 5, 3: 1})
+        plan = engine.plan([(10, 2), (11, 2), (12, None), (13, None), (14, 3)])
+        self.assertEqual(plan, {1: [10, 11, 13], 3: [12, 14]})
+        self.assertEqual(engine.loads, {1: 3, 2: 5, 3: 3})
+        self.assertEqual(assignment.AssignmentEngine().plan([(1, None)]), {})
+
+    def test_simulation(self):
+        out = StringIO()
+        call_command('simulate_assignment', assistants=5, clients=20, tasks=200, batch_size=50, threads=2, stdout=out)
+        self.assertIn('heap', out.getvalue())
+
+
+class TaskTransitionTest(APITestCase):
+    """
+    State changes are compare-and-set updates along TASK_TRANSITIONS
+    """
+    def setUp(self):
+        super(TaskTransitionTest, self).setUp()
+        self.task = self.create_tasks(1)[0]
+        self.url = '/api/clients/{}/tasks/{}'.format(self.client_user.id, self.task.id)
+
+    def transition(self, **data):
+        return self.api.post(self.url + '/transition', data, format='json')
+
+    def test_only_one_assistant_takes_a_task(self):
+        other = Assistant.objects.create(username='other@assist.co', email='other@assist.co',
+            first_name='Ada', last_name='Other', gender=self.gender, date_of_birth=datetime.date(1990, 1, 1))
+        first = self.transition(state='executing', expected_state='ready', assistant_id=other.id)
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual((first.data['state'], first.data['assistant']['email']), ('executing', other.email))
+        second = self.transition(state='executing', expected_state='ready', assistant_id=self.assistant.id)
+        self.assertEqual(second.status_code, 409)
+        self.assertEqual(second.data['state'], 'executing')
+        self.assertEqual(Task.objects.get(id=self.task.id).assistant_id, other.id)
+
+    def test_completion_is_stamped(self):
+        self.transition(state='executing')
+        # Savepoint, the UPDATE, the task and its contacts, the two counts
+        with self.assertNumQueries(7):
+            response = self.transition(state='completed')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['is_complete'])
+        self.assertIsNotNone(response.data['completed_on'])
+        # Finished tasks stay finished
+        self.assertEqual(self.transition(state='ready').status_code, 409)
+        self.assertEqual(self.transition(state='executing', expected_state='completed').status_code, 400)
+
+    def test_patch_goes_through_transitions(self):
+        response = self.api.patch(self.url, {'state': 'completed'}, format='json')
+        self.assertEqual(response.status_code, 409)
+        response = self.api.patch(self.url, {'state': 'terminated', 'text': 'Never mind', 'is_complete': True},
+            format='json')
+        self.assertEqual(response.status_code, 200)
+        task = Task.objects.get(id=self.task.id)
+        self.assertEqual((task.state, task.text, task.is_complete), ('terminated', 'Never mind', False))
+        self.assertEqual(self.api.patch(self.url, {'state': 'sleeping'}, format='json').status_code, 400)
+
+    def test_patch_does_not_undo_a_concurrent_transition(self):
+        serializer = serializers.TaskSerializer(self.task, data={'text': 'Edited'}, partial=True)
+        self.assertTrue(serializer.is_valid())
+        Task.objects.transition(self.task.id, 'executing')
+        serializer.save()
+        task = Task.objects.get(id=self.task.id)
+        self.assertEqual((task.state, task.text), ('executing', 'Edited'))
+
+
+class AssistantQueueTest(APITestCase):
+    """
+    /api/assistants/<id>/queue and the task counts kept with the task writes
+    """
+    def counts(self, assistant=None):
+        return task_counts.counts((assistant or self.assistant).id)
+
+    def recounted(self):
+        call_command('rebuild_task_counts', stdout=StringIO())
+        return self.counts()
+
+    def test_counts_follow_task_writes(self):
+        tasks = self.create_tasks(4, contacts_per_task=0)
+        self.api.post('/api/clients/{}/tasks/{}/transition'.format(self.client_user.id, tasks[0].id),
+            {'state': 'executing'}, format='json')
+        self.api.patch('/api/clients/{}/tasks/{}'.format(self.client_user.id, tasks[1].id),
+            {'state': 'terminated'}, format='json')
+        self.api.delete('/api/clients/{}/tasks/{}'.format(self.client_user.id, tasks[2].id))
+        tasks[3].delete()
+        # Created unassigned, then assigned by the engine
+        self.post_batch(2)
+        expected = {'ready': 2, 'executing': 1, 'completed': 0, 'terminated': 1}
+        self.assertEqual(self.counts(), expected)
+        self.assertEqual(self.recounted(), expected)
+
+    def test_reassignment_moves_the_count(self):
+        other = Assistant.objects.create(username='other@assist.co', email='other@assist.co',
+            first_name='Ada', last_name='Other', gender=self.gender, date_of_birth=datetime.date(1990, 1, 1))
+        task = self.create_tasks(1, contacts_per_task=0)[0]
+        Task.objects.transition(task.id, 'executing', assistant_id=other.id)
+        self.assertEqual((self.counts()['ready'], self.counts(other)['executing']), (0, 1))
+
+    def post_batch(self, count):
+        payload = [{'text': 'Batch {}'.format(i), 'task_type': self.task_type.permalink,
+            'client_id': self.client_user.id, 'contacts': []} for i in range(count)]
+        self.api.post('/api/tasks/batch', payload, format='json')
+
+    def test_queue_lists_open_tasks_without_counting_them(self):
+        ready, executing, done = self.create_tasks(3, contacts_per_task=0)
+        Task.objects.transition(executing.id, 'executing')
+        Task.objects.transition(done.id, 'terminated')
+        url = '/api/assistants/{}/queue'.format(self.assistant.id)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.api.get(url)
+        self.assertEqual([task['id'] for task in response.data['results']], [executing.id, ready.id])
+        self.assertEqual(response.data['count'], 2)
+        self.assertEqual(response.data['counts'], {'ready': 1, 'executing': 1, 'completed': 0, 'terminated': 1})
+        self.assertFalse([query for query in queries if 'COUNT(' in query['sql']])
+        self.assertEqual(self.api.get('/api/assistants/999999/queue').status_code, 404)
+
+
+class CachingTokenAuthenticationTest(APITestCase):
+    """
+    Repeat tokens are authenticated without touching the database
+    """
+    def setUp(self):
+        super(CachingTokenAuthenticationTest, self).setUp()
+        token_cache.clear()
+        self.token = self.client_user.get_or_create_token()
+        self.auth = CachingTokenAuthentication()
+
+    def test_second_lookup_is_a_cache_hit(self):
+        with self.assertNumQueries(1):
+            user, token = self.auth.authenticate_credentials(self.token.key)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.auth.authenticate_credentials(self.token.key)[0].id, user.id)
+        self.assertEqual(token_cache.stats()['hits'], 1)
+        self.assertEqual(token_cache.stats()['misses'], 1)
+
+    def test_logout_invalidates(self):
+        self.auth.authenticate_credentials(self.token.key)
+        self.api.force_authenticate(user=self.client_user.user_ptr)
+        self.api.delete('/api/logout')
+        with self.assertRaises(AuthenticationFailed):
+            self.auth.authenticate_credentials(self.token.key)
+
+    def test_deactivating_client_invalidates(self):
+        self.auth.authenticate_credentials(self.token.key)
+        self.api.delete('/api/clients/{}'.format(self.client_user.id))
+        with self.assertRaises(AuthenticationFailed):
+            self.auth.authenticate_credentials(self.token.key)
+
+    def test_cache_is_bounded(self):
+        cache = TokenCache(max_size=2, ttl=60)
+        for key in ('a', 'b', 'c'):
+            cache.set(key, key)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get('c'), 'c')
+
+    def test_shared_cache_deletes_apply_to_every_process(self):
+        first = TokenCache(max_size=10, ttl=60, cache_alias='default')
+        second = TokenCache(max_size=10, ttl=60, cache_alias='default')
+        self.addCleanup(first.shared.clear)
+        first.set(self.token.key, 'cached')
+        self.assertEqual(second.get(self.token.key), 'cached')
+        self.assertEqual(first.get(self.token.key), 'cached')
+        first.delete(self.token.key)
+        self.assertIsNone(second.get(self.token.key))
+
+
+class PerformanceMiddlewareTest(APITestCase):
+    """
+    Sampled requests are recorded per view and exposed at /api/metrics
+    """
+    def setUp(self):
+        super(PerformanceMiddlewareTest, self).setUp()
+        metrics.registry.reset()
+
+    @override_settings(PERF_METRICS={'SAMPLE_RATE': 1.0, 'SERVER_TIMING': True})
+    def test_records_view_metrics(self):
+        self.create_tasks(3)
+        api = APIClient()
+        response = api.get('/api/clients/{}/tasks'.format(self.client_user.id))
+        self.assertIn('db;dur=', response['Server-Timing'])
+        body = api.get('/api/metrics').content.decode('utf-8')
+        self.assertIn('assist_db_queries_bucket{view="ClientTasksView",le="5"} 1', body)
+        self.assertIn('assist_request_seconds_count{view="ClientTasksView"} 1', body)
+        self.assertIn('assist_response_bytes_count{view="ClientTasksView"} 1', body)
+        self.assertIn('assist_token_cache_hits_total', body)
+
+    @override_settings(PERF_METRICS={'SAMPLE_RATE': 0, 'SERVER_TIMING': True})
+    def test_sampling_off_records_nothing(self):
+        api = APIClient()
+        response = api.get('/api/option/genders')
+        self.assertFalse(response.has_header('Server-Timing'))
+        self.assertNotIn('GendersView', metrics.registry.render())
+
+
+class DatabaseTuningTest(TestCase):
+    """
+    Connection level settings from assist_co_server/db.py
+    """
+    def test_sqlite_pragmas_are_applied(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('sqlite only')
+        cursor = connection.cursor()
+        cursor.execute('PRAGMA synchronous')
+        self.assertEqual(cursor.fetchone()[0], 1)
+        cursor.execute('PRAGMA busy_timeout')
+        self.assertEqual(cursor.fetchone()[0], settings.SQLITE_PRAGMAS['busy_timeout'])
+
+    @override_settings(DB_HEALTH_CHECKS=True)
+    def test_dead_persistent_connection_is_closed_before_request(self):
+        conn = mock.Mock(connection=object(), settings_dict={'CONN_MAX_AGE': 60})
+        conn.is_usable.return_value = False
+        with mock.patch('assist_co_server.db.connections') as connections:
+            connections.all.return_value = [conn]
+            request_started.send(sender=self.__class__)
+        conn.close.assert_called_once_with()
+
+    @override_settings(DB_HEALTH_CHECKS=True)
+    def test_healthy_connection_is_kept(self):
+        conn = mock.Mock(connection=object(), settings_dict={'CONN_MAX_AGE': 60})
+        conn.is_usable.return_value = True
+        with mock.patch('assist_co_server.db.connections') as connections:
+            connections.all.return_value = [conn]
+            request_started.send(sender=self.__class__)
+        self.assertFalse(conn.close.called)
+
+
+class ContactIndexesTest(APITestCase):
+    """
+    Contacts are unique per client and the hot lookups are served by indexes
+    """
+    def test_same_email_for_different_clients(self):
+        other = self.create_client('other@assist.co', '5555550101')
+        for client in (self.client_user, other):
+            response = self.api.post('/api/contacts', {
+                'first_name': 'Shared',
+                'last_name': 'Contact',
+                'email': 'shared@example.com',
+                'phone': None,
+                'client_id': client.id,
+            }, format='json')
+            self.assertEqual(response.status_code, 201)
+        response = self.api.post('/api/contacts', {
+            'first_name': 'Shared',
+            'last_name': 'Again',
+            'email': 'shared@example.com',
+            'client_id': other.id,
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_phone_only_contacts(self):
+        task = self.create_tasks(1, contacts_per_task=0)[0]
+        response = self.api.post('/api/tasks/{}/contacts'.format(task.id), {'contacts': [{
+            'first_name': 'Phone',
+            'last_name': str(i),
+            'email': '',
+            'phone': '555000{:04d}'.format(i),
+        } for i in range(3)]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Contact.objects.filter(client=self.client_user, email__isnull=True).count(), 3)
+
+    def test_explain_queries(self):
+        out = StringIO()
+        call_command('explain_queries', stdout=out)
+        self.assertNotIn('full scan', out.getvalue())
+
+
+class SignupTest(APITestCase):
+    """
+    Emails and phones are unique, checked in one query and by the indexes
+    """
+    def signup(self, email='new@example.com', phone='5555550199'):
+        return self.api.post('/api/signup', {
+            'email': email,
+            'password': 'secret-password',
+            'first_name': 'New',
+            'last_name': 'Client',
+            'date_of_birth': '1990-01-01',
+            'gender': 'male',
+            'phone': phone,
+            'profession': self.profession.permalink,
+        }, format='json')
+
+    def test_signup_creates_client_and_token(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.signup(email='New@Example.com')
+        self.assertEqual(response.status_code, 200)
+        client = Client.objects.get(id=response.data['client_id'])
+        self.assertEqual(client.email, 'new@example.com')
+        self.assertEqual(client.auth_token.key, response.data['token'])
+        # The existence check, nothing read back after the inserts
+        user_selects = [query for query in queries if query['sql'].startswith('SELECT')
+            and ('auth_user' in query['sql'] or 'clients' in query['sql'])]
+        self.assertEqual(len(user_selects), 1)
+
+    def test_taken_email_and_phone(self):
+        response = self.signup(email='Client@Assist.co', phone='5555550100')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data, {'email': ['Email already exists'], 'phone': ['Phone number already exists']})
+        self.assertEqual(self.signup(phone='5555550100').data, {'phone': ['Phone number already exists']})
+
+    def test_race_is_settled_by_the_indexes(self):
+        # Another signup takes the email between the check and the insert
+        with mock.patch('assist_co_server.serializers.taken_identities', side_effect=[set(), {'email'}]):
+            response = self.signup(email='CLIENT@assist.co')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data, {'email': ['Email already exists']})
+        self.assertFalse(Client.objects.filter(phone='5555550199').exists())
+
+    def test_client_keeps_own_email_and_phone(self):
+        response = self.api.patch('/api/clients/{}'.format(self.client_user.id),
+            {'email': 'client@assist.co', 'phone': '5555550100', 'first_name': 'Cleo'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        other = self.create_client('other@assist.co', '5555550101')
+        response = self.api.patch('/api/clients/{}'.format(other.id), {'phone': '5555550100'}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_migration_lists_duplicate_emails(self):
+        migration = importlib.import_module('assist_co_server.migrations.0027_auto_20261018_1938')
+        self.assertEqual(migration.find_duplicates(connection), ([], []))
+        with connection.cursor() as cursor:
+            cursor.execute('DROP INDEX auth_user_email_lower')
+        self.create_client('Client@Assist.co', '5555550101')
+        with self.assertRaisesRegex(RuntimeError, 'Duplicate emails: client@assist.co. Duplicate phones: none.'):
+            migration.check_duplicates(None, mock.Mock(connection=connection))
+
+
+@override_settings(PBKDF2_ITERATIONS=1000)
+class EmailBackendTest(APITestCase):
+    """
+    Login by email whatever its case, with passwords rehashed on login
+    """
+    def login(self, email='Client@Assist.co', password='secret-password'):
+        return self.api.post('/api/login', {'email': email, 'password': password}, format='json')
+
+    def password(self):
+        return User.objects.get(id=self.client_user.id).password
+
+    def test_login_by_email(self):
+        self.client_user.set_password('secret-password')
+        self.client_user.save()
+        response = self.login()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['token'], self.client_user.get_or_create_token().key)
+        self.assertEqual(self.login(password='wrong').status_code, 400)
+        self.assertEqual(self.login(email='nobody@assist.co').status_code, 400)
+
+    def test_plaintext_password_is_hashed_on_login(self):
+        User.objects.filter(id=self.client_user.id).update(password='secret-password')
+        self.assertEqual(self.login().status_code, 200)
+        self.assertTrue(self.password().startswith('pbkdf2_sha256$1000$'))
+        self.assertEqual(self.login().status_code, 200)
+
+    def test_hash_is_not_a_password(self):
+        self.client_user.set_password('secret-password')
+        self.client_user.save()
+        self.assertEqual(self.login(password=self.password()).status_code, 400)
+
+    def test_rehash_with_new_iterations(self):
+        self.client_user.set_password('secret-password')
+        self.client_user.save()
+        with override_settings(PBKDF2_ITERATIONS=1200):
+            self.assertEqual(self.login().status_code, 200)
+        self.assertTrue(self.password().startswith('pbkdf2_sha256$1200$'))
+
+    def test_username_login_for_the_admin(self):
+        self.client_user.set_password('secret-password')
+        self.client_user.save()
+        self.assertEqual(authenticate(username='client@assist.co', password='secret-password').id,
+            self.client_user.id)
+        # Failed email logins don't go on to the username backend
+        with mock.patch.object(ModelBackend, 'authenticate') as username_authenticate:
+            self.assertEqual(self.login(password='wrong').status_code, 400)
+        username_authenticate.assert_not_called()
+
+    def test_signup_hashes_the_password(self):
+        response = self.api.post('/api/signup', {
+            'email': 'new@example.com',
+            'password': 'secret-password',
+            'first_name': 'New',
+            'last_name': 'Client',
+            'date_of_birth': '1990-01-01',
+            'gender': 'male',
+            'phone': '5555550199',
+            'profession': self.profession.permalink,
+        }, format='json')
+        self.assertTrue(User.objects.get(id=response.data['client_id']).password.startswith('pbkdf2_sha256$'))
+        self.assertEqual(self.login(email='NEW@example.com').status_code, 200)
+
+
+class ThrottlingTest(APITestCase):
+    """
+    Sliding window limits rejecting requests before they do any work
+    """
+    def test_sliding_window(self):
+        limiter = throttling.SlidingWindowLimiter('test', 3, 60, max_keys=10)
+        self.assertEqual([limiter.hit('a', now=t) for t in (0, 1, 2)], [0, 0, 0])
+        self.assertAlmostEqual(limiter.hit('a', now=3), 77)
+        self.assertEqual(limiter.hit('b', now=3), 0)
+        # Halfway into the next window the 3 previous hits count for 1.5
+        self.assertEqual(limiter.hit('a', now=90), 0)
+        self.assertAlmostEqual(limiter.hit('a', now=90), 10)
+        self.assertEqual(limiter.hit('a', now=100), 0)
+        self.assertEqual(limiter.hit('a', now=240), 0)
+
+    def test_shared_counts(self):
+        limiters = [throttling.SlidingWindowLimiter('test', 2, 60, max_keys=10, cache_alias='default')
+            for i in range(2)]
+        for limiter in limiters:
+            limiter.shared.clear()
+        self.assertEqual(limiters[0].hit('a', now=0), 0)
+        self.assertEqual(limiters[1].hit('a', now=1), 0)
+        self.assertTrue(limiters[0].hit('a', now=2))
+        # Remembered locally, the shared cache isn't asked again
+        with mock.patch.object(limiters[0].shared, 'get_many') as get_many:
+            self.assertTrue(limiters[0].hit('a', now=3))
+        get_many.assert_not_called()
+
+    def test_zero_rate_rejects_every_request(self):
+        limiter = throttling.SlidingWindowLimiter('test', 0, 60, max_keys=10)
+        self.assertAlmostEqual(limiter.hit('a', now=15), 45)
+        with override_settings(THROTTLES={'RATES': {'login': '0/min'}}):
+            self.assertEqual(self.api.post('/api/login', {'email': 'client@assist.co', 'password': 'wrong'},
+                format='json').status_code, 429)
+
+    def test_invalid_rates(self):
+        self.assertEqual(throttling.parse_rate('0/hour'), (0, 3600))
+        for rate in ('-1/min', 'ten/min', '10/week', '10'):
+            with self.assertRaises(ImproperlyConfigured):
+                throttling.parse_rate(rate)
+
+    @override_settings(THROTTLES={'RATES': {'login': '2/min'}})
+    def test_login_is_rejected_before_any_work(self):
+        with mock.patch('assist_co_server.serializers.authenticate', return_value=None) as authenticate:
+            for i in range(2):
+                self.api.post('/api/login', {'email': 'client@assist.co', 'password': 'wrong'}, format='json')
+            with self.assertNumQueries(0):
+                response = self.api.post('/api/login', {'email': 'client@assist.co', 'password': 'wrong'},
+                    format='json', REMOTE_ADDR='10.0.0.2')
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+        self.assertEqual(authenticate.call_count, 2)
+
+    @override_settings(THROTTLES={'RATES': {'write': '1/min'}})
+    def test_writes_are_limited_not_reads(self):
+        payload = {'text': 'Book a table', 'task_type': self.task_type.permalink,
+            'client_id': self.client_user.id, 'contacts': []}
+        self.assertEqual(self.api.post('/api/tasks', payload, format='json').status_code, 201)
+        self.assertEqual(self.api.post('/api/tasks', payload, format='json').status_code, 429)
+        self.assertEqual(self.api.get('/api/tasks').status_code, 200)
+
+
+class ResponseCacheTest(APITestCase):
+    """
+    Client task lists are served from the response cache until a write
+    """
+    def setUp(self):
+        super(ResponseCacheTest, self).setUp()
+        self.task = self.create_tasks(2, contacts_per_task=1)[0]
+        self.url = '/api/clients/{}/tasks'.format(self.client_user.id)
+
+    def task_queries(self, url=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.api.get(url or self.url)
+        self.assertEqual(response.status_code, 200)
+        # The database cache backend reads its own table
+        return response, [query for query in queries if '"tasks"' in query['sql']]
+
+    def assertCached(self, url=None):
+        first = self.api.get(url or self.url)
+        second, queries = self.task_queries(url)
+        self.assertFalse(queries)
+        self.assertEqual(first.content, second.content)
+        return json.loads(second.content.decode('utf-8'))
+
+    def assertStale(self, write):
+        self.assertCached()
+        self.assertLess(write().status_code, 300)
+        self.assertTrue(self.task_queries()[1])
+
+    def test_pages_are_cached_per_query(self):
+        self.assertEqual(self.assertCached()['count'], 2)
+        self.assertEqual(len(self.assertCached(self.url + '?fields=id')['results'][0]), 1)
+        self.assertEqual(self.assertCached(self.url + '?cursor=')['next'], None)
+
+    def test_writes_make_pages_stale(self):
+        task_url = '{}/{}'.format(self.url, self.task.id)
+        contact = self.task.contacts.get()
+        self.assertStale(lambda: self.api.patch(task_url, {'text': 'Changed'}, format='json'))
+        self.assertStale(lambda: self.api.post(task_url + '/transition', {'state': 'executing'}, format='json'))
+        self.assertStale(lambda: self.api.post('/api/tasks/{}/contacts'.format(self.task.id), {'contacts': [
+            {'first_name': 'New', 'last_name': 'Contact', 'email': 'new-contact@example.com'}]}, format='json'))
+        self.assertStale(lambda: self.api.patch('/api/contacts/{}'.format(contact.id),
+            {'first_name': 'Renamed', 'email': contact.email, 'client_id': self.client_user.id}, format='json'))
+        self.assertStale(lambda: self.api.post('/api/tasks', {'text': 'New', 'task_type': self.task_type.permalink,
+            'client_id': self.client_user.id, 'contacts': []}, format='json'))
+        self.assertStale(lambda: self.api.delete(task_url))
+        self.assertStale(lambda: self.api.patch('/api/assistants/{}'.format(self.assistant.id),
+            {'first_name': 'Renamed'}, format='json'))
+        self.assertEqual(self.assertCached()['count'], 2)
+
+    def test_other_clients_pages_stay_cached(self):
+        other = self.create_client('other@assist.co', '5555550101')
+        other_url = '/api/clients/{}/tasks'.format(other.id)
+        self.assertCached(other_url)
+        self.api.patch('{}/{}'.format(self.url, self.task.id), {'text': 'Changed'}, format='json')
+        self.assertFalse(self.task_queries(other_url)[1])
+
+    def test_client_writes_only_make_their_own_pages_stale(self):
+        other = self.create_client('other@assist.co', '5555550101')
+        other_url = '/api/clients/{}/tasks'.format(other.id)
+        self.assertCached(other_url)
+        self.assertStale(lambda: self.api.patch('/api/clients/{}'.format(self.client_user.id),
+            {'first_name': 'Cleopatra'}, format='json'))
+        self.assertEqual(self.assertCached()['results'][0]['client']['first_name'], 'Cleopatra')
+        self.create_client('new@assist.co', '5555550102')
+        self.assertFalse(self.task_queries(other_url)[1])
+
+    def test_html_pages_are_not_cached(self):
+        other = self.create_client('other@assist.co', '5555550101')
+        for user in (self.client_user, other):
+            self.api.force_authenticate(user=user.user_ptr)
+            with CaptureQueriesContext(connection) as queries:
+                response = self.api.get(self.url, HTTP_ACCEPT='text/html')
+            self.assertEqual(response.status_code, 200)
+            # The navbar shows the requesting user
+            self.assertIn('<li class="navbar-text">{}</li>'.format(user.username), response.content.decode('utf-8'))
+            self.assertTrue([query for query in queries if '"tasks"' in query['sql']])
+
+    @override_settings(RESPONSE_CACHE={'MAX_BODY_BYTES': 100})
+    def test_large_pages_are_not_cached(self):
+        self.api.get(self.url)
+        self.assertTrue(self.task_queries()[1])
+
+    def test_file_and_database_backends(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        call_command('createcachetable', 'response_cache', verbosity=0)
+        for backend, location in (('filebased.FileBasedCache', directory), ('db.DatabaseCache', 'response_cache')):
+            cache = {'BACKEND': 'django.core.cache.backends.' + backend, 'LOCATION': location}
+            with override_settings(CACHES=dict(settings.CACHES, responses=cache)):
+                self.assertStale(lambda: self.api.patch('{}/{}'.format(self.url, self.task.id),
+                    {'text': backend}, format='json'))
+
+
+class RenderersTest(APITestCase):
+    """
+    The JSON renderer and parser match DRF's, whichever encoder is installed
+    """
+    data = collections.OrderedDict([
+        ('text', 'Caf\u00e9 \u2028 \u2029 </script>'),
+        ('created_on', datetime.datetime(2016, 11, 20, 10, 30, tzinfo=timezone.utc)),
+        ('date', datetime.date(2016, 11, 20)),
+        ('amount', decimal.Decimal('1.50')),
+        ('uuid', uuid.UUID(int=1)),
+        ('nested', [{'id': 1, 'ok': True, 'none': None, 'ratio': 0.5}]),
+    ])
+
+    def test_renders_like_drf(self):
+        for media_type in (None, 'application/json', 'application/json; indent=4'):
+            self.assertEqual(renderers.JSONRenderer().render(self.data, media_type),
+                drf_renderers.JSONRenderer().render(self.data, media_type))
+        self.assertEqual(renderers.JSONRenderer().render(None), b'')
+
+    def test_parser_round_trip(self):
+        content = renderers.JSONRenderer().render(self.data)
+        self.assertEqual(renderers.JSONParser().parse(io.BytesIO(content)),
+            drf_parsers.JSONParser().parse(io.BytesIO(content)))
+        self.assertEqual(renderers.JSONParser().parse(io.BytesIO('{"a": "\u00e9"}'.encode('utf-16')),
+            parser_context={'encoding': 'utf-16'}), {'a': '\u00e9'})
+        with self.assertRaises(ParseError):
+            renderers.JSONParser().parse(io.BytesIO(b'{"a": '))
+
+    def test_task_page_renders_like_drf_serializers(self):
+        self.create_tasks(3)
+        tasks = Task.objects.with_related().filter(client=self.client_user).order_by('id')
+        data = serializers.TaskSerializer(tasks, many=True).data
+        with mock.patch.object(serializers.PlainRepresentationMixin, 'to_representation',
+                drf_serializers.Serializer.to_representation):
+            stock = serializers.TaskSerializer(tasks, many=True).data
+        self.assertEqual(renderers.JSONRenderer().render(data), drf_renderers.JSONRenderer().render(stock))
+        self.assertIs(type(data[0]['client']), dict)
+        self.assertEqual(data[0]['client']['phone'], str(self.client_user.phone))
+
+    def test_api_uses_renderer_and_parser(self):
+        response = self.api.post('/api/tasks', json.dumps({'text': 'Caf\u00e9', 'task_type': self.task_type.permalink,
+            'client_id': self.client_user.id, 'contacts': []}), content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.content, drf_renderers.JSONRenderer().render(response.data))
+        self.assertEqual(json.loads(response.content.decode('utf-8'))['text'], 'Caf\u00e9')
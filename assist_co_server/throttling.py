@@ -0,0 +1,259 @@
+"""
+Rate limits for login, signup and writes, checked before the request does
+any work.
+
+Each scope has a sliding window limiter allowing a number of requests per
+period and key. Login is limited per client IP and per email, signup per IP
+and every write (POST, PUT, PATCH, DELETE) per IP. Views with
+EarlyThrottleMixin check their throttles before authenticating, so a
+rejected request costs no query and no password hash.
+
+Configured with settings.THROTTLES:
+
+    THROTTLES = {
+        'RATES': {              # requests per second, min, hour or day
+            'login': '10/min',
+            'signup': '20/hour',
+            'write': '300/min',
+        },
+        'MAX_KEYS': 100000,     # keys counted in the process local LRU
+        'CACHE_ALIAS': None,    # Django cache alias shared between processes
+    }
+
+A scope without a rate isn't limited, one with a rate of 0 rejects every
+request. Without CACHE_ALIAS every process
+counts on its own, so each one allows the full rate.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework.throttling import BaseThrottle
+
+DEFAULTS = {
+    'RATES': {
+        'login': '10/min',
+        'signup': '20/hour',
+        'write': '300/min',
+    },
+    'MAX_KEYS': 100000,
+    'CACHE_ALIAS': None,
+}
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_rate(rate):
+    """
+    (requests, period in seconds) of a rate like '10/min'
+    """
+    try:
+        requests, period = rate.split('/')
+        requests, period = int(requests), PERIODS[period[0]]
+    except (ValueError, KeyError, IndexError):
+        raise ImproperlyConfigured("Invalid throttle rate '{}'".format(rate))
+    if requests < 0:
+        raise ImproperlyConfigured("Negative throttle rate '{}'".format(rate))
+    return requests, period
+
+
+class SlidingWindowLimiter(object):
+    """
+    At most limit hits per key in any period seconds. The sliding window
+    count is estimated from the counts of the current and the previous fixed
+    window, the previous one weighted by the share of it still inside the
+    sliding window, so a key costs two counters whatever the limit.
+
+    Counts are kept in a bounded process local LRU, or in the cache_alias
+    Django cache when set. Rejected keys are then remembered locally until
+    they may retry, so a flood doesn't reach the shared cache.
+    """
+    key_prefix = 'throttle:'
+
+    def __init__(self, name, limit, period, max_keys, cache_alias=None):
+        self.name = name
+        self.limit = limit
+        self.period = period
+        self.max_keys = max_keys
+        self.cache_alias = cache_alias
+        # key -> [window, count, previous window's count] or retry time
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def shared(self):
+        return caches[self.cache_alias] if self.cache_alias else None
+
+    def hit(self, key, now=None):
+        """
+        Count a hit for key unless it is over the limit. Returns 0 when the
+        hit is allowed, otherwise the seconds until it would be.
+        """
+        now = time.time() if now is None else now
+        window, elapsed = divmod(now, self.period)
+        window = int(window)
+        if self.shared is not None:
+            return self._hit_shared(key, now, window, elapsed)
+
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None or entry[0] < window - 1:
+                entry = [window, 0, 0]
+            elif entry[0] == window - 1:
+                entry = [window, 0, entry[1]]
+            self._store(key, entry)
+            wait = self.wait(entry[1], entry[2], elapsed)
+            if not wait:
+                entry[1] += 1
+        return wait
+
+    def _hit_shared(self, key, now, window, elapsed):
+        with self._lock:
+            retry_at = self._entries.get(key)
+            if retry_at is not None:
+                if retry_at > now:
+                    return retry_at - now
+                del self._entries[key]
+
+        keys = [self.cache_key(key, window), self.cache_key(key, window - 1)]
+        counts = self.shared.get_many(keys)
+        wait = self.wait(counts.get(keys[0], 0), counts.get(keys[1], 0), elapsed)
+        if wait:
+            with self._lock:
+                self._store(key, now + wait)
+            return wait
+        # Kept for the next window too, where it is the previous one
+        if not self.shared.add(keys[0], 1, 2 * self.period):
+            try:
+                self.shared.incr(keys[0])
+            except ValueError:
+                # Expired between add() and incr()
+                self.shared.set(keys[0], 1, 2 * self.period)
+        return 0
+
+    def _store(self, key, value):
+        self._entries[key] = value
+        while len(self._entries) > self.max_keys:
+            self._entries.popitem(last=False)
+
+    def cache_key(self, key, window):
+        return '{}{}:{}:{}'.format(self.key_prefix, self.name, key, window)
+
+    def wait(self, count, previous, elapsed):
+        """
+        0 when one more hit fits with count hits in the current window,
+        previous in the previous one and elapsed seconds into the current
+        one, otherwise the seconds until it fits
+        """
+        remaining = self.period - elapsed
+        if self.limit < 1:
+            # Nothing ever fits, retry in the next window
+            return remaining
+        if previous * remaining / self.period + count + 1 <= self.limit:
+            return 0
+        if count + 1 <= self.limit:
+            # Once enough of the previous window has slid out
+            return max(remaining - (self.limit - 1 - count) * float(self.period) / previous, 0.001)
+        # Into the next window, where count is the previous window's count
+        return remaining + self.period * (1 - float(self.limit - 1) / count)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(scope):
+    """
+    The limiter of scope as configured in settings.THROTTLES, None when the
+    scope has no rate
+    """
+    conf = dict(DEFAULTS, **getattr(settings, 'THROTTLES', {}))
+    rate = conf['RATES'].get(scope)
+    if not rate:
+        return None
+    config = (scope, rate, conf['MAX_KEYS'], conf['CACHE_ALIAS'])
+    with _limiters_lock:
+        if config not in _limiters:
+            limit, period = parse_rate(rate)
+            _limiters[config] = SlidingWindowLimiter(scope, limit, period, conf['MAX_KEYS'], conf['CACHE_ALIAS'])
+        return _limiters[config]
+
+
+def reset():
+    """
+    Forget every count
+    """
+    with _limiters_lock:
+        _limiters.clear()
+
+
+class LimiterThrottle(BaseThrottle):
+    """
+    Counts a hit on the scope's limiter for each key of get_keys() and
+    rejects the request when any of them is over the limit
+    """
+    scope = None
+
+    def get_keys(self, request, view):
+        return ['ip:' + self.get_ident(request)]
+
+    def allow_request(self, request, view):
+        limiter = get_limiter(self.scope)
+        if limiter is None:
+            return True
+        self.waits = [limiter.hit(key) for key in self.get_keys(request, view)]
+        return not any(self.waits)
+
+    def wait(self):
+        return max(self.waits)
+
+
+class LoginThrottle(LimiterThrottle):
+    """
+    Login attempts per IP and per email
+    """
+    scope = 'login'
+
+    def get_keys(self, request, view):
+        keys = super(LoginThrottle, self).get_keys(request, view)
+        email = getattr(request.data, 'get', lambda name: None)('email')
+        if email and isinstance(email, str):
+            keys.append('email:' + email.lower())
+        return keys
+
+
+class SignupThrottle(LimiterThrottle):
+    scope = 'signup'
+
+
+class WriteThrottle(LimiterThrottle):
+    """
+    Writes per IP, reads aren't counted
+    """
+    scope = 'write'
+
+    def allow_request(self, request, view):
+        if request.method in ('GET', 'HEAD', 'OPTIONS'):
+            return True
+        return super(WriteThrottle, self).allow_request(request, view)
+
+
+class EarlyThrottleMixin(object):
+    """
+    Checks the view's throttles first thing, before authentication,
+    permissions and the handler
+    """
+    def initial(self, request, *args, **kwargs):
+        super(EarlyThrottleMixin, self).check_throttles(request)
+        super(EarlyThrottleMixin, self).initial(request, *args, **kwargs)
+
+    def check_throttles(self, request):
+        # Already checked by initial()
+        pass
@@ -0,0 +1,119 @@
+"""
+Profile picture thumbnails, generated off the request thread.
+
+ProfilePictureView stores the upload as is and queues generate() as a job, see
+assist_co_server/jobs.py, where Pillow decodes and resizes it. Thumbnails are square crops stored
+next to the original as <name>_<size>.<ext>, WebP when Pillow was built with
+it and JPEG otherwise. The format is saved in the user's thumbnail_format once
+every size is written; until then the serializers return no thumbnails.
+
+Configured with settings.PROFILE_THUMBNAILS:
+
+    PROFILE_THUMBNAILS = {
+        'SIZES': (64, 128, 256),
+        'QUALITY': 85,
+    }
+"""
+import io
+import os
+from collections import OrderedDict
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from assist_co_server import jobs, response_cache
+
+DEFAULTS = {
+    'SIZES': (64, 128, 256),
+    'QUALITY': 85,
+}
+
+EXTENSIONS = {'webp': 'webp', 'jpeg': 'jpg'}
+
+
+def get_setting(name):
+    return dict(DEFAULTS, **getattr(settings, 'PROFILE_THUMBNAILS', {}))[name]
+
+
+def output_format():
+    """
+    webp if this Pillow can encode it, jpeg otherwise
+    """
+    Image.init()
+    return 'webp' if 'WEBP' in Image.SAVE else 'jpeg'
+
+
+def thumbnail_name(name, size, fmt):
+    root, ext = os.path.splitext(name)
+    return '{}_{}.{}'.format(root, size, EXTENSIONS[fmt])
+
+
+def thumbnail_urls(name, fmt):
+    """
+    Size -> url of the thumbnails of the picture name, None while they are
+    being generated
+    """
+    if not name or not fmt:
+        return None
+    return OrderedDict(
+        (str(size), default_storage.url(thumbnail_name(name, size, fmt))) for size in get_setting('SIZES'))
+
+
+def render(image, size, fmt, quality):
+    thumbnail = ImageOps.fit(image, (size, size), Image.LANCZOS)
+    out = io.BytesIO()
+    if fmt == 'jpeg':
+        thumbnail.save(out, 'JPEG', quality=quality, optimize=True, progressive=True)
+    else:
+        thumbnail.save(out, 'WEBP', quality=quality)
+    return out.getvalue()
+
+
+def delete(name):
+    """
+    Delete a picture and every thumbnail it may have
+    """
+    names = [name] + [thumbnail_name(name, size, fmt) for size in get_setting('SIZES') for fmt in EXTENSIONS]
+    for path in names:
+        default_storage.delete(path)
+
+
+def generate(model, pk, name, previous=None):
+    """
+    Write the thumbnails of the picture name of the model instance pk and mark
+    them ready, unless another picture was uploaded meanwhile. previous is the
+    picture it replaced, deleted with its thumbnails.
+    """
+    if previous and previous != name:
+        delete(previous)
+    fmt = output_format()
+    sizes = sorted(get_setting('SIZES'))
+    with default_storage.open(name) as f:
+        image = Image.open(f)
+        # JPEGs can be decoded straight at a fraction of their size
+        image.draft('RGB', (sizes[-1], sizes[-1]))
+        image = image.convert('RGB')
+    for size in sizes:
+        data = render(image, size, fmt, get_setting('QUALITY'))
+        path = thumbnail_name(name, size, fmt)
+        # save() would pick another name for an existing file
+        default_storage.delete(path)
+        default_storage.save(path, ContentFile(data))
+    model.objects.filter(pk=pk, profile_pic=name).update(thumbnail_format=fmt, updated_on=timezone.now())
+    response_cache.bump_user(model, pk)
+
+
+@jobs.register
+def generate_thumbnails(model_label, pk, name, previous=None):
+    generate(apps.get_model(model_label), pk, name, previous)
+
+
+def submit(model, pk, name, previous=None):
+    """
+    Generate the thumbnails of the picture name in the background
+    """
+    jobs.enqueue(generate_thumbnails, model._meta.label, pk, name, previous)
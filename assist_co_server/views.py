@@ -1,31 +1,66 @@
+import os
+from collections import OrderedDict
+
 from django.utils import timezone
 
 from django.contrib.auth import login, logout
 from django.contrib.auth.models import User
-from django.http import Http404
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, transaction
+from django.http import Http404, HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
 
 from rest_framework.authtoken import views as rest_views
-from rest_framework import viewsets, generics, mixins, views, status
+from rest_framework import viewsets, generics, mixins, views, status, serializers as drf_serializers
 from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import APIException, ValidationError
+from rest_framework.pagination import _positive_int
+from rest_framework.parsers import FormParser, MultiPartParser
 from rest_framework.views import APIView
 from rest_framework.response import Response
 
-from assist_co_server import serializers, paginators
-from assist_co_server.models import Client, Gender, TaskType, Profession, Task, Assistant, Contact
+from assist_co_server import serializers, paginators, filters, options, etags, exports, assignment, jobs, metrics, \
+    response_cache, search, sync, task_counts, thumbnails, throttling
+from assist_co_server.authentication import token_cache, update_last_login
+from assist_co_server.models import Client, Gender, TaskType, Profession, Task, Assistant, Contact, upload_to, \
+    InvalidTransition, TransitionConflict
+
+
+class Conflict(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'Conflict'
 
-class LoginView(rest_views.ObtainAuthToken):
+
+def transition_task(tasks, task_id, state, expected=None, assistant_id=None):
+    """
+    TaskQuerySet.transition with its errors raised as API errors: 400 for a
+    transition that isn't allowed and 409 with the task's current state when
+    it is in another state
+    """
+    try:
+        return tasks.transition(task_id, state, expected, assistant_id)
+    except InvalidTransition as e:
+        raise ValidationError({'state': [str(e)]})
+    except TransitionConflict as e:
+        raise Conflict({'detail': str(e), 'state': e.state})
+    except Task.DoesNotExist:
+        raise Http404
+
+class LoginView(throttling.EarlyThrottleMixin, rest_views.ObtainAuthToken):
     """
     POST
     Log user in by returning their token
     """
+    throttle_classes = (throttling.LoginThrottle,)
+
     def post(self, request, *args, **kwargs):
         serializer = serializers.LoginSerializer(data=request.data)
         if serializer.is_valid():
             user = serializer.validated_data['user']
             token, created = Token.objects.get_or_create(user=user)
-            user.last_login = timezone.now()
-            user.save()
+            jobs.enqueue(update_last_login, user.pk, timezone.now())
             return Response({'token': token.key})
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -41,74 +76,159 @@ class LogoutView(APIView):
         return Response({'success': True})
 
 
-class ClientSignupView(APIView):
+class ClientSignupView(throttling.EarlyThrottleMixin, APIView):
     """
     POST
     Sign the client up and return a valid token for authenticating to server
     """
+    throttle_classes = (throttling.SignupThrottle,)
+
     def post(self, request, *args, **kwargs):
         serializer = serializers.ClientSerializer(data=request.data)
         if serializer.is_valid():
             data = serializer.validated_data
-            client = Client.objects.create(
-                username=data['email'],
-                email=data['email'],
-                password=data['password'],
-                first_name=data['first_name'],
-                last_name=data['last_name'],
-                phone=data['phone'],
-                profession=data['profession'],
-                gender=data['gender'],
-                date_of_birth=data['date_of_birth']
-            )
-            token = client.get_or_create_token()
+            try:
+                # The unique email and phone indexes settle concurrent signups
+                with transaction.atomic():
+                    client = Client.objects.create_user(
+                        data['email'],
+                        data['email'],
+                        data['password'],
+                        first_name=data['first_name'],
+                        last_name=data['last_name'],
+                        phone=data['phone'],
+                        profession=data['profession'],
+                        gender=data['gender'],
+                        date_of_birth=data['date_of_birth']
+                    )
+                    token = Token.objects.create(user_id=client.pk)
+            except IntegrityError:
+                serializer.check_identities(data['email'], data['phone'])
+                raise
             return Response({'token': token.key, 'client_id': client.id}, status=status.HTTP_200_OK)
         else:
             return Response(serializer._errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+@method_decorator(condition(etag_func=etags.option_etag(options.genders)), name='get')
 class GendersView(generics.ListAPIView):
     """
     GET
     Get all the gender options in db
     """
-    queryset = Gender.objects.all()
     serializer_class = serializers.GenderSerializer
     pagination_class = paginators.StandardResultsSetPagination
 
+    def get_queryset(self):
+        return options.genders.all()
+
 
+@method_decorator(condition(etag_func=etags.option_etag(options.task_types)), name='get')
 class TaskTypesView(generics.ListAPIView):
     """
     GET
     Get all the task type options in db
     """
-    queryset = TaskType.objects.all()
     serializer_class = serializers.TaskTypeSerializer
     pagination_class = paginators.StandardResultsSetPagination
 
+    def get_queryset(self):
+        return options.task_types.all()
+
 
+@method_decorator(condition(etag_func=etags.option_etag(options.professions)), name='get')
 class ProfessionsView(generics.ListAPIView):
     """
     GET
     Get all the Profession options
     """
-    queryset = Profession.objects.all()
     serializer_class = serializers.ProfessionSerializer
     pagination_class = paginators.StandardResultsSetPagination
 
+    def get_queryset(self):
+        return options.professions.all()
+
+
+class TaskListMixin(object):
+    """
+    Filtering (see filters.TaskFilterBackend), ?ordering= and ?fields= for
+    the task lists. Only the relations of the requested fields are loaded.
+    """
+    serializer_class = serializers.TaskSerializer
+    pagination_class = paginators.StandardOrKeysetPagination
+    filter_backends = (filters.TaskFilterBackend, filters.TaskOrderingFilter)
 
-class TasksView(generics.ListAPIView,
+    def get_tasks(self):
+        return Task.objects.with_related(serializers.TaskSerializer.requested_fields(self.request))
+
+class TasksView(throttling.EarlyThrottleMixin,
+                TaskListMixin,
+                generics.ListAPIView,
                 generics.CreateAPIView):
     """
     GET, POST
     Get all the tasks in db including archived tasks
     """
-    queryset = Task.objects.all()
-    serializer_class = serializers.TaskSerializer
-    pagination_class = paginators.StandardResultsSetPagination
+    def get_queryset(self):
+        return self.get_tasks()
+
+
+class TasksExportView(APIView):
+    """
+    GET
+    Stream every task, filtered like TasksView, as NDJSON (?format=ndjson,
+    the default) or CSV (?format=csv). Takes ?fields= like the task lists.
+    """
+    renderer_classes = (exports.NDJSONRenderer, exports.CSVRenderer)
+    chunk_size = 1000
+
+    def get(self, request, *args, **kwargs):
+        layout = exports.Layout(serializers.TaskSerializer(context={'request': request}))
+        tasks = filters.TaskFilterBackend().filter_queryset(request, Task.objects.all(), self)
+        rows = exports.task_rows(tasks, layout, self.chunk_size)
+        if request.accepted_renderer.format == 'csv':
+            response = StreamingHttpResponse(exports.csv_lines(rows, layout), content_type='text/csv; charset=utf-8')
+            response['Content-Disposition'] = 'attachment; filename="tasks.csv"'
+        else:
+            response = StreamingHttpResponse(exports.ndjson_lines(rows), content_type='application/x-ndjson')
+        return response
 
+class TasksBatchView(throttling.EarlyThrottleMixin, APIView):
+    """
+    POST
+    Create many tasks at once. Takes a list of task json objects and returns
+    a result per item, either the created task id or its validation errors.
+    Valid items are created even when others fail.
+    """
+    max_batch_size = 1000
 
-class AssistantsView(generics.ListAPIView,
+    def post(self, request, *args, **kwargs):
+        items = request.data
+        if not isinstance(items, list):
+            return Response("Must pass a list of tasks", status=status.HTTP_400_BAD_REQUEST)
+        if len(items) > self.max_batch_size:
+            return Response("Can't create more than {} tasks at once".format(self.max_batch_size),
+                status=status.HTTP_400_BAD_REQUEST)
+
+        serializer = serializers.TaskSerializer(many=True, context={'request': request})
+        results = [None] * len(items)
+        valid = []
+        for index, item in enumerate(items):
+            try:
+                valid.append((index, serializer.child.run_validation(item)))
+            except ValidationError as exc:
+                results[index] = {'index': index, 'errors': exc.detail}
+
+        tasks = serializer.create([attrs for index, attrs in valid])
+        for (index, attrs), task in zip(valid, tasks):
+            results[index] = {'index': index, 'id': task.id}
+
+        response_status = status.HTTP_201_CREATED if tasks else status.HTTP_400_BAD_REQUEST
+        return Response({'results': results}, status=response_status)
+
+
+class AssistantsView(throttling.EarlyThrottleMixin,
+                    generics.ListAPIView,
                     generics.CreateAPIView):
 
     """
@@ -117,10 +237,11 @@ class AssistantsView(generics.ListAPIView,
     """
     serializer_class = serializers.AssistantSerializer
     pagination_class = paginators.StandardResultsSetPagination
-    queryset = Assistant.objects.all()
+    queryset = Assistant.objects.with_related()
 
 
-class AssistantDetailView(generics.RetrieveUpdateAPIView):
+@method_decorator(condition(etag_func=etags.assistant_etag), name='get')
+class AssistantDetailView(throttling.EarlyThrottleMixin, generics.RetrieveUpdateAPIView):
     """
     GET, PATCH, DELETE
     Get, update, or delete specified assistant
@@ -128,7 +249,7 @@ class AssistantDetailView(generics.RetrieveUpdateAPIView):
     serializer_class = serializers.AssistantSerializer
 
     def get_object(self):
-        assistant = get_object_or_404(Assistant, id=self.kwargs['id'])
+        assistant = get_object_or_404(Assistant.objects.with_related(), id=self.kwargs['id'])
         return assistant
 
     def partial_update(self, request, *args, **kwargs):
@@ -144,14 +265,41 @@ class AssistantDetailView(generics.RetrieveUpdateAPIView):
         else:
             return Response(serializer._errors, status=status.HTTP_400_BAD_REQUEST)
 
-class ContactsView(generics.CreateAPIView):
+class AssistantQueueView(TaskListMixin, generics.ListAPIView):
+    """
+    GET
+    The assistant's open tasks, executing then ready and oldest first,
+    with the number of their tasks in each state in counts. The counts are
+    read from the assistant_task_counts table, see task_counts.py, and give
+    the page count too, so the queue is never counted. Takes ?fields= but
+    none of the task list filters.
+    """
+    pagination_class = paginators.CountedPagination
+    filter_backends = ()
+
+    def get_queryset(self):
+        return (self.get_tasks()
+            .filter(assistant_id=self.kwargs['id'], state__in=assignment.OPEN_STATES, is_archived=False)
+            .order_by('state', 'created_on', 'id'))
+
+    def get_count(self):
+        return sum(self.counts[state] for state in assignment.OPEN_STATES)
+
+    def list(self, request, *args, **kwargs):
+        get_object_or_404(Assistant.objects.only('id'), id=self.kwargs['id'])
+        self.counts = task_counts.counts(self.kwargs['id'])
+        response = super(AssistantQueueView, self).list(request, *args, **kwargs)
+        response.data['counts'] = self.counts
+        return response
+
+class ContactsView(throttling.EarlyThrottleMixin, generics.CreateAPIView):
     """
     POST
     Create Contact
     """
     serializer_class = serializers.ContactSerializer
 
-class ContactDetailView(generics.RetrieveUpdateDestroyAPIView):
+class ContactDetailView(throttling.EarlyThrottleMixin, generics.RetrieveUpdateDestroyAPIView):
     """
     GET, PATCH/UPDATE, DELETE
     Contact
@@ -161,7 +309,7 @@ class ContactDetailView(generics.RetrieveUpdateDestroyAPIView):
         contact = get_object_or_404(Contact, id=self.kwargs['id'])
         return contact
  
-class TaskContactsView(APIView):
+class TaskContactsView(throttling.EarlyThrottleMixin, APIView):
     """
     POST
     Add Contacts to task
@@ -175,29 +323,40 @@ class TaskContactsView(APIView):
         """
         # get the task for this request
         task = get_object_or_404(Task, id=self.kwargs['id'], is_archived=False)
-        contact_objs = []
-        contacts = request.data['contacts']
-        curr_task_contacts = task.contacts
-        # check if we have array of objects or ids
-        if type(contacts[0]) is dict:
-            # We have Contact json objects
-            # Create Contact objects if it doesn't already exist
-            for contact_attrs in contacts:
-                contact = Contact.get_or_create_by_attrs(contact_attrs)
-                if curr_task_contacts.filter(id=contact.id).count() == 0:
-                    contact_objs.append(contact)
-        else:
-            # we have contact ids
-            contacts_set = Contact.objects.filter(pk__in=contacts)
-            if len(contacts) != contacts_set.count():
-                return Response("Contact does not exist for one or more IDs provided", status=status.HTTP_400_BAD_REQUEST)
-            for contact in contacts_set:
-                if curr_task_contacts.filter(id=contact.id).count() == 0:
-                    contact_objs.append(contact)
-
-        if len(contact_objs) > 0:
-            task.contacts.add(*contact_objs)
-            task.save()
+        contacts = request.data.get('contacts')
+        if not isinstance(contacts, list):
+            return Response("Must include a list of contacts", status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            with transaction.atomic():
+                # check if we have array of objects or ids, a mix is rejected by either
+                if any(isinstance(contact, dict) for contact in contacts):
+                    # We have Contact json objects, created under the task's client
+                    serializer = serializers.ContactSerializer(data=contacts, many=True)
+                    serializer.child.fields.pop('client_id')
+                    if not serializer.is_valid():
+                        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+                    # Create the Contact objects that don't already exist
+                    contact_ids = [c.id for c in Contact.bulk_get_or_create(task.client_id, serializer.validated_data)]
+                else:
+                    # we have contact ids, of contacts of the task's client
+                    try:
+                        contact_ids = set(drf_serializers.ListField(child=drf_serializers.IntegerField())
+                            .run_validation(contacts))
+                    except ValidationError:
+                        return Response("Contact ids must be integers", status=status.HTTP_400_BAD_REQUEST)
+                    if len(contact_ids) != Contact.objects.filter(pk__in=contact_ids, client_id=task.client_id).count():
+                        return Response("Contact does not exist for one or more IDs provided", status=status.HTTP_400_BAD_REQUEST)
+
+                if contact_ids:
+                    # add() skips contacts already on the task in a single query
+                    task.contacts.add(*contact_ids)
+                    Task.objects.filter(id=task.id).update(updated_on=timezone.now())
+        except IntegrityError:
+            # A contact with one of the emails was created by a concurrent request
+            return Response("One or more contacts were created meanwhile, please retry",
+                status=status.HTTP_400_BAD_REQUEST)
+        task = Task.objects.with_related().get(id=task.id)
         return Response(serializers.TaskSerializer(task).data)
 
     def get(self, request, *args, **kwargs):
@@ -213,18 +372,19 @@ class ClientsView(generics.ListAPIView):
     GET
     Get all the clients in db
     """
-    queryset = Client.objects.all()
+    queryset = Client.objects.with_related()
     serializer_class = serializers.ClientSerializer
-    pagination_class = paginators.StandardResultsSetPagination
+    pagination_class = paginators.StandardOrKeysetPagination
 
-class ClientDetailView(generics.RetrieveUpdateDestroyAPIView):
+@method_decorator(condition(etag_func=etags.client_etag), name='get')
+class ClientDetailView(throttling.EarlyThrottleMixin, generics.RetrieveUpdateDestroyAPIView):
     """
     GET, PATCH, DELETE
     Get, Patch, DELETE(set to inactive) specific user in db
     """
     serializer_class = serializers.ClientSerializer
     def get_object(self):
-        client = get_object_or_404(Client, id=self.kwargs['id'], is_active=True)
+        client = get_object_or_404(Client.objects.with_related(), id=self.kwargs['id'], is_active=True)
         return client
 
     def partial_update(self, request, *args, **kwargs):
@@ -250,19 +410,74 @@ class ClientDetailView(generics.RetrieveUpdateDestroyAPIView):
         client.save()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
-class ClientTasksView(generics.ListAPIView):
+class ClientTasksView(TaskListMixin, generics.ListAPIView):
     """
     GET
-    List or Create a Task for a specific user
+    List or Create a Task for a specific user. Pages are served from the
+    response cache until the client's tasks change, see response_cache.py.
     """
-    serializer_class = serializers.TaskSerializer
-    pagination_class = paginators.StandardResultsSetPagination
-
     def get_queryset(self):
         # Return all the tasks that belong to the client
-        return Task.objects.filter(client_id=self.kwargs['id'], is_archived=False)
+        return self.get_tasks().filter(client_id=self.kwargs['id'], is_archived=False)
+
+    def list(self, request, *args, **kwargs):
+        return response_cache.cached_response(self, request, self.kwargs['id'],
+            lambda: super(ClientTasksView, self).list(request, *args, **kwargs))
 
-class ClientTaskDetailView(generics.RetrieveUpdateDestroyAPIView):
+class ClientSearchView(generics.GenericAPIView):
+    """
+    GET
+    Search the client's tasks by text and by contact name, email and phone
+    with ?q=, best matches first. Takes ?fields= like the task lists.
+    """
+    serializer_class = serializers.TaskSerializer
+    pagination_class = paginators.RankedPagination
+
+    def get(self, request, *args, **kwargs):
+        query = request.query_params.get('q', '')
+        if not search.words(query):
+            return Response("Must include a search query", status=status.HTTP_400_BAD_REQUEST)
+        task_ids = self.paginate_queryset(search.Results(self.kwargs['id'], query))
+        tasks = (Task.objects.with_related(serializers.TaskSerializer.requested_fields(request))
+            .filter(client_id=self.kwargs['id'], is_archived=False)
+            .in_bulk(task_ids))
+        page = [tasks[task_id] for task_id in task_ids if task_id in tasks]
+        return self.get_paginated_response(self.get_serializer(page, many=True).data)
+
+class ClientChangesView(APIView):
+    """
+    GET
+    The client's tasks and contacts created, updated, archived or deleted
+    since ?since=<watermark>, omit it for a full sync. Call again with the
+    returned watermark while has_more is true. Takes ?fields= for tasks and
+    ?page_size= rows per table.
+    """
+    def get(self, request, *args, **kwargs):
+        try:
+            watermark = sync.Watermark.decode(request.query_params.get('since'))
+        except ValueError:
+            return Response("Invalid watermark", status=status.HTTP_400_BAD_REQUEST)
+        try:
+            page_size = _positive_int(request.query_params['page_size'], strict=True,
+                cutoff=sync.get_setting('MAX_PAGE_SIZE'))
+        except (KeyError, ValueError):
+            page_size = sync.get_setting('PAGE_SIZE')
+
+        task_fields = serializers.TaskSerializer.requested_fields(request)
+        changes = sync.changes(self.kwargs['id'], watermark, page_size, task_fields)
+        return Response(OrderedDict([
+            ('tasks', serializers.TaskSerializer(changes.tasks, many=True, context={'request': request}).data),
+            ('contacts', serializers.ContactSerializer(changes.contacts, many=True).data),
+            ('deleted', OrderedDict([
+                ('tasks', changes.deleted_tasks),
+                ('contacts', changes.deleted_contacts),
+            ])),
+            ('watermark', changes.watermark.encode()),
+            ('has_more', changes.has_more),
+        ]))
+
+@method_decorator(condition(etag_func=etags.client_task_etag), name='get')
+class ClientTaskDetailView(throttling.EarlyThrottleMixin, generics.RetrieveUpdateDestroyAPIView):
     """
     GET, PATCH, DELETE
     Get, update, or delete specified task owned by specific client
@@ -270,22 +485,33 @@ class ClientTaskDetailView(generics.RetrieveUpdateDestroyAPIView):
     serializer_class = serializers.TaskSerializer
 
     def get_object(self):
-        task = get_object_or_404(Task, client_id=self.kwargs['client_id'],
+        task = get_object_or_404(Task.objects.with_related(), client_id=self.kwargs['client_id'],
             id=self.kwargs['id'], is_archived=False)
         return task
 
+    def get_tasks(self):
+        return Task.objects.with_related().filter(client_id=self.kwargs['client_id'], is_archived=False)
+
     def partial_update(self, request, *args, **kwargs):
         """
         PATCH
-        Update some or all of the fields for the task
+        Update some or all of the fields for the task. A new state goes
+        through the same transition as /transition.
         """
         task = self.get_object()
         serializer = serializers.TaskSerializer(task, data=request.data, partial=True)
-        if serializer.is_valid():
-            serializer.save()
-            return Response(serializer.data)
-        else:
+        if not serializer.is_valid():
             return Response(serializer._errors, status=status.HTTP_400_BAD_REQUEST)
+        with transaction.atomic():
+            if 'state' in request.data:
+                transition = serializers.TaskTransitionSerializer(data={'state': request.data['state']})
+                transition.is_valid(raise_exception=True)
+                if transition.validated_data['state'] != task.state:
+                    serializer.instance = transition_task(self.get_tasks(), task.id,
+                        transition.validated_data['state'])
+            if serializer.validated_data:
+                serializer.save()
+        return Response(serializer.data)
 
     def destroy(self, request, *args, **kwargs):
         """
@@ -296,3 +522,75 @@ class ClientTaskDetailView(generics.RetrieveUpdateDestroyAPIView):
         task.is_archived = True
         task.save()
         return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class ClientTaskTransitionView(throttling.EarlyThrottleMixin, APIView):
+    """
+    POST
+    Move the task to another state, e.g. {"state": "executing",
+    "expected_state": "ready", "assistant_id": 3} for an assistant taking a
+    ready task. Without expected_state the task may be in any state that can
+    go to state. Responds with the task, or 409 with the task's current state
+    when it isn't in a state the transition starts from, so of two assistants
+    taking the same task only one succeeds.
+    """
+    def post(self, request, *args, **kwargs):
+        serializer = serializers.TaskTransitionSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        data = serializer.validated_data
+        assistant = data.get('assistant_id')
+        tasks = Task.objects.with_related().filter(client_id=self.kwargs['client_id'], is_archived=False)
+        task = transition_task(tasks, self.kwargs['id'], data['state'], data.get('expected_state'),
+            assistant.id if assistant is not None else None)
+        return Response(serializers.TaskSerializer(task, context={'request': request}).data)
+
+
+class ProfilePictureView(throttling.EarlyThrottleMixin, APIView):
+    """
+    POST
+    Upload a profile picture as the multipart field profile_pic. The file is
+    stored as is and the thumbnails are generated in the background, they
+    show up in profile_pic_thumbnails once ready. Responds 202 with the user.
+    """
+    parser_classes = (MultiPartParser, FormParser)
+    model = None
+    serializer_class = None
+    max_upload_bytes = 10 * 1024 * 1024
+
+    def post(self, request, *args, **kwargs):
+        user = get_object_or_404(self.model.objects.with_related(), id=self.kwargs['id'], is_active=True)
+        upload = request.data.get('profile_pic')
+        if not hasattr(upload, 'content_type'):
+            return Response("Must include a profile_pic file", status=status.HTTP_400_BAD_REQUEST)
+        if upload.size > self.max_upload_bytes:
+            return Response("Profile pictures can't be larger than {} MB".format(self.max_upload_bytes // (1024 * 1024)),
+                status=status.HTTP_400_BAD_REQUEST)
+        if not (upload.content_type or '').startswith('image/'):
+            return Response("profile_pic must be an image", status=status.HTTP_400_BAD_REQUEST)
+
+        # Decoding is left to the thumbnail workers
+        previous = user.profile_pic.name
+        name = default_storage.save(upload_to(user, os.path.basename(upload.name)), upload)
+        user.profile_pic = name
+        user.thumbnail_format = ''
+        user.updated_on = timezone.now()
+        self.model.objects.filter(pk=user.pk).update(
+            profile_pic=name, thumbnail_format='', updated_on=user.updated_on)
+        response_cache.bump_user(self.model, user.pk)
+        thumbnails.submit(self.model, user.pk, name, previous)
+        return Response(self.serializer_class(user, context={'request': request}).data,
+            status=status.HTTP_202_ACCEPTED)
+
+class MetricsView(APIView):
+    """
+    GET
+    Request metrics recorded by PerformanceMiddleware in the Prometheus text format
+    """
+    def get(self, request, *args, **kwargs):
+        token_stats = token_cache.stats()
+        body = metrics.registry.render(extra_counters=(
+            ('token_cache_hits_total', 'Token authentication cache hits', token_stats['hits']),
+            ('token_cache_misses_total', 'Token authentication cache misses', token_stats['misses']),
+        ))
+        return HttpResponse(body, content_type='text/plain; version=0.0.4; charset=utf-8')
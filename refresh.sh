@@ -1,4 +1,4 @@
-rm db.sqlite3
+rm -f db.sqlite3 db.sqlite3-wal db.sqlite3-shm
 python manage.py migrate
 python manage.py loaddata seed.json
 python manage.py runserver